@@ -0,0 +1,72 @@
+"""Benchmark reading .psz archives
+
+Writes a synthetic photon stream as a 32 bit .dat file and as a
+.psz archive and compares the time for loading both files with
+:func:`pyscanfcs.openfile.openDAT` and
+:func:`pyscanfcs.archive.openPSZ` (compiled and NumPy varint
+decoder). The throughput is given with respect to the size of the
+.dat file, i.e. it can be compared directly to the transfer rate of
+the storage the .dat files are read from.
+
+Usage: python benchmark_archive.py [number of events in millions]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pyscanfcs import archive, openfile
+
+
+def make_stream(n_events, mean_interval=300, seed=42):
+    """Synthetic photon stream with exponentially distributed intervals"""
+    rs = np.random.RandomState(seed)
+    data = rs.exponential(mean_interval, size=n_events) + 1
+    return data.astype(np.uint32)
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def benchmark(data, tmpdir):
+    datpath = os.path.join(tmpdir, "stream.dat")
+    with open(datpath, "wb") as fd:
+        fd.write(bytes([32, 60]))
+        data.astype("<u4").tofile(fd)
+    pszpath = archive.compress_dat(datpath)
+    datsize = os.path.getsize(datpath)
+    print("{:.1f}M events, .dat {:.1f} MB, .psz {:.1f} MB".format(
+        data.size / 1e6, datsize / 1e6, os.path.getsize(pszpath) / 1e6))
+    compiled = archive.decode_dat
+    methods = [("openDAT", openfile.openDAT, compiled),
+               ("psz", archive.openPSZ, compiled),
+               ("psz numpy", archive.openPSZ, None),
+               ]
+    for name, func, module in methods:
+        if name == "psz" and module is None:
+            print("  {:10s} not available".format(name))
+            continue
+        archive.decode_dat = module
+        try:
+            dt, info = timeit(func, datpath if func is openfile.openDAT
+                              else pszpath)
+        finally:
+            archive.decode_dat = compiled
+        print("  {:10s} {:8.4f}s {:8.1f} MB/s identical: {}".format(
+            name, dt, datsize / dt / 1e6,
+            np.array_equal(info["data_stream"], data)))
+
+
+if __name__ == "__main__":
+    n_million = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data = make_stream(int(n_million * 1e6))
+    with tempfile.TemporaryDirectory(prefix="pyscanfcs_bench_") as tmpdir:
+        benchmark(data, tmpdir)
@@ -0,0 +1,66 @@
+"""Benchmark binning of photon streams
+
+Compares the compiled binning kernel (:mod:`pyscanfcs.bin_pe`) to
+the NumPy fallback of :mod:`pyscanfcs.binning` and to parallel
+binning with all CPUs for a synthetic photon stream and checks that
+all methods give identical results.
+
+Usage: python benchmark_binning.py [number of events in millions]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from pyscanfcs import binning
+
+
+def make_stream(n_events, mean_interval=300, seed=42):
+    """Synthetic photon stream with exponentially distributed intervals"""
+    rs = np.random.RandomState(seed)
+    data = rs.exponential(mean_interval, size=n_events) + 1
+    return data.astype(np.uint32)
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def benchmark(data, t_bin):
+    print("{:.1f}M events, t_bin {}".format(data.size / 1e6, t_bin))
+    compiled = binning.bin_pe
+    methods = [("compiled", compiled, 1),
+               ("numpy", None, 1),
+               ("parallel", compiled, os.cpu_count()),
+               ]
+    results = {}
+    for name, module, workers in methods:
+        if module is None and name != "numpy":
+            print("  {:10s} not available".format(name))
+            continue
+        binning.bin_pe = module
+        try:
+            dt, results[name] = timeit(binning.bin_photon_array,
+                                       data, t_bin, workers=workers)
+        finally:
+            binning.bin_pe = compiled
+        print("  {:10s} {:8.4f}s {:8.1f} M events/s ({} threads)".format(
+            name, dt, data.size / dt / 1e6, workers))
+    ref = results.pop("compiled", None)
+    for name in results:
+        if ref is not None:
+            print("  {} identical: {}".format(
+                name, np.array_equal(ref, results[name])))
+
+
+if __name__ == "__main__":
+    n_million = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data = make_stream(int(n_million * 1e6))
+    for t_bin in [10.3, 1000.3]:
+        benchmark(data, t_bin)
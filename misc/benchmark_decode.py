@@ -0,0 +1,93 @@
+"""Benchmark decoding of 16 bit .dat files
+
+Compares the decoder of PyScanFCS (compiled, with NumPy fallback) to
+the NumPy implementation of PyScanFCS 0.3.6 for the files in
+`tests/data` and for large synthetic files.
+
+Usage: python benchmark_decode.py [number of events in millions]
+"""
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from pyscanfcs import openfile
+
+
+def legacy_open_dat16(path):
+    """16 bit decoder of PyScanFCS 0.3.6"""
+    filed = open(path, 'rb')
+    np.fromfile(filed, dtype="<u1", count=2)
+    data16 = np.fromfile(filed, dtype="<u2", count=-1)
+    occ = np.where(data16 == 65535)[0]
+    N = len(occ)
+    data = np.uint32(data16)
+    data[occ] = data[occ + 1] + data[occ + 2] * 65536
+    zeroids = np.zeros(N * 2, dtype=int)
+    zeroids[::2] = occ + 1
+    zeroids[1::2] = occ + 2
+    data = np.delete(data, zeroids)
+    filed.close()
+    return data
+
+
+def make_dat16(path, n_events, escape_fraction=0.01, seed=42):
+    """Write a synthetic 16 bit .dat file"""
+    rs = np.random.RandomState(seed)
+    data = rs.randint(1, 0xFFFF, size=n_events).astype(np.uint32)
+    esc = rs.random_sample(n_events) < escape_fraction
+    data[esc] = rs.randint(0x10000, 2**31, size=np.sum(esc))
+    nwords = 1 + 2 * esc
+    pos = np.cumsum(nwords) - nwords
+    words = np.zeros(np.sum(nwords), dtype="<u2")
+    words[pos[~esc]] = data[~esc]
+    words[pos[esc]] = 0xFFFF
+    words[pos[esc] + 1] = data[esc] & 0xFFFF
+    words[pos[esc] + 2] = data[esc] >> 16
+    with open(path, "wb") as fd:
+        fd.write(np.array([16, 60], dtype="<u1").tobytes())
+        words.tofile(fd)
+
+
+def timeit(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def benchmark(path):
+    size = os.path.getsize(path) / 1024**2
+    methods = [("legacy", legacy_open_dat16),
+               ("openDAT", lambda p: openfile.openDAT(p, workers=1)),
+               ("parallel", lambda p: openfile.openDAT(
+                   p, workers=os.cpu_count()))]
+    if openfile.decode_dat is not None:
+        def fallback(p):
+            decoder = openfile.decode_dat
+            openfile.decode_dat = None
+            try:
+                openfile.openDAT(p)
+            finally:
+                openfile.decode_dat = decoder
+        methods.insert(1, ("numpy", fallback))
+    print("{} ({:.1f} MiB)".format(path, size))
+    for name, func in methods:
+        dt = timeit(func, path)
+        print("  {:10s} {:8.4f}s {:8.1f} MiB/s".format(name, dt, size / dt))
+
+
+if __name__ == "__main__":
+    n_million = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    here = pathlib.Path(__file__).parent
+    for path in sorted((here.parent / "tests" / "data").glob("*16bit.dat")):
+        benchmark(str(path))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic_16bit.dat")
+        make_dat16(path, int(n_million * 1e6))
+        benchmark(path)
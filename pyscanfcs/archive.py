@@ -0,0 +1,376 @@
+"""Compressed archive format for photon streams (.psz)
+
+Most photon arrival time differences fit into one or two bytes, but
+the 32 bit .dat format uses four bytes for each of them. The .psz
+format stores the photon stream in blocks of variable-length
+integers (LEB128 varint, 7 bits per byte) that are compressed with
+zlib. A block index at the end of the file allows random access to
+the blocks and blocks can be decoded in parallel.
+
+File layout (all integers little endian):
+
+- magic bytes `MAGIC` (8 bytes)
+- header length (uint32) and JSON header with the keys
+  "version", "system_clock", "block_size" and "codec"
+- compressed blocks
+- block index: for each block the number of events (uint64),
+  the byte offset (uint64), the compressed size (uint64) and the
+  cumulative time before the first event (uint64)
+- number of blocks (uint64), byte offset of the block index (uint64),
+  total time (uint64) and the magic bytes `INDEX_MAGIC` (8 bytes)
+"""
+import concurrent.futures
+import json
+import zlib
+
+import numpy as np
+
+try:
+    from . import decode_dat
+except ImportError:
+    decode_dat = None
+
+
+MAGIC = b"PSCFCSZ\x01"
+INDEX_MAGIC = b"PSZINDEX"
+VERSION = 1
+
+
+class ArchiveWriter(object):
+    def __init__(self, path, system_clock, block_size=1048576, level=6):
+        """Write a photon stream to a .psz archive
+
+        Parameters
+        ----------
+        path : str
+            Output path
+        system_clock : int
+            System clock [MHz]
+        block_size : int
+            Number of events per block
+        level : int
+            zlib compression level (1: fastest, 9: smallest)
+
+        Notes
+        -----
+        Data can be written with :func:`ArchiveWriter.write` in pieces
+        of any size. The archive is only complete after
+        :func:`ArchiveWriter.close` was called. Use the writer as a
+        context manager to make sure this happens.
+        """
+        self.path = path
+        self.block_size = int(block_size)
+        self.level = level
+        self._fd = open(path, "wb")
+        header = json.dumps({"version": VERSION,
+                             "system_clock": system_clock,
+                             "block_size": self.block_size,
+                             "codec": "varint+zlib"}).encode("utf-8")
+        self._fd.write(MAGIC)
+        self._fd.write(np.uint32(len(header)).astype("<u4").tobytes())
+        self._fd.write(header)
+        self._buffer = np.zeros(0, dtype=np.uint32)
+        self._index = []
+        self._time = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_block(self, data):
+        payload = zlib.compress(varint_encode(data).tobytes(), self.level)
+        self._index.append((data.size, self._fd.tell(), len(payload),
+                            self._time))
+        self._fd.write(payload)
+        self._time += int(np.sum(data, dtype=np.uint64))
+
+    def write(self, data):
+        """Append photon arrival time differences (uint32)"""
+        data = np.asarray(data, dtype=np.uint32)
+        if self._buffer.size:
+            data = np.concatenate((self._buffer, data))
+        nfull = data.size - data.size % self.block_size
+        for ii in range(0, nfull, self.block_size):
+            self._write_block(data[ii:ii + self.block_size])
+        self._buffer = data[nfull:].copy()
+
+    def close(self):
+        """Write the remaining data and the block index"""
+        if self._fd.closed:
+            return
+        if self._buffer.size:
+            self._write_block(self._buffer)
+            self._buffer = np.zeros(0, dtype=np.uint32)
+        index_offset = self._fd.tell()
+        index = np.array(self._index, dtype=np.uint64).reshape(-1, 4)
+        self._fd.write(index.astype("<u8").tobytes())
+        self._fd.write(np.array([len(self._index), index_offset,
+                                 self._time], dtype="<u8").tobytes())
+        self._fd.write(INDEX_MAGIC)
+        self._fd.close()
+
+
+class ArchiveReader(object):
+    def __init__(self, path):
+        """Read a photon stream from a .psz archive
+
+        Parameters
+        ----------
+        path : str
+            Path to .psz file
+
+        Attributes
+        ----------
+        system_clock : int
+            System clock [MHz]
+        n_events : ndarray
+            Number of events for each block
+        times : ndarray
+            Cumulative time before the first event of each block
+        total_time : int
+            Total time of the measurement in system clock ticks
+        """
+        self.path = path
+        with open(path, "rb") as fd:
+            if fd.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a .psz archive: {}".format(path))
+            hlen = int(np.frombuffer(fd.read(4), dtype="<u4")[0])
+            self.header = json.loads(fd.read(hlen).decode("utf-8"))
+            fd.seek(-32, 2)
+            nblocks, index_offset, total_time = np.frombuffer(fd.read(24),
+                                                              dtype="<u8")
+            if fd.read(8) != INDEX_MAGIC:
+                raise ValueError("Incomplete .psz archive: {}".format(path))
+            fd.seek(int(index_offset))
+            index = np.frombuffer(fd.read(int(nblocks) * 32), dtype="<u8")
+        index = index.reshape(-1, 4).astype(np.uint64)
+        self.system_clock = self.header["system_clock"]
+        self.n_events = index[:, 0]
+        self.offsets = index[:, 1]
+        self.sizes = index[:, 2]
+        self.times = index[:, 3]
+        self.total_time = int(total_time)
+
+    def __len__(self):
+        """Number of photon events"""
+        return int(np.sum(self.n_events))
+
+    @property
+    def n_blocks(self):
+        return self.n_events.size
+
+    def read_block(self, index):
+        """Decode the `index`-th block"""
+        with open(self.path, "rb") as fd:
+            fd.seek(int(self.offsets[index]))
+            payload = fd.read(int(self.sizes[index]))
+        raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        return varint_decode(raw)
+
+    def iter_blocks(self):
+        """Iterate over the decoded blocks"""
+        for ii in range(self.n_blocks):
+            yield self.read_block(ii)
+
+    def read(self, workers=None):
+        """Decode the entire photon stream
+
+        Parameters
+        ----------
+        workers : int or None
+            Number of threads for decoding the blocks (zlib and most
+            NumPy operations release the GIL); defaults to the number
+            of CPUs.
+
+        Returns
+        -------
+        data : ndarray (uint32)
+            Photon arrival time differences
+        """
+        starts = np.zeros(self.n_blocks + 1, dtype=np.intp)
+        np.cumsum(self.n_events, out=starts[1:])
+        data = np.empty(starts[-1], dtype=np.uint32)
+
+        def decode(ii):
+            data[starts[ii]:starts[ii + 1]] = self.read_block(ii)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            list(pool.map(decode, range(self.n_blocks)))
+        return data
+
+    def read_window(self, t_start, t_stop):
+        """Decode the photon events within a time window
+
+        Decoding starts with the last block that begins before
+        `t_start` (see :attr:`ArchiveReader.times`) and stops with
+        the first block that reaches `t_stop`.
+
+        Parameters
+        ----------
+        t_start, t_stop : int
+            Time window [t_start, t_stop) in system clock ticks
+
+        Returns
+        -------
+        data : ndarray (uint32)
+            Photon arrival time differences; the first value is the
+            time difference between `t_start` and the first event.
+        """
+        from . import openfile
+
+        first = max(int(np.searchsorted(self.times, t_start)) - 1, 0)
+        blocks = (self.read_block(ii) for ii in range(first, self.n_blocks))
+        time = int(self.times[first]) if self.n_blocks else 0
+        return openfile._select_time_window(blocks, time, t_start, t_stop)
+
+
+def openPSZ(path, callback=None, workers=None, mmap=False, cache=None,
+            t_start=None, t_stop=None, time_unit="s", index=False,
+            salvage=False):
+    """Load a photon stream from a .psz archive
+
+    Parameters
+    ----------
+    path : str
+        Path to .psz file
+    callback : callable or None
+        Not used (for compatibility with the other readers)
+    workers : int or None
+        Number of threads for decoding, see :func:`ArchiveReader.read`
+    mmap, cache
+        Ignored (archives are always decoded)
+    t_start, t_stop, time_unit
+        Time window, see :func:`openfile.openDAT`; only the blocks
+        that overlap with the window are decoded (see
+        :func:`ArchiveReader.read_window`).
+    index : bool
+        Archives have no checkpoint index (their block index is used
+        for time windows); if True, "index" is set to None.
+    salvage : bool
+        Not supported for archives (ValueError)
+
+    Returns
+    -------
+    info: dict
+        Dictionary containing the "system_clock" in MHz and the
+        "data_stream" (photon arrival time event stream). For time
+        windows, "time_offset" is the start of the window in system
+        clock ticks.
+    """
+    from . import openfile
+
+    if salvage:
+        raise ValueError("Salvage not supported for .psz archives!")
+    arc = ArchiveReader(path)
+    info = {"system_clock": arc.system_clock}
+    if t_start is not None or t_stop is not None:
+        start, stop = openfile._window_ticks(t_start, t_stop, time_unit,
+                                             arc.system_clock)
+        info["data_stream"] = arc.read_window(start, stop)
+        info["time_offset"] = start
+    else:
+        info["data_stream"] = arc.read(workers=workers)
+    if index:
+        info["index"] = None
+    return info
+
+
+def compress_dat(path, outpath=None, block_size=1048576, level=6):
+    """Convert a .dat file to a .psz archive with bounded memory
+
+    Parameters
+    ----------
+    path : str
+        Path to a .dat file
+    outpath : str or None
+        Output path; defaults to `path` with the suffix ".psz"
+    block_size : int
+        Number of events per block
+    level : int
+        zlib compression level
+
+    Returns
+    -------
+    outpath : str
+        Path of the archive
+    """
+    from . import openfile
+
+    if outpath is None:
+        outpath = path.rsplit(".", 1)[0] + ".psz"
+    with open(path, "rb") as fd:
+        _, system_clock = openfile._read_dat_header(fd)
+    with ArchiveWriter(outpath, system_clock=system_clock,
+                       block_size=block_size, level=level) as arc:
+        for data in openfile.iterDAT(path, chunk_size=block_size):
+            arc.write(data)
+    return outpath
+
+
+def varint_decode(raw):
+    """Decode LEB128 variable-length integers
+
+    Uses the compiled single-pass decoder of
+    :mod:`pyscanfcs.decode_dat` if available.
+
+    Parameters
+    ----------
+    raw : ndarray (uint8)
+        Encoded data
+
+    Returns
+    -------
+    values : ndarray (uint32)
+    """
+    if decode_dat is not None:
+        return decode_dat.varint_decode(raw)
+    return _varint_decode_numpy(raw)
+
+
+def _varint_decode_numpy(raw):
+    """Vectorized NumPy fallback for :func:`varint_decode`"""
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    values = (raw[starts] & 0x7F).astype(np.uint32)
+    lengths = ends - starts
+    for kk in range(1, 5):
+        sel = np.flatnonzero(lengths >= kk)
+        if sel.size == 0:
+            break
+        values[sel] |= (raw[starts[sel] + kk].astype(np.uint32)
+                        & 0x7F) << np.uint32(7 * kk)
+    return values
+
+
+def varint_encode(values):
+    """Encode uint32 values as LEB128 variable-length integers
+
+    Each byte holds 7 bits of the value; the most significant bit
+    is set if more bytes follow.
+
+    Parameters
+    ----------
+    values : ndarray (uint32)
+
+    Returns
+    -------
+    raw : ndarray (uint8)
+    """
+    values = np.asarray(values, dtype=np.uint32)
+    nbytes = np.ones(values.size, dtype=np.intp)
+    for kk in range(1, 5):
+        nbytes += values >= (1 << (7 * kk))
+    starts = np.cumsum(nbytes) - nbytes
+    raw = np.zeros(int(np.sum(nbytes)), dtype=np.uint8)
+    for kk in range(5):
+        sel = np.flatnonzero(nbytes > kk)
+        if sel.size == 0:
+            break
+        byte = (values[sel] >> np.uint32(7 * kk)) & 0x7F
+        byte |= np.where(nbytes[sel] > kk + 1, 0x80, 0).astype(np.uint32)
+        raw[starts[sel] + kk] = byte
+    return raw
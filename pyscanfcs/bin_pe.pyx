@@ -1,6 +1,3 @@
-import tempfile
-import warnings
-
 import numpy as np
 
 # "cimport" is used to import special compile-time information
@@ -19,126 +16,178 @@ ctypedef np.uint32_t DTYPEuint32_t
 ctypedef np.uint16_t DTYPEuint16_t
 
 cimport cython
+from libc.stdint cimport uint8_t, uint16_t, uint32_t, uint64_t
+
+# Output types of the binning kernel
+ctypedef fused count_t:
+    uint8_t
+    uint16_t
+    uint32_t
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _bin_kernel(const uint32_t[::1] data, double t_bin,
+                            uint64_t time, Py_ssize_t first,
+                            count_t[::1] out) noexcept nogil:
+    """Add the photon events in `data` to the bins in `out`
+
+    The arrival time of each photon event is the exact cumulative
+    sum of the time differences, starting at `time`. The photon
+    event with arrival time T is counted in bin `floor(T / t_bin)`,
+    where `out[0]` is the bin `first`.
+
+    Returns the number of binned events, which is smaller than the
+    length of `data` if `out` is too short.
+    """
+    cdef Py_ssize_t n = data.shape[0]
+    cdef Py_ssize_t nout = out.shape[0]
+    cdef Py_ssize_t i, b
+    for i in range(n):
+        time += data[i]
+        b = <Py_ssize_t>(time / t_bin) - first
+        if b >= nout:
+            return i
+        out[b] += 1
+    return n
+
+
+def _bin_chunk(chunk, double t_bin, uint64_t time, Py_ssize_t first, out,
+               partial=False):
+    """Bin one chunk of photon events into `out` (GIL released)
+
+    If `partial` is True, binning stops at the first photon event
+    after the end of `out` and the number of binned events is
+    returned; otherwise, a ValueError is raised.
+    """
+    cdef const uint32_t[::1] d = np.ascontiguousarray(chunk,
+                                                      dtype=DTYPEuint32)
+    cdef Py_ssize_t done
+    cdef uint8_t[::1] o8
+    cdef uint16_t[::1] o16
+    cdef uint32_t[::1] o32
+    if out.dtype == np.uint8:
+        o8 = out
+        with nogil:
+            done = _bin_kernel(d, t_bin, time, first, o8)
+    elif out.dtype == np.uint16:
+        o16 = out
+        with nogil:
+            done = _bin_kernel(d, t_bin, time, first, o16)
+    elif out.dtype == np.uint32:
+        o32 = out
+        with nogil:
+            done = _bin_kernel(d, t_bin, time, first, o32)
+    else:
+        raise ValueError("Unsupported output type: {}".format(out.dtype))
+    if done != d.shape[0] and not partial:
+        raise ValueError("Output array too short for photon event "
+                         "{}".format(done))
+    return done
+
+
+cdef inline Py_ssize_t _kymo_bin(uint64_t time, double line_time,
+                                 Py_ssize_t bins_per_line) noexcept nogil:
+    """Bin of a photon event in a kymograph (line * bins_per_line + column)
+
+    The lines start at the exact times `i * line_time`; the column is
+    computed from the time since the start of the line, which avoids
+    accumulating rounding errors of the bin time.
+    """
+    cdef double t = <double>time
+    cdef Py_ssize_t line = <Py_ssize_t>(t / line_time)
+    cdef double offset = t - line * line_time
+    cdef Py_ssize_t column
+    if offset < 0:
+        # `t / line_time` was rounded up to the next line
+        line -= 1
+        offset = t - line * line_time
+    column = <Py_ssize_t>(offset * bins_per_line / line_time)
+    if column >= bins_per_line:
+        column = bins_per_line - 1
+    return line * bins_per_line + column
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _kymo_kernel(const uint32_t[::1] data, double line_time,
+                             Py_ssize_t bins_per_line, uint64_t time,
+                             Py_ssize_t first,
+                             count_t[::1] out) noexcept nogil:
+    """Add the photon events in `data` to the kymograph bins in `out`
+
+    Like :func:`_bin_kernel`, but the photon event with arrival
+    time T is counted in the kymograph bin :func:`_kymo_bin`
+    (`out` is the flattened kymograph starting at bin `first`).
+    """
+    cdef Py_ssize_t n = data.shape[0]
+    cdef Py_ssize_t nout = out.shape[0]
+    cdef Py_ssize_t i, b
+    for i in range(n):
+        time += data[i]
+        b = _kymo_bin(time, line_time, bins_per_line) - first
+        if b >= nout:
+            return i
+        out[b] += 1
+    return n
+
+
+def kymo_bin(time, double line_time, Py_ssize_t bins_per_line):
+    """Kymograph bin (line * bins_per_line + column) of an arrival time"""
+    return _kymo_bin(time, line_time, bins_per_line)
+
+
+def _bin_kymo_chunk(chunk, double line_time, Py_ssize_t bins_per_line,
+                    uint64_t time, Py_ssize_t first, out, partial=False):
+    """Bin one chunk of photon events into a flattened kymograph `out`
+
+    See :func:`_bin_chunk` (GIL released).
+    """
+    cdef const uint32_t[::1] d = np.ascontiguousarray(chunk,
+                                                      dtype=DTYPEuint32)
+    cdef Py_ssize_t done
+    cdef uint8_t[::1] o8
+    cdef uint16_t[::1] o16
+    cdef uint32_t[::1] o32
+    if out.dtype == np.uint8:
+        o8 = out
+        with nogil:
+            done = _kymo_kernel(d, line_time, bins_per_line, time, first,
+                                o8)
+    elif out.dtype == np.uint16:
+        o16 = out
+        with nogil:
+            done = _kymo_kernel(d, line_time, bins_per_line, time, first,
+                                o16)
+    elif out.dtype == np.uint32:
+        o32 = out
+        with nogil:
+            done = _kymo_kernel(d, line_time, bins_per_line, time, first,
+                                o32)
+    else:
+        raise ValueError("Unsupported output type: {}".format(out.dtype))
+    if done != d.shape[0] and not partial:
+        raise ValueError("Output array too short for photon event "
+                         "{}".format(done))
+    return done
+
+
+def bin_photon_array(data, t_bin, **kwargs):
+    """Bin photon events into a preallocated array
+
+    See :func:`pyscanfcs.binning.bin_photon_array`, which uses the
+    compiled kernels of this module.
+    """
+    # imported here, because `binning` imports this module
+    from . import binning
+    return binning.bin_photon_array(data, t_bin, **kwargs)
+
 
-# Negative indices are checked for and handled correctly. The code is
-# explicitly coded so that it doesn’t use negative indices, and it (hopefully)
-# always access within bounds. We can add a decorator to disable bounds
-# checking:
-@cython.cdivision(True)
-@cython.boundscheck(False)  # turn of bounds-checking for entire function
-def bin_photon_events(np.ndarray[DTYPEuint32_t] data, double t_bin,
-                      binshift=None, outfile=None, outdtype=DTYPEuint16,
-                      callback=None, cb_kwargs={}):
+def bin_photon_events(data, t_bin, **kwargs):
     """Convert photon arrival times to a binned trace
 
-    Bin all photon arrival times in a numpy.uint32 array *data*, using
-    the binning time float *t_bin* and saving the intensity trace as
-    the file *filename*. *dlg* is a python object that supports
-    dlg.Update, like a progress dialog.
-
-    Parameters
-    ----------
-    data : ndarray (uint32)
-        photon events to be binned
-    t_bin : (double)
-        binning time
-    binshift : int
-        adding a number of zeros at the beginning of the binned data
-    outfile : str
-        path to store output
-    outdtype : dtype
-        numpy dtype of the output file
-    callback : callable or None
-        Callback function to be called throughout the algorithm. If the
-        return value of `callback` is not None, the function will abort.
-        Number of function calls: 100
-    cb_kwargs : dict, optional
-        Keyword arguments for `callback` (e.g. "pid" of process).
-
-    Returns
-    -------
-    filename : str
-        The filename of the binned data.
-
-    Notes
-    -----
-    The photon stream `data` is created by a program called `Photon.exe`
-    from correlator.com.
+    See :func:`pyscanfcs.binning.bin_photon_events`, which uses the
+    compiled kernels of this module.
     """
-    cdef int N = len(data)
-    BinData = []
-    cdef double time_c = 0  # time counter
-    cdef int phot_c = 0  # photon counter
-    cdef int maxphot = 0
-    cdef int j, i, emptybins, bin
-
-    dtype = np.dtype(outdtype)
-
-    if outfile is None:
-        outfile = tempfile.mktemp(suffix=".bin")
-
-    # print("Creating file {} ({})".format(outfile, outdtype.__name__))
-
-    NewFile = open(outfile, 'wb')
-
-    # Add number of empty bins to beginning of file
-    if binshift is not None:
-        NewFile.write(outdtype(np.zeros(binshift)))
-
-    TempTrace = []
-
-    Nperc = int(np.floor(N / 100))
-
-    for j in range(100):
-        percent = str(j)
-
-        for i in range(Nperc):
-            i = i + Nperc * j
-            time_c += data[i]
-
-            if time_c >= t_bin:
-                # Append counted photons and
-                # reset counters
-                # NewFile.write(outdtype(phot_c))
-                TempTrace.append(phot_c)
-                time_c -= t_bin
-                phot_c = 0
-                # Empty bins between this and next event:
-                emptybins = int(time_c / t_bin)
-                TempTrace += emptybins * [0]
-                time_c -= emptybins * t_bin
-                # Equivalent to:
-                # time_c = int(time_c)%int(t_bin)
-            phot_c += 1
-        NewFile.write(outdtype(TempTrace))
-        TempTrace = []
-
-        if callback is not None:
-            ret = callback(**cb_kwargs)
-            if ret is not None:
-                warnings.warn("Aborted by user.")
-                return outfile
-
-    # Now write the rest:
-    for i in range(Nperc * 100, N):
-        time_c += data[i]
-        if time_c >= t_bin:
-            # Append counted photons and
-            # reset counters
-            # NewFile.write(outdtype(phot_c))
-            TempTrace.append(phot_c)
-            time_c -= t_bin
-            phot_c = 0
-            # Empty bins between this and next event:
-            emptybins = int(time_c / t_bin)
-            TempTrace += emptybins * [0]
-            time_c -= emptybins * t_bin
-            # Equivalent to:
-            # time_c = int(time_c)%int(t_bin)
-        phot_c += 1
-    # final photons
-    TempTrace.append(phot_c)
-    
-    NewFile.write(outdtype(TempTrace))
-    NewFile.close()
-    return outfile
+    from . import binning
+    return binning.bin_photon_events(data, t_bin, **kwargs)
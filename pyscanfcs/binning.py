@@ -0,0 +1,860 @@
+"""Binning of photon streams
+
+This module provides :func:`bin_photon_array` and
+:func:`bin_photon_events` with the same signatures and results as
+the compiled functions in :mod:`pyscanfcs.bin_pe`. The compiled
+kernel is used if the extension is available; otherwise, the photon
+events are binned with NumPy: the exact arrival times are computed
+with a cumulative sum of the time differences, divided by the bin
+time and counted with :func:`numpy.bincount`, block by block.
+
+Large photon stream arrays are split into segments that are binned
+in parallel threads (see :func:`_bin_parallel`).
+:func:`bin_kymograph` bins photon streams directly into the lines of
+a kymograph (:func:`iter_kymograph` yields them block by block) and
+:func:`bin_pyramid` bins them at power-of-two multiples of a bin
+time.
+"""
+import concurrent.futures
+import os
+import tempfile
+import warnings
+
+import numpy as np
+
+try:
+    from . import bin_pe
+except ImportError:
+    # compiled binning not available
+    bin_pe = None
+
+
+def _bin_chunk(chunk, t_bin, time, first, out, partial=False):
+    """Bin one chunk of photon events into `out`
+
+    Uses the compiled kernel of :mod:`pyscanfcs.bin_pe` if available.
+    The photon event with the arrival time T (`time` plus the
+    cumulative sum of `chunk`) is counted in bin `floor(T / t_bin)`,
+    where `out[0]` is the bin `first`.
+
+    If `partial` is True, binning stops at the first photon event
+    after the end of `out` and the number of binned events is
+    returned; otherwise, a ValueError is raised.
+    """
+    if bin_pe is not None:
+        return bin_pe._bin_chunk(chunk, t_bin, time, first, out,
+                                 partial=partial)
+    else:
+        return _bin_chunk_numpy(chunk, t_bin, time, first, out,
+                                partial=partial)
+
+
+def _bin_chunk_numpy(chunk, t_bin, time, first, out, partial=False,
+                     block_size=1048576):
+    """NumPy implementation of :func:`_bin_chunk`"""
+    def to_bins(arrival):
+        # same rounding as the compiled kernel (uint64 -> double)
+        return (arrival / t_bin).astype(np.intp)
+
+    return _bin_blocks_numpy(chunk, to_bins, time, first, out,
+                             partial=partial, block_size=block_size)
+
+
+def _bin_kymo_chunk(chunk, line_time, bins_per_line, time, first, out,
+                    partial=False):
+    """Bin one chunk of photon events into a flattened kymograph `out`
+
+    Like :func:`_bin_chunk`, but the photon event with the arrival
+    time T is counted in the kymograph bin `line * bins_per_line +
+    column` (see :func:`kymo_bins`).
+    """
+    if bin_pe is not None:
+        return bin_pe._bin_kymo_chunk(chunk, line_time, bins_per_line,
+                                      time, first, out, partial=partial)
+    else:
+        return _bin_kymo_chunk_numpy(chunk, line_time, bins_per_line,
+                                     time, first, out, partial=partial)
+
+
+def _bin_kymo_chunk_numpy(chunk, line_time, bins_per_line, time, first,
+                          out, partial=False, block_size=1048576):
+    """NumPy implementation of :func:`_bin_kymo_chunk`"""
+    def to_bins(arrival):
+        return kymo_bins(arrival, line_time, bins_per_line)
+
+    return _bin_blocks_numpy(chunk, to_bins, time, first, out,
+                             partial=partial, block_size=block_size)
+
+
+def kymo_bins(arrival, line_time, bins_per_line):
+    """Kymograph bins of photon arrival times
+
+    The lines start at the exact times `i * line_time`. The line of
+    the arrival time T is `floor(T / line_time)` and the column is
+    computed from the time since the start of the line, i.e. the
+    rounding errors of the bin time `line_time / bins_per_line` do
+    not accumulate over the lines. This is the NumPy implementation
+    of the kymograph kernel in :mod:`pyscanfcs.bin_pe` (same
+    floating point operations).
+
+    Parameters
+    ----------
+    arrival : ndarray (uint64)
+        Arrival times in system clock ticks
+    line_time : float
+        Line time in system clock ticks
+    bins_per_line : int
+        Number of bins per line
+
+    Returns
+    -------
+    bins : ndarray (intp)
+        Kymograph bins `line * bins_per_line + column`
+    """
+    t = np.asarray(arrival, dtype=np.uint64).astype(np.float64)
+    line = (t / line_time).astype(np.intp)
+    offset = t - line * line_time
+    # `t / line_time` may be rounded up to the next line
+    up = offset < 0
+    if np.any(up):
+        line[up] -= 1
+        offset[up] = t[up] - line[up] * line_time
+    column = (offset * bins_per_line / line_time).astype(np.intp)
+    np.minimum(column, bins_per_line - 1, out=column)
+    return line * bins_per_line + column
+
+
+def _bin_blocks_numpy(chunk, to_bins, time, first, out, partial=False,
+                      block_size=1048576):
+    """Bin photon events block by block with NumPy
+
+    `to_bins` maps arrival times (uint64) to sorted bin indices.
+    """
+    chunk = np.asarray(chunk, dtype=np.uint32)
+    time = np.uint64(time)
+    for ii in range(0, chunk.size, block_size):
+        block = chunk[ii:ii + block_size]
+        arrival = np.cumsum(block, dtype=np.uint64)
+        arrival += time
+        time = arrival[-1]
+        bins = to_bins(arrival)
+        bins -= first
+        if bins[-1] >= out.size:
+            done = int(np.searchsorted(bins, out.size))
+            _count_bins(bins[:done], out)
+            if partial:
+                return ii + done
+            raise ValueError("Output array too short for photon event "
+                             "{}".format(ii + done))
+        _count_bins(bins, out)
+    return chunk.size
+
+
+def _count_bins(bins, out):
+    """Add sorted bin indices to `out`
+
+    The counts wrap around like in the compiled kernel if `out`
+    overflows.
+    """
+    if bins.size == 0:
+        return
+    if bins[-1] - bins[0] < bins.size:
+        counts = np.bincount(bins - bins[0])
+        view = out[bins[0]:bins[-1] + 1]
+        np.add(view, counts.astype(out.dtype), out=view)
+    else:
+        # sparse events (short bin time): count the runs of equal bins
+        starts = np.flatnonzero(np.diff(bins)) + 1
+        starts = np.concatenate(([0], starts))
+        counts = np.diff(starts, append=bins.size)
+        out[bins[starts]] += counts.astype(out.dtype)
+
+
+def _bin_parallel(data, out, workers, bin_chunk, bin_index, index=None,
+                  callback=None, cb_kwargs={}):
+    """Bin a photon stream into `out` using multiple threads
+
+    The photon stream is split into `workers` segments (see
+    :func:`_split_segments`) that are binned in a thread pool (the
+    compiled kernel releases the GIL). The first bin of a segment
+    may also contain photon events of the previous segment. To
+    avoid concurrent writes, this bin is counted separately by each
+    thread and added to `out` after all threads have finished. The
+    result is identical to serial binning.
+
+    Parameters
+    ----------
+    data : ndarray (uint32)
+        Photon stream
+    out : ndarray
+        Output array (1D)
+    workers : int
+        Number of threads
+    bin_chunk : callable
+        Binning function with the arguments `(chunk, time, first,
+        out, partial=False)` (see :func:`_bin_chunk`)
+    bin_index : callable
+        Function that returns the bin of an arrival time
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`, see :func:`_split_segments`
+    callback : callable or None
+        Called after each segment, see :func:`bin_photon_array`
+    cb_kwargs : dict, optional
+        Keyword arguments for `callback`
+
+    Returns
+    -------
+    aborted : bool
+        True if `callback` returned a value other than None
+    """
+    def bin_segment(k):
+        segment = data[bounds[k]:bounds[k + 1]]
+        time = times[k]
+        if k == 0 or segment.size == 0:
+            bin_chunk(segment, time, 0, out)
+            return None
+        first = bin_index(time + int(segment[0]))
+        head = np.zeros(1, dtype=out.dtype)
+        done = bin_chunk(segment, time, first, head, partial=True)
+        time += int(np.sum(segment[:done], dtype=np.uint64))
+        bin_chunk(segment[done:], time, 0, out)
+        return first, head
+
+    aborted = False
+    heads = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        bounds, times = _split_segments(data, workers, index, pool=pool)
+        futures = [pool.submit(bin_segment, k) for k in range(len(times))]
+        for future in concurrent.futures.as_completed(futures):
+            heads.append(future.result())
+            if callback is not None and not aborted:
+                if callback(**cb_kwargs) is not None:
+                    aborted = True
+                    for ff in futures:
+                        ff.cancel()
+    if not aborted:
+        for head in heads:
+            if head is not None:
+                first, value = head
+                out[first:first + 1] += value
+    return aborted
+
+
+def _split_segments(data, n_segments, index=None, pool=None):
+    """Split a photon stream into segments for parallel binning
+
+    Parameters
+    ----------
+    data : ndarray (uint32)
+        Photon stream
+    n_segments : int
+        Number of segments
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`; if given, the segments start
+        at checkpoints and their start times are taken from the
+        index. Otherwise, the start times are computed from the
+        sums of the segments.
+    pool : concurrent.futures.Executor or None
+        Executor for computing the sums of the segments
+
+    Returns
+    -------
+    bounds : list of int
+        Event indices of the segment boundaries (length
+        number of segments plus one)
+    times : list of int
+        Arrival time before the first event of each segment
+    """
+    n_events = len(data)
+    if index is not None and index.n_events == n_events:
+        n_checkpoints = index.times.size
+        checkpoints = sorted(set(n_checkpoints * k // n_segments
+                                 for k in range(n_segments)))
+        bounds = [c * index.every for c in checkpoints] + [n_events]
+        times = [int(index.times[c]) for c in checkpoints]
+        if not times:
+            bounds, times = [0, 0], [0]
+    else:
+        bounds = [n_events * k // n_segments for k in range(n_segments + 1)]
+        segments = [data[a:b] for a, b in zip(bounds[:-2], bounds[1:-1])]
+        mapper = map if pool is None else pool.map
+        sums = list(mapper(lambda segment: np.sum(segment, dtype=np.uint64),
+                           segments))
+        times = [0] + [int(t) for t in np.cumsum(sums, dtype=np.uint64)]
+    return bounds, times
+
+
+def _bin_chunk_function(t_bin):
+    """:func:`_bin_chunk` with a fixed bin time (for :func:`_bin_parallel`)"""
+    def bin_chunk(chunk, time, first, out, partial=False):
+        return _bin_chunk(chunk, t_bin, time, first, out, partial=partial)
+    return bin_chunk
+
+
+def _iter_chunks(data):
+    """Split the photon stream in chunks for the progress callback"""
+    if isinstance(data, np.ndarray):
+        # 100 steps for the progress callback
+        N = len(data)
+        Nperc = N // 100
+        for j in range(100):
+            yield data[Nperc * j:Nperc * (j + 1)]
+        # the rest
+        yield data[Nperc * 100:]
+    else:
+        yield from data.iter_chunks()
+
+
+def n_bins(total_time, t_bin):
+    """Number of bins of a photon stream with the total time `total_time`
+
+    This is the bin index of the last photon event plus one.
+    """
+    return int(float(int(total_time)) / t_bin) + 1
+
+
+def _get_workers(data, workers):
+    """Number of threads for binning `data`"""
+    if not isinstance(data, np.ndarray):
+        # photon stream objects are binned chunk by chunk
+        return 1
+    if workers is None:
+        workers = os.cpu_count() if data.size > 2**24 else 1
+    return max(1, workers)
+
+
+def bin_photon_array(data, t_bin, binshift=None, outdtype=np.uint16,
+                     total_time=None, callback=None, cb_kwargs={},
+                     workers=None, index=None):
+    """Bin photon events into a preallocated array
+
+    This is the in-memory counterpart of :func:`bin_photon_events`.
+    The length of the output is computed from the total time of the
+    measurement and the photon events are counted in a compiled loop
+    without the GIL (see :mod:`pyscanfcs.bin_pe`).
+
+    Parameters
+    ----------
+    data : ndarray (uint32) or photon stream object
+        photon events to be binned; objects that are not arrays
+        (e.g. :class:`pyscanfcs.multistream.ConcatenatedStream`)
+        must have a method `iter_chunks` that yields uint32 arrays
+    t_bin : float
+        binning time
+    binshift : int
+        adding a number of zeros at the beginning of the binned data
+    outdtype : dtype
+        numpy dtype of the output (uint8, uint16, or uint32)
+    total_time : int or None
+        Total time of the measurement in system clock ticks (e.g. from
+        the checkpoint index); computed from `data` if None.
+    callback : callable or None
+        Callback function to be called throughout the algorithm. If the
+        return value of `callback` is not None, the function will abort.
+        Number of function calls: 100 (or one per chunk for photon
+        stream objects)
+    cb_kwargs : dict, optional
+        Keyword arguments for `callback` (e.g. "pid" of process).
+    workers : int or None
+        Number of threads for binning photon stream arrays (see
+        :func:`_bin_parallel`). If None, all CPUs are used for more
+        than 2**24 photon events.
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`, used for splitting the photon
+        stream into segments and for the total time
+
+    Returns
+    -------
+    binned : ndarray
+        The binned data; photon events with the arrival time T are
+        counted in bin `binshift + floor(T / t_bin)`.
+    """
+    workers = _get_workers(data, workers)
+    index = _get_index(data, index)
+    total_time = _get_total_time(data, total_time, index)
+    if binshift is None:
+        binshift = 0
+    binned = np.zeros(binshift + n_bins(total_time, t_bin), dtype=outdtype)
+
+    _bin_into(data, binned[binshift:],
+              bin_chunk=_bin_chunk_function(t_bin),
+              bin_index=lambda time: n_bins(time, t_bin) - 1,
+              workers=workers, index=index, callback=callback,
+              cb_kwargs=cb_kwargs)
+    return binned
+
+
+def _get_index(data, index):
+    """Checkpoint index for binning `data` (None if it does not match)"""
+    if index is not None and index.n_events != len(data):
+        # index of a different (e.g. complete) photon stream
+        index = None
+    return index
+
+
+def _get_total_time(data, total_time=None, index=None):
+    """Total time of a photon stream in system clock ticks"""
+    if total_time is None and index is not None:
+        total_time = index.total_time
+    if total_time is None:
+        if isinstance(data, np.ndarray):
+            total_time = np.sum(data, dtype=np.uint64)
+        elif hasattr(data, "total_time"):
+            total_time = data.total_time()
+        else:
+            total_time = sum(np.sum(c, dtype=np.uint64)
+                             for c in data.iter_chunks())
+    return int(total_time)
+
+
+def _bin_into(data, out, bin_chunk, bin_index, workers=1, index=None,
+              callback=None, cb_kwargs={}):
+    """Bin a photon stream into `out` serially or in parallel
+
+    See :func:`_bin_parallel` for a description of the parameters.
+    """
+    if workers > 1:
+        if _bin_parallel(data, out, workers, bin_chunk=bin_chunk,
+                         bin_index=bin_index, index=index,
+                         callback=callback, cb_kwargs=cb_kwargs):
+            warnings.warn("Aborted by user.")
+        return
+
+    time = 0
+    for j, chunk in enumerate(_iter_chunks(data)):
+        bin_chunk(chunk, time, 0, out)
+        time += int(np.sum(chunk, dtype=np.uint64))
+
+        if callback is not None and (j < 100 or
+                                     not isinstance(data, np.ndarray)):
+            ret = callback(**cb_kwargs)
+            if ret is not None:
+                warnings.warn("Aborted by user.")
+                break
+
+
+def bin_kymograph(data, line_time, bins_per_line, correction=1.0,
+                  binshift=None, outdtype=np.uint16, total_time=None,
+                  callback=None, cb_kwargs={}, workers=None, index=None):
+    """Bin photon events directly into a kymograph
+
+    Binning a photon stream with the bin time `line_time /
+    bins_per_line` and reshaping the binned data lets the rounding
+    errors of the bin time accumulate over the lines, i.e. the
+    kymograph is sheared for fractional line times. Here, each line
+    starts at the exact time `i * line_time` and the photon events
+    are counted in the (line, column) bins of the kymograph in a
+    single pass (see :func:`kymo_bins`).
+
+    Parameters
+    ----------
+    data : ndarray (uint32) or photon stream object
+        Photon events to be binned, see :func:`bin_photon_array`
+    line_time : float
+        Line time (scan cycle time) in system clock ticks
+    bins_per_line : int
+        Number of bins per line
+    correction : float
+        Line time correction factor (the line time used for binning
+        is `line_time * correction`)
+    binshift : int
+        Empty bins at the beginning of the kymograph (shifts the
+        photon events by whole bins along the lines)
+    outdtype : dtype
+        numpy dtype of the output (uint8, uint16, or uint32)
+    total_time, callback, cb_kwargs, workers, index
+        See :func:`bin_photon_array`
+
+    Returns
+    -------
+    kymograph : ndarray of shape (lines, bins_per_line)
+        The binned data; the last line contains the last photon
+        event.
+    """
+    line_time = line_time * correction
+    bins_per_line = int(bins_per_line)
+    workers = _get_workers(data, workers)
+    index = _get_index(data, index)
+    total_time = _get_total_time(data, total_time, index)
+    if binshift is None:
+        binshift = 0
+
+    def bin_index(time):
+        return int(kymo_bins([time], line_time, bins_per_line)[0])
+
+    def bin_chunk(chunk, time, first, out, partial=False):
+        return _bin_kymo_chunk(chunk, line_time, bins_per_line, time,
+                               first, out, partial=partial)
+
+    n_lines = (binshift + bin_index(total_time)) // bins_per_line + 1
+    kymograph = np.zeros((n_lines, bins_per_line), dtype=outdtype)
+    _bin_into(data, kymograph.reshape(-1)[binshift:],
+              bin_chunk=bin_chunk, bin_index=bin_index, workers=workers,
+              index=index, callback=callback, cb_kwargs=cb_kwargs)
+    return kymograph
+
+
+def iter_kymograph(data, line_time, bins_per_line, correction=1.0,
+                   binshift=None, outdtype=np.uint16, callback=None,
+                   cb_kwargs={}, workers=None, index=None):
+    """Bin photon events into a kymograph, yielding blocks of lines
+
+    Same binning as :func:`bin_kymograph`, but the photon stream is
+    binned chunk by chunk and the lines are yielded as soon as they
+    are complete, i.e. only the lines of one chunk are held in
+    memory (e.g. for writing to a
+    :class:`pyscanfcs.kymostore.KymographWriter`).
+
+    Parameters
+    ----------
+    data, line_time, bins_per_line, correction, binshift, outdtype
+        See :func:`bin_kymograph`
+    callback : callable or None
+        Called after each chunk, see :func:`bin_photon_array`
+    cb_kwargs : dict, optional
+        Keyword arguments for `callback`
+    workers : int or None
+        Number of threads for binning each chunk, see
+        :func:`bin_photon_array`
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`; if given, the chunks start at
+        checkpoints and their start times are taken from the index.
+
+    Yields
+    ------
+    lines : ndarray of shape (n, bins_per_line)
+        Consecutive lines of the kymograph; concatenated, they are
+        identical to the result of :func:`bin_kymograph`.
+    """
+    line_time = line_time * correction
+    bins_per_line = int(bins_per_line)
+    workers = _get_workers(data, workers)
+    index = _get_index(data, index)
+    if binshift is None:
+        binshift = 0
+
+    def kymo_bin(time):
+        return binshift + int(kymo_bins([time], line_time, bins_per_line)[0])
+
+    first = 0  # first line that is not yielded yet
+    # photons of the last (incomplete) line
+    carry = np.zeros(bins_per_line, dtype=outdtype)
+
+    for j, (chunk, time, end) in enumerate(_iter_timed_chunks(data, index)):
+        last = kymo_bin(end) // bins_per_line
+        lines = np.zeros((last - first + 1, bins_per_line), dtype=outdtype)
+        lines[0] = carry
+        # kymograph bin of lines[0, 0] (without bin shift)
+        offset = first * bins_per_line - binshift
+        if workers > 1:
+            def bin_chunk(segment, t, f, out, partial=False):
+                return _bin_kymo_chunk(segment, line_time, bins_per_line,
+                                       time + t, offset + f, out,
+                                       partial=partial)
+
+            def bin_index(t):
+                return kymo_bin(time + t) - binshift - offset
+
+            _bin_parallel(chunk, lines.reshape(-1), workers,
+                          bin_chunk=bin_chunk, bin_index=bin_index)
+        else:
+            _bin_kymo_chunk(chunk, line_time, bins_per_line, time, offset,
+                            lines.reshape(-1))
+        # the last line may receive more photons from the next chunk
+        if last > first:
+            yield lines[:-1]
+        carry = lines[-1]
+        first = last
+
+        if callback is not None and (j < 100 or
+                                     not isinstance(data, np.ndarray)):
+            ret = callback(**cb_kwargs)
+            if ret is not None:
+                warnings.warn("Aborted by user.")
+                return
+
+    # final photons
+    yield carry.reshape(1, -1)
+
+
+def _iter_timed_chunks(data, index=None):
+    """Chunks of a photon stream with their start and end times
+
+    Like :func:`_iter_chunks`, but if a checkpoint `index` of the
+    photon stream array is given, the chunks start at checkpoints
+    and the times are taken from the index.
+
+    Yields
+    ------
+    chunk : ndarray (uint32)
+        Photon events
+    time, end : int
+        Arrival time before the first and of the last event
+    """
+    if index is not None and isinstance(data, np.ndarray):
+        n_checkpoints = index.times.size
+        checkpoints = sorted(set(n_checkpoints * j // 100
+                                 for j in range(1, 100)) - {0})
+        bounds = [0] + [c * index.every for c in checkpoints] + [len(data)]
+        times = ([0] + [int(index.times[c]) for c in checkpoints] +
+                 [index.total_time])
+        for k in range(len(bounds) - 1):
+            yield data[bounds[k]:bounds[k + 1]], times[k], times[k + 1]
+    else:
+        time = 0
+        for chunk in _iter_chunks(data):
+            end = time + int(np.sum(chunk, dtype=np.uint64))
+            yield chunk, time, end
+            time = end
+
+
+def bin_photon_events(data, t_bin, binshift=None, outfile=None,
+                      outdtype=np.uint16, callback=None, cb_kwargs={},
+                      workers=None, index=None):
+    """Convert photon arrival times to a binned trace
+
+    Bin all photon arrival times in `data` using the binning time
+    `t_bin` and save the intensity trace as the file `outfile`.
+
+    Parameters
+    ----------
+    data : ndarray (uint32) or photon stream object
+        photon events to be binned, see :func:`bin_photon_array`
+    t_bin : float
+        binning time
+    binshift : int
+        adding a number of zeros at the beginning of the binned data
+    outfile : str
+        path to store output
+    outdtype : dtype
+        numpy dtype of the output file
+    callback, cb_kwargs
+        See :func:`bin_photon_array`
+    workers : int or None
+        Number of threads, see :func:`bin_photon_array`. With more
+        than one thread, the output file is memory-mapped and the
+        segments are binned directly into the file.
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`
+
+    Returns
+    -------
+    filename : str
+        The filename of the binned data.
+
+    Notes
+    -----
+    The photon stream `data` is created by a program called `Photon.exe`
+    from correlator.com.
+
+    With a single thread, the binned data are written chunk by chunk,
+    i.e. the memory usage is bounded by the chunk size. Use
+    :func:`bin_photon_array` to obtain the binned data as an array.
+    """
+    time = 0  # arrival time of the last photon event
+    first = 0  # first bin that is not written yet
+
+    dtype = np.dtype(outdtype)
+    workers = _get_workers(data, workers)
+
+    if outfile is None:
+        outfile = tempfile.mktemp(suffix=".bin")
+
+    if workers > 1:
+        index = _get_index(data, index)
+        total_time = _get_total_time(data, index=index)
+        binshift = binshift or 0
+        binned = np.memmap(outfile, dtype=dtype, mode="w+",
+                           shape=(binshift + n_bins(total_time, t_bin),))
+        _bin_into(data, binned[binshift:],
+                  bin_chunk=_bin_chunk_function(t_bin),
+                  bin_index=lambda time: n_bins(time, t_bin) - 1,
+                  workers=workers, index=index, callback=callback,
+                  cb_kwargs=cb_kwargs)
+        binned.flush()
+        del binned
+        return outfile
+
+    with open(outfile, "wb") as fd:
+        # Add number of empty bins to beginning of file
+        if binshift is not None:
+            np.zeros(binshift, dtype=dtype).tofile(fd)
+
+        # photons of the last (incomplete) bin
+        carry = 0
+
+        for j, chunk in enumerate(_iter_chunks(data)):
+            end = time + int(np.sum(chunk, dtype=np.uint64))
+            last = n_bins(end, t_bin) - 1
+            trace = np.zeros(last - first + 1, dtype=dtype)
+            trace[0] = carry
+            _bin_chunk(chunk, t_bin, time, first, trace)
+            # the last bin may receive more photons from the next chunk
+            trace[:-1].tofile(fd)
+            carry = trace[-1]
+            first = last
+            time = end
+
+            if callback is not None and (j < 100 or
+                                         not isinstance(data, np.ndarray)):
+                ret = callback(**cb_kwargs)
+                if ret is not None:
+                    warnings.warn("Aborted by user.")
+                    return outfile
+
+        # final photons
+        np.array([carry], dtype=dtype).tofile(fd)
+    return outfile
+
+
+class BinPyramid(object):
+    def __init__(self, levels, t_bin, binshift=0):
+        """Binned photon stream at power-of-two multiples of a bin time
+
+        Level `k` contains the photon counts in bins of the width
+        `2**k * t_bin`, i.e. the sums of pairs of bins of level
+        `k - 1`. If the photon stream was binned with a bin shift,
+        level `k` corresponds to binning with `2**k * t_bin` only
+        if the bin shift is a multiple of `2**k`.
+
+        Parameters
+        ----------
+        levels : list of ndarray
+            Binned data of each level
+        t_bin : float
+            Bin time of level 0 in system clock ticks
+        binshift : int
+            Empty bins at the beginning of level 0
+        """
+        self.levels = levels
+        self.t_bin = t_bin
+        self.binshift = binshift
+
+    def __getitem__(self, k):
+        return self.levels[k]
+
+    def __len__(self):
+        return len(self.levels)
+
+    @classmethod
+    def from_binned(cls, binned, t_bin, binshift=0, n_levels=None):
+        """Compute the pyramid of binned data
+
+        Parameters
+        ----------
+        binned : ndarray
+            Level 0 (1D)
+        t_bin : float
+            Bin time of `binned` in system clock ticks
+        binshift : int
+            Empty bins at the beginning of `binned`
+        n_levels : int or None
+            Number of levels; if None, levels are added until a level
+            consists of a single bin.
+        """
+        levels = [np.asarray(binned)]
+        while ((n_levels is None and levels[-1].size > 1) or
+               (n_levels is not None and len(levels) < n_levels)):
+            levels.append(_pairwise_sum(levels[-1]))
+        return cls(levels, t_bin=t_bin, binshift=binshift)
+
+    def bin_time(self, k):
+        """Bin time of level `k` in system clock ticks"""
+        return self.t_bin * 2**k
+
+    def level_for_length(self, length):
+        """Finest level with at most `length` bins
+
+        Returns the coarsest level if all levels are longer.
+        """
+        for k, level in enumerate(self.levels):
+            if level.size <= length:
+                return k
+        return len(self.levels) - 1
+
+    def level_for_bin_time(self, t_bin):
+        """Coarsest level with a bin time of at most `t_bin`"""
+        k = 0
+        while k + 1 < len(self.levels) and self.bin_time(k + 1) <= t_bin:
+            k += 1
+        return k
+
+    def reduce_trace(self, deltat, length):
+        """Shorten level 0 by averaging
+
+        Equivalent to :func:`pyscanfcs.util.reduce_trace` with level
+        0 as the trace, but reads the averages from the pyramid.
+
+        Parameters
+        ----------
+        deltat : float
+            Time difference between bins in level 0.
+        length : int
+            Maximum length of the new trace.
+
+        Returns
+        -------
+        newtrace : ndarray, shape (N,2)
+            New trace (axis 1) with timepoints (axis 0).
+        """
+        size = self.levels[0].size
+        step = 0
+        while size >> step > length:
+            step += 1
+        if step >= len(self.levels):
+            raise ValueError("Pyramid has only {} levels, {} required".format(
+                len(self.levels), step + 1))
+        # only complete pairs are averaged
+        trace = self.levels[step][:size >> step] / 2**step
+        T = np.zeros((len(trace), 2))
+        T[:, 1] = trace / deltat / 1e3  # in kHz
+        T[:, 0] = np.arange(len(trace)) * deltat * 2**step
+        return T
+
+
+def _pairwise_sum(data):
+    """Sum of pairs of bins (the last bin is kept if the size is odd)
+
+    The result is stored with the smallest unsigned integer type.
+    """
+    data = np.asarray(data)
+    half = data.size // 2
+    dtype = np.uint64 if data.dtype.itemsize >= 4 else np.uint32
+    coarse = np.empty(data.size - half, dtype=dtype)
+    np.add(data[0:2 * half:2], data[1:2 * half:2], out=coarse[:half],
+           dtype=dtype)
+    if data.size % 2:
+        coarse[-1] = data[-1]
+    maxval = int(coarse.max()) if coarse.size else 0
+    return coarse.astype(np.min_scalar_type(maxval), copy=False)
+
+
+def bin_pyramid(data, t_bin, binshift=None, outdtype=np.uint16,
+                total_time=None, callback=None, cb_kwargs={}, workers=None,
+                index=None, n_levels=None):
+    """Bin photon events at power-of-two multiples of a bin time
+
+    The photon stream is binned once with `t_bin` (see
+    :func:`bin_photon_array`); the coarser levels are computed from
+    the binned data. Since `floor(T / (2**k * t_bin))` equals
+    `floor(T / t_bin) // 2**k`, level `k` is identical to binning
+    the photon stream with `2**k * t_bin` (for `binshift=0`).
+
+    Parameters
+    ----------
+    n_levels : int or None
+        Number of levels, see :func:`BinPyramid.from_binned`
+
+    See :func:`bin_photon_array` for a description of the other
+    parameters.
+
+    Returns
+    -------
+    pyramid : BinPyramid
+    """
+    binned = bin_photon_array(data, t_bin, binshift=binshift,
+                              outdtype=outdtype, total_time=total_time,
+                              callback=callback, cb_kwargs=cb_kwargs,
+                              workers=workers, index=index)
+    return BinPyramid.from_binned(binned, t_bin, binshift=binshift or 0,
+                                  n_levels=n_levels)
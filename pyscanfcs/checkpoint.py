@@ -0,0 +1,245 @@
+"""Absolute-time checkpoint index for photon streams
+
+A photon stream only contains the time differences between photon
+events. The :class:`CheckpointIndex` stores the cumulative time (in
+system clock ticks) and the byte offset in the file for every
+`every`-th event. It is saved as a sidecar file next to the .dat
+file (see :func:`sidecar_path`), which makes lookups of times and
+events O(log n) instead of O(n).
+"""
+import os
+import warnings
+import zipfile
+
+import numpy as np
+
+from . import openfile
+
+
+#: default number of events between two checkpoints
+EVERY = 65536
+
+
+class CheckpointIndex(object):
+    def __init__(self, path, times, offsets, every, n_events, total_time,
+                 system_clock, file_size=None, file_mtime=None):
+        """Sparse index of a photon stream
+
+        Parameters
+        ----------
+        path : str
+            Path to the indexed .dat file
+        times : ndarray (uint64)
+            Cumulative time before each checkpoint event, i.e.
+            `times[j] = sum(data[:j*every])`
+        offsets : ndarray (uint64)
+            Byte offset of each checkpoint event in the .dat file
+        every : int
+            Number of events between two checkpoints
+        n_events : int
+            Total number of events
+        total_time : int
+            Total time of the measurement in system clock ticks
+        system_clock : int
+            System clock [MHz]
+        file_size, file_mtime : int
+            Size and modification time (ns) of the indexed file
+        """
+        self.path = path
+        self.times = np.asarray(times, dtype=np.uint64)
+        self.offsets = np.asarray(offsets, dtype=np.uint64)
+        self.every = int(every)
+        self.n_events = int(n_events)
+        self.total_time = int(total_time)
+        self.system_clock = system_clock
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    @classmethod
+    def build(cls, path, data=None, every=EVERY):
+        """Build the index of a .dat file
+
+        Parameters
+        ----------
+        path : str
+            Path to .dat file
+        data : ndarray (uint32) or None
+            The decoded photon stream of `path`. If None, the file
+            is decoded with :func:`openfile.iterDAT` (bounded memory).
+        every : int
+            Number of events between two checkpoints
+        """
+        with open(path, "rb") as filed:
+            _, system_clock = openfile._read_dat_header(filed)
+        if data is None:
+            sums = []
+            n_events = 0
+            for block in openfile.iterDAT(path, chunk_size=every):
+                sums.append(np.sum(block, dtype=np.uint64))
+                n_events += block.size
+            sums = np.array(sums, dtype=np.uint64)
+        else:
+            n_events = len(data)
+            starts = np.arange(0, n_events, every)
+            if n_events:
+                sums = np.add.reduceat(data, starts, dtype=np.uint64)
+            else:
+                sums = np.zeros(0, dtype=np.uint64)
+        times = np.zeros(sums.size, dtype=np.uint64)
+        np.cumsum(sums[:-1], out=times[1:])
+        stat = os.stat(path)
+        return cls(path=path,
+                   times=times,
+                   offsets=openfile._event_offsets(
+                       path, np.arange(sums.size) * every),
+                   every=every,
+                   n_events=n_events,
+                   total_time=np.sum(sums, dtype=np.uint64),
+                   system_clock=system_clock,
+                   file_size=stat.st_size,
+                   file_mtime=stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, path):
+        """Load the sidecar index of a .dat file
+
+        Returns None if there is no sidecar file, if the sidecar file
+        cannot be read (e.g. incomplete after a crash), or if the
+        .dat file was modified after the index was created.
+        """
+        spath = sidecar_path(path)
+        if not os.path.exists(spath):
+            return None
+        stat = os.stat(path)
+        try:
+            with np.load(spath) as arc:
+                if (int(arc["file_size"]) != stat.st_size or
+                        int(arc["file_mtime"]) != stat.st_mtime_ns):
+                    return None
+                return cls(path=path,
+                           times=arc["times"],
+                           offsets=arc["offsets"],
+                           every=arc["every"],
+                           n_events=arc["n_events"],
+                           total_time=arc["total_time"],
+                           system_clock=int(arc["system_clock"]),
+                           file_size=int(arc["file_size"]),
+                           file_mtime=int(arc["file_mtime"]))
+        except (OSError, ValueError, KeyError, EOFError,
+                zipfile.BadZipFile):
+            warnings.warn("Ignoring unreadable index file {}".format(spath))
+            return None
+
+    def save(self):
+        """Save the index as a sidecar file next to the .dat file
+
+        The index is written to a temporary file that replaces the
+        sidecar file, i.e. an existing sidecar file is never left
+        incomplete.
+
+        Returns the path of the sidecar file or None if it could not
+        be written (e.g. read-only directory).
+        """
+        spath = sidecar_path(self.path)
+        tmppath = spath + ".tmp"
+        try:
+            with open(tmppath, "wb") as fd:
+                np.savez(fd,
+                         times=self.times,
+                         offsets=self.offsets,
+                         every=self.every,
+                         n_events=self.n_events,
+                         total_time=np.uint64(self.total_time),
+                         system_clock=self.system_clock,
+                         file_size=self.file_size,
+                         file_mtime=self.file_mtime)
+            os.replace(tmppath, spath)
+        except OSError:
+            warnings.warn("Could not write index file {}".format(spath))
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            return None
+        return spath
+
+    def _block(self, jj, data=None):
+        """Return the events of checkpoint block `jj`"""
+        if data is not None:
+            return data[jj * self.every:(jj + 1) * self.every]
+        block, _ = openfile._read_events(self.path, self.offsets[jj],
+                                         count=self.every)
+        return block
+
+    def event_time(self, event, data=None):
+        """Absolute arrival time of a photon event
+
+        Parameters
+        ----------
+        event : int
+            Event index
+        data : ndarray (uint32) or None
+            The decoded photon stream; if None, the events are read
+            from the file.
+
+        Returns
+        -------
+        time : int
+            Arrival time in system clock ticks, `sum(data[:event+1])`
+        """
+        if not 0 <= event < self.n_events:
+            raise IndexError("Event {} out of range".format(event))
+        jj = event // self.every
+        block = self._block(jj, data)[:event - jj * self.every + 1]
+        return int(self.times[jj]) + int(np.sum(block, dtype=np.uint64))
+
+    def time_to_event(self, time, data=None):
+        """Index of the first photon event arriving at or after `time`
+
+        Parameters
+        ----------
+        time : int
+            Time in system clock ticks
+        data : ndarray (uint32) or None
+            The decoded photon stream; if None, the events are read
+            from the file.
+
+        Returns
+        -------
+        event : int
+            Event index; `n_events` if `time` is after the last event
+        """
+        if time > self.total_time:
+            return self.n_events
+        jj, _, _ = self.seek(time)
+        block = self._block(jj, data)
+        arrival = np.cumsum(block, dtype=np.uint64)
+        arrival += self.times[jj]
+        return jj * self.every + int(np.searchsorted(arrival, time))
+
+    def seek(self, time):
+        """Find the last checkpoint strictly before `time`
+
+        Parameters
+        ----------
+        time : int
+            Time in system clock ticks
+
+        Returns
+        -------
+        checkpoint : int
+            Checkpoint index; the first event after the checkpoint
+            is `checkpoint * every`
+        offset : int
+            Byte offset of the checkpoint event in the file
+        time : int
+            Cumulative time before the checkpoint event
+        """
+        jj = np.searchsorted(self.times, time, side="left") - 1
+        jj = max(int(jj), 0)
+        if jj >= self.times.size:
+            raise ValueError("Index is empty")
+        return jj, int(self.offsets[jj]), int(self.times[jj])
+
+
+def sidecar_path(path):
+    """Path of the sidecar index file of a .dat file"""
+    return path + ".idx.npz"
@@ -0,0 +1,124 @@
+"""Conversion of .dat files to the 32 bit format
+
+The 32 bit .dat format can be read by other tools without decoding.
+The conversion is done block by block with bounded memory usage and
+can be run for many files in parallel, either via the Python API or
+the command line::
+
+    pyscanfcs-convert -j 4 -o converted/ data/*.dat
+"""
+import argparse
+import concurrent.futures
+import os
+
+import numpy as np
+
+from . import openfile
+
+
+def dat32_name(filename):
+    """Return a reasonable file name for the 32 bit version of a file
+
+    The channel suffix ("A.dat" or "B.dat") is preserved.
+    """
+    if filename[-5:] == "A.dat":
+        return filename[:-5] + "_32bit_A.dat"
+    elif filename[-5:] == "B.dat":
+        return filename[:-5] + "_32bit_B.dat"
+    else:
+        return os.path.splitext(filename)[0] + "_32bit.dat"
+
+
+def convert_dat(path, outpath=None, chunk_size=4194304):
+    """Convert a .dat file to the 32 bit format
+
+    Parameters
+    ----------
+    path : str
+        Path to a .dat file (8, 16, or 32 bit)
+    outpath : str or None
+        Output path; defaults to :func:`dat32_name` of `path`
+    chunk_size : int
+        Number of photon events converted at a time
+
+    Returns
+    -------
+    outpath : str
+        Path of the converted file
+    """
+    if outpath is None:
+        outpath = dat32_name(path)
+    # only the header is read (probeDAT would scan the whole file)
+    with open(path, "rb") as filed:
+        _, system_clock = openfile._read_dat_header(filed)
+    # Write to a temporary file first, so that there are no incomplete
+    # output files if the conversion fails.
+    tmppath = outpath + ".tmp"
+    try:
+        with open(tmppath, "wb") as fd:
+            fd.write(np.array([32, system_clock],
+                              dtype=np.uint8).tobytes())
+            for data in openfile.iterDAT(path, chunk_size=chunk_size):
+                data.astype("<u4", copy=False).tofile(fd)
+        os.replace(tmppath, outpath)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+    return outpath
+
+
+def convert_many(paths, outdir=None, workers=None, chunk_size=4194304):
+    """Convert many .dat files to the 32 bit format in parallel
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths to .dat files
+    outdir : str or None
+        Output directory; defaults to the directory of each file
+    workers : int or None
+        Number of files converted in parallel; defaults to the
+        number of CPUs
+    chunk_size : int
+        Number of photon events converted at a time per file
+
+    Returns
+    -------
+    outpaths : list of str
+        Paths of the converted files
+    """
+    outpaths = []
+    for path in paths:
+        outpath = dat32_name(path)
+        if outdir is not None:
+            outpath = os.path.join(outdir, os.path.basename(outpath))
+        outpaths.append(outpath)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(convert_dat, p, o, chunk_size)
+                   for p, o in zip(paths, outpaths)]
+        return [f.result() for f in futures]
+
+
+def main(args=None):
+    """Command line interface for the conversion to 32 bit .dat files"""
+    parser = argparse.ArgumentParser(
+        description="Convert .dat photon stream files to the 32 bit "
+                    "format with bounded memory usage.")
+    parser.add_argument("paths", metavar="FILE", nargs="+",
+                        help="input .dat files")
+    parser.add_argument("-o", "--outdir", default=None,
+                        help="output directory (default: next to the "
+                             "input files)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of files converted in parallel")
+    args = parser.parse_args(args)
+    if args.outdir is not None:
+        os.makedirs(args.outdir, exist_ok=True)
+    outpaths = convert_many(args.paths, outdir=args.outdir,
+                            workers=args.jobs)
+    for path, outpath in zip(args.paths, outpaths):
+        print("{} -> {}".format(path, outpath))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Compiled decoders for the "Flex02-12D" .dat photon stream format"""
+import numpy as np
+
+cimport cython
+from libc.stdint cimport uint8_t, uint16_t, uint32_t
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _count_16bit(const uint16_t[::1] words,
+                             Py_ssize_t *consumed) noexcept nogil:
+    cdef Py_ssize_t n = words.shape[0]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    while i < n:
+        if words[i] == 0xFFFF:
+            if i + 2 >= n:
+                # incomplete escape sequence
+                break
+            i += 3
+        else:
+            i += 1
+        j += 1
+    consumed[0] = i
+    return j
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _decode_16bit(const uint16_t[::1] words, uint32_t[::1] out,
+                              Py_ssize_t *consumed) noexcept nogil:
+    cdef Py_ssize_t n = words.shape[0]
+    cdef Py_ssize_t nout = out.shape[0]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef uint16_t v
+    while i < n and j < nout:
+        v = words[i]
+        if v == 0xFFFF:
+            if i + 2 >= n:
+                # incomplete escape sequence
+                break
+            out[j] = words[i + 1] | (<uint32_t>words[i + 2] << 16)
+            i += 3
+        else:
+            out[j] = v
+            i += 1
+        j += 1
+    consumed[0] = i
+    return j
+
+
+def count_16bit(words):
+    """Count the photon events in 16 bit .dat data
+
+    Parameters
+    ----------
+    words : ndarray (uint16)
+        16 bit words of the photon stream (without the header)
+
+    Returns
+    -------
+    n_events : int
+        Number of complete photon events
+    consumed : int
+        Number of words used by these events; smaller than
+        `len(words)` if the data end with an incomplete escape
+        sequence.
+    """
+    cdef Py_ssize_t consumed
+    cdef const uint16_t[::1] w = np.ascontiguousarray(words,
+                                                      dtype=np.uint16)
+    with nogil:
+        n_events = _count_16bit(w, &consumed)
+    return n_events, consumed
+
+
+def decode_16bit(words, out=None):
+    """Decode 16 bit .dat data in a single pass
+
+    Each 16 bit word is a photon event, unless it is 0xFFFF, in which
+    case the following two words (little endian) form a 32 bit photon
+    event. The decoded events are written directly to `out`.
+
+    Parameters
+    ----------
+    words : ndarray (uint16)
+        16 bit words of the photon stream (without the header)
+    out : ndarray (uint32) or None
+        Preallocated output array. If None, an array with the exact
+        size is allocated (using :func:`count_16bit`). Decoding stops
+        when `out` is full.
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        The decoded photon events (a view of `out`)
+    consumed : int
+        Number of words that were decoded
+    """
+    cdef Py_ssize_t consumed
+    cdef Py_ssize_t n_events
+    cdef const uint16_t[::1] w = np.ascontiguousarray(words,
+                                                      dtype=np.uint16)
+    cdef uint32_t[::1] o
+    if out is None:
+        n_events, _ = count_16bit(w)
+        out = np.empty(n_events, dtype=np.uint32)
+    o = out
+    with nogil:
+        n_events = _decode_16bit(w, o, &consumed)
+    return out[:n_events], consumed
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _find_invalid(const uint32_t[::1] data, uint32_t limit,
+                              Py_ssize_t max_zero_run,
+                              Py_ssize_t *n_zero,
+                              Py_ssize_t *n_large) noexcept nogil:
+    cdef Py_ssize_t n = data.shape[0]
+    cdef Py_ssize_t i
+    cdef Py_ssize_t first = -1
+    cdef Py_ssize_t run = 0
+    cdef uint32_t v
+    for i in range(n):
+        v = data[i]
+        # unsigned wrap-around: zero becomes the largest value
+        if <uint32_t>(v - 1) >= limit:
+            if v == 0:
+                n_zero[0] += 1
+                run += 1
+                if run > max_zero_run and first < 0:
+                    # first event of the run of zeros
+                    first = i - run + 1
+                continue
+            n_large[0] += 1
+            if first < 0:
+                first = i
+        run = 0
+    return first
+
+
+def find_invalid(data, max_interval=None, max_zero_run=0):
+    """Find implausible photon arrival time differences
+
+    Parameters
+    ----------
+    data : ndarray (uint32)
+        Photon arrival time differences
+    max_interval : int or None
+        Time differences larger than this value are implausible
+    max_zero_run : int
+        Runs of more than `max_zero_run` consecutive zero time
+        differences are implausible
+
+    Returns
+    -------
+    n_zero : int
+        Number of zero time differences
+    n_large : int
+        Number of time differences larger than `max_interval`
+    first_invalid : int or None
+        Index of the first implausible time difference (the first
+        event of a run of zeros)
+    """
+    cdef Py_ssize_t n_zero = 0
+    cdef Py_ssize_t n_large = 0
+    cdef Py_ssize_t first
+    cdef Py_ssize_t zero_run = max_zero_run
+    cdef uint32_t limit = 0xFFFFFFFF
+    cdef const uint32_t[::1] d = np.ascontiguousarray(data,
+                                                      dtype=np.uint32)
+    if max_interval is not None:
+        limit = min(max_interval, 0xFFFFFFFF)
+    with nogil:
+        first = _find_invalid(d, limit, zero_run, &n_zero, &n_large)
+    if first < 0:
+        return n_zero, n_large, None
+    return n_zero, n_large, first
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _varint_decode(const uint8_t[::1] raw,
+                               uint32_t[::1] out) noexcept nogil:
+    cdef Py_ssize_t n = raw.shape[0]
+    cdef Py_ssize_t nout = out.shape[0]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t j = 0
+    cdef uint32_t value = 0
+    cdef uint32_t more
+    cdef unsigned int shift = 0
+    cdef uint8_t b
+    # branchless: the continuation bit is not predictable
+    while i < n and j < nout:
+        b = raw[i]
+        value |= <uint32_t>(b & 0x7F) << (shift & 31)
+        out[j] = value
+        more = b >> 7
+        j += 1 - more
+        value *= more
+        shift = (shift + 7) * more
+        i += 1
+    return j
+
+
+def varint_decode(raw, out=None):
+    """Decode LEB128 variable-length integers in a single pass
+
+    Parameters
+    ----------
+    raw : ndarray (uint8)
+        Encoded data; a trailing incomplete integer is ignored
+    out : ndarray (uint32) or None
+        Preallocated output array. If None, an array with the exact
+        size is allocated. Decoding stops when `out` is full.
+
+    Returns
+    -------
+    values : ndarray (uint32)
+        The decoded integers (a view of `out`)
+    """
+    cdef Py_ssize_t n_values
+    cdef const uint8_t[::1] r = np.ascontiguousarray(raw, dtype=np.uint8)
+    cdef uint32_t[::1] o
+    if out is None:
+        out = np.empty(np.count_nonzero(np.asarray(r) < 0x80),
+                       dtype=np.uint32)
+    o = out
+    with nogil:
+        n_values = _varint_decode(r, o)
+    return out[:n_values]
@@ -0,0 +1,207 @@
+"""Chunked writer for binned kymographs in the .fits format
+
+The kymograph (lines x bins per line) is written in blocks of lines
+and stored with the smallest integer type that fits the data (8 bit
+unsigned, 16 bit or 32 bit signed integers, without scaling). Lines
+can be appended while the binning is in progress; the image size in
+the header is updated when the file is closed.
+"""
+import os
+
+import numpy as np
+
+
+#: FITS data types in the order of their size (BITPIX, dtype)
+DTYPES = [(8, np.dtype(">u1")),
+          (16, np.dtype(">i2")),
+          (32, np.dtype(">i4")),
+          ]
+
+#: FITS files consist of blocks of 2880 bytes
+BLOCK = 2880
+
+
+class FITSWriter(object):
+    def __init__(self, path, bins_per_line, system_clock, line_time,
+                 bin_time, bin_shift=0, total_time=None, bitpix=8):
+        """Write a binned kymograph to a .fits file
+
+        Parameters
+        ----------
+        path : str
+            Output path
+        bins_per_line : int
+            Number of bins per line (image width)
+        system_clock : float
+            System clock [MHz]
+        line_time : float
+            Time for each line scan in system clock ticks
+        bin_time : float
+            Time for each bin in system clock ticks
+        bin_shift : int
+            Empty bins before actual binning of data
+        total_time : float or None
+            Total time in system clock ticks
+        bitpix : int
+            Initial data type (8, 16, or 32); the data type is widened
+            automatically when larger values are appended.
+
+        Notes
+        -----
+        The data are written to the temporary file `path + ".tmp"`,
+        which replaces `path` when :func:`FITSWriter.close` is
+        called (an existing file at `path`, e.g. a memory-mapped
+        kymograph, is not modified before). An incomplete last line
+        is padded with zeros.
+        """
+        self.path = path
+        self.bins_per_line = int(bins_per_line)
+        self.cards = [("SysClck", system_clock, "System clock [MHz]"),
+                      ("Tcycle", line_time,
+                       "Time for each linescan in system clock ticks"),
+                      ("Tbin", bin_time,
+                       "Time for each bin in system clock ticks"),
+                      ("Binshift", bin_shift,
+                       "Empty bins before actual binning of data"),
+                      ]
+        if total_time is not None:
+            self.cards.insert(1, ("Total", total_time,
+                                  "Total time in system clock ticks"))
+        self.bitpix = bitpix
+        self.n_lines = 0
+        self._rest = np.zeros(0, dtype=np.int64)
+        self._tmppath = path + ".tmp"
+        self._fd = open(self._tmppath, "w+b")
+        self._header_size = self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            # do not replace `path` with an incomplete file
+            self._fd.close()
+            os.remove(self._tmppath)
+
+    @property
+    def dtype(self):
+        return dict(DTYPES)[self.bitpix]
+
+    def _header(self):
+        import astropy.io.fits
+
+        header = astropy.io.fits.Header()
+        header["SIMPLE"] = True
+        header["BITPIX"] = self.bitpix
+        header["NAXIS"] = 2
+        header["NAXIS1"] = self.bins_per_line
+        header["NAXIS2"] = self.n_lines
+        header["EXTEND"] = True
+        for key, value, comment in self.cards:
+            header[key] = (value, comment)
+        return header.tostring().encode("ascii")
+
+    def _write_header(self):
+        raw = self._header()
+        self._fd.seek(0)
+        self._fd.write(raw)
+        return len(raw)
+
+    def _widen(self, bitpix):
+        """Rewrite the data with a larger data type"""
+        olddtype = self.dtype
+        self.bitpix = bitpix
+        tmppath = self.path + ".widen.tmp"
+        with open(tmppath, "w+b") as fd:
+            fd.write(self._header())
+            self._fd.seek(self._header_size)
+            nlines = max(1, 1048576 // self.bins_per_line)
+            for _ in range(0, self.n_lines, nlines):
+                data = np.fromfile(self._fd, dtype=olddtype,
+                                   count=nlines * self.bins_per_line)
+                data.astype(self.dtype).tofile(fd)
+        self._fd.close()
+        os.replace(tmppath, self._tmppath)
+        self._fd = open(self._tmppath, "r+b")
+        self._fd.seek(0, 2)
+
+    def append(self, data):
+        """Append binned data
+
+        Parameters
+        ----------
+        data : ndarray
+            1D intensity data (continuation of the previously appended
+            data, which does not have to end at a line boundary) or
+            2D array of lines
+        """
+        data = np.asarray(data).reshape(-1)
+        if data.size == 0:
+            return
+        if data.min() < 0:
+            raise ValueError("Negative values cannot be stored!")
+        maxval = int(data.max())
+        for bitpix, dtype in DTYPES:
+            if bitpix < self.bitpix:
+                continue
+            if maxval <= np.iinfo(dtype).max:
+                break
+        else:
+            raise ValueError("Values exceed 32 bit: {}".format(maxval))
+        if bitpix != self.bitpix:
+            self._widen(bitpix)
+        if self._rest.size:
+            data = np.concatenate((self._rest, data))
+        nfull = data.size - data.size % self.bins_per_line
+        data[:nfull].astype(self.dtype).tofile(self._fd)
+        self.n_lines += nfull // self.bins_per_line
+        self._rest = data[nfull:].copy()
+
+    def close(self):
+        """Write the last line and update the header"""
+        if self._fd.closed:
+            return
+        if self._rest.size:
+            padded = np.zeros(self.bins_per_line, dtype=self.dtype)
+            padded[:self._rest.size] = self._rest
+            padded.tofile(self._fd)
+            self.n_lines += 1
+            self._rest = np.zeros(0, dtype=np.int64)
+        # pad the data to full blocks
+        size = self.n_lines * self.bins_per_line * self.dtype.itemsize
+        self._fd.write(b"\x00" * (-size % BLOCK))
+        if self._write_header() != self._header_size:
+            raise ValueError("Header size changed!")
+        self._fd.close()
+        os.replace(self._tmppath, self.path)
+
+
+def save_fits(path, intdata, bins_per_line, chunk_size=1048576, **kwargs):
+    """Write a kymograph to a .fits file block by block
+
+    Parameters
+    ----------
+    path : str
+        Output path
+    intdata : ndarray
+        1D intensity data (e.g. memory-mapped)
+    bins_per_line : int
+        Number of bins per line
+    chunk_size : int
+        Approximate number of bins written at a time
+    **kwargs : dict
+        Metadata, see :class:`FITSWriter`
+    """
+    # smallest data type for the whole data set (avoids rewriting)
+    maxval = 0
+    for ii in range(0, len(intdata), chunk_size):
+        maxval = max(maxval, int(np.max(intdata[ii:ii + chunk_size])))
+    for bitpix, dtype in DTYPES:
+        if maxval <= np.iinfo(dtype).max:
+            break
+    chunk = max(1, chunk_size // bins_per_line) * bins_per_line
+    with FITSWriter(path, bins_per_line, bitpix=bitpix, **kwargs) as fw:
+        for ii in range(0, len(intdata), chunk):
+            fw.append(intdata[ii:ii + chunk])
@@ -1,6 +1,7 @@
 import csv
 import os
 import platform
+import shutil
 import sys
 import tempfile
 import traceback
@@ -17,7 +18,6 @@ from matplotlib.widgets import RectangleSelector
 from matplotlib.patches import Rectangle
 import matplotlib.pyplot as plt
 
-import astropy.io.fits as pyfits
 import multipletau
 import numpy as np
 from scipy.fftpack import fft
@@ -26,9 +26,15 @@ import wx.adv
 from wx.lib.agw import floatspin
 from wx.lib.scrolledpanel import ScrolledPanel
 
+from .. import convert
+from .. import fitsfile
 from .. import fitting
+from .. import kymostore
 from .. import openfile
-from .. import bin_pe
+from .. import preview
+from .. import binning
+from .. import multistream
+from .. import streamcache
 from .. import util
 
 from . import doc
@@ -37,6 +43,9 @@ from . import misc
 from . import uilayer
 
 
+#: maximum number of bins for finding the line time (FFT)
+FFT_LENGTH = 2**22
+
 
 ########################################################################
 class ExceptionDialog(wx.MessageDialog):
@@ -297,7 +306,16 @@ class MyFrame(wx.Frame):
         self.t_linescan = None
         self.t_bin = None
         self.datData = None
+        # Checkpoint index of the photon stream (absolute times)
+        self.datIndex = None
         self.intData = None
+        # All channels of binned data with several channels (LSM)
+        self.intDataChannels = None
+        # Binning pyramid of prebinned data (coarser bin times)
+        self.intPyramid = None
+        # Temporary directory of the binned data (kymograph stores)
+        self.binned_dir = None
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.bins_per_line = None
         self.percent = 0.  # correction factor for cycle time
 
@@ -311,10 +329,6 @@ class MyFrame(wx.Frame):
         # List of absolute filenames that contain bleaching info
         self.file_bleach_profile = list()
 
-        # Temporary filenames for binned intensity
-        self.tempbintot = tempfile.mktemp("_binned_total.int")
-        self.tempbinpar = tempfile.mktemp("_binned_partial.int")
-
         # We try to work with a cache to save time.
         self.cache = dict()
         # Each element of the cache is a filename connected to some data
@@ -322,6 +336,11 @@ class MyFrame(wx.Frame):
         # cachetest["bins_per_line"] = self.bins_per_line
         # cachetest["linetime"] = self.t_linescan
         # cachetest["data"] = self.intData
+        # Persistent cache for decoded photon streams
+        try:
+            self.stream_cache = streamcache.StreamCache()
+        except OSError:
+            self.stream_cache = None
         self.Update()
         # Set window icon
         try:
@@ -334,7 +353,7 @@ class MyFrame(wx.Frame):
             self.OnMenuSupport()
 
 
-    def AddToCache(self, Data, cachename, background=False):
+    def AddToCache(self, Data, cachename, background=False, pyramid=None):
         if list(self.cache.keys()).count(cachename) == 0:
             # Add the menu entry
             menu = self.cachemenu.Append(
@@ -344,11 +363,33 @@ class MyFrame(wx.Frame):
                 menu.Check(True)
             # OnSelectCache plots the selected Cache element
             self.Bind(wx.EVT_MENU, self.OnSelectCache, menu)
+        else:
+            old = self.cache[cachename]["data"]
+            if (isinstance(old, kymostore.KymographStore) and
+                    old is not Data):
+                # remove the binned data of the replaced entry (fails
+                # silently on Windows if it is still memory-mapped)
+                shutil.rmtree(old.directory, ignore_errors=True)
         acache = dict()
-        acache["data"] = 1 * Data
+        if isinstance(Data, kymostore.KymographStore):
+            # read-only, no copy required
+            acache["data"] = Data
+        else:
+            acache["data"] = 1 * Data
+        if pyramid is not None:
+            # coarse levels of the binned data
+            pyramid = binning.BinPyramid(
+                [acache["data"]] + pyramid.levels[1:],
+                t_bin=pyramid.t_bin, binshift=pyramid.binshift)
+        acache["pyramid"] = pyramid
         acache["bins_per_line"] = self.bins_per_line
         acache["linetime"] = self.t_linescan
         acache["dirname"] = self.dirname
+        # Files of a split acquisition
+        acache["paths"] = None
+        if (not background and
+                isinstance(self.datData, multistream.ConcatenatedStream)):
+            acache["paths"] = self.datData.paths
         self.cache[cachename] = acache
 
     def Bin_All_Photon_Events(self, Data):
@@ -360,25 +401,35 @@ class MyFrame(wx.Frame):
         # t_bin in clock ticks
         t_bin = self.t_linescan / self.bins_per_line
         outdtype = np.uint16
-        outfile = self.tempbintot
+        if self.binned_dir is None:
+            # binned data of all files; removed when the frame is closed
+            self.binned_dir = tempfile.mkdtemp(prefix="pyscanfcs_binned_")
+
+        # The checkpoint index is only valid for the full photon stream
+        index = self.datIndex if Data is self.datData else None
 
         wxdlg = uilayer.wxdlg(parent=self, steps=100,
                               title="Binning photon events...")
 
-        print("Creating file {} ({})".format(outfile, outdtype.__name__))
-
-        bin_pe.bin_photon_events(Data, t_bin, binshift=eb,
-                                 outfile=outfile,
-                                 outdtype=outdtype,
-                                 callback=wxdlg.Iterate)
+        # Lines start at exact multiples of the line time. The lines
+        # are written to a chunked store while binning and are only
+        # read from disk when they are needed.
+        with kymostore.KymographWriter(
+                tempfile.mkdtemp(dir=self.binned_dir),
+                bins_per_line=self.bins_per_line,
+                bin_time=t_bin,
+                line_time=self.t_linescan,
+                bin_shift=eb,
+                system_clock=self.system_clock) as kw:
+            for lines in binning.iter_kymograph(Data, self.t_linescan,
+                                                self.bins_per_line,
+                                                binshift=eb,
+                                                outdtype=outdtype,
+                                                callback=wxdlg.Iterate,
+                                                index=index):
+                kw.append(lines)
         wxdlg.Finalize()
-
-        binneddata = np.fromfile(outfile, dtype=outdtype)
-
-        if np.max(binneddata) < 256:
-            # save memory
-            binneddata = np.uint8(binneddata)
-        return binneddata
+        return kymostore.KymographStore(kw.directory)
 
     def Bin_Photon_Events(self, n_events=None, t_bin=None):
         """
@@ -392,23 +443,29 @@ class MyFrame(wx.Frame):
         # t_bin in clock ticks
         self.t_bin = t_bin
         outdtype = np.uint16
-        outfile = self.tempbinpar
         eb = self.BoxPrebin[10].GetValue()  # 10 spin: bin shift
 
-        Data = self.datData[:n_events]
-
-        wxdlg = uilayer.wxdlg(parent=self, steps=100,
-                              title="Binning photon events...")
-
-        print("Creating file {} ({})".format(outfile, outdtype.__name__))
+        if self.BoxPrebin[11].GetValue():
+            # Windows spread over the entire measurement
+            binneddata, _ = preview.bin_windows(
+                self.datData, t_bin, self.bins_per_line, n_events,
+                binshift=eb, index=self.datIndex)
+        else:
+            Data = self.datData[:n_events]
 
-        bin_pe.bin_photon_events(Data, t_bin, binshift=eb,
-                                   outfile=outfile,
-                                   outdtype=outdtype,
-                                   callback=wxdlg.Iterate)
-        wxdlg.Finalize()
+            wxdlg = uilayer.wxdlg(parent=self, steps=100,
+                                  title="Binning photon events...")
 
-        binneddata = np.fromfile(outfile, dtype=outdtype)
+            if self.BoxPrebin[6].GetValue() and self.t_linescan is not None:
+                # Lines start at exact multiples of the line time
+                binneddata = binning.bin_kymograph(
+                    Data, self.t_linescan, self.bins_per_line, binshift=eb,
+                    outdtype=outdtype, callback=wxdlg.Iterate).reshape(-1)
+            else:
+                binneddata = binning.bin_photon_array(
+                    Data, t_bin, binshift=eb, outdtype=outdtype,
+                    callback=wxdlg.Iterate)
+            wxdlg.Finalize()
 
         if np.max(binneddata) < 256:
             # save memory
@@ -417,21 +474,27 @@ class MyFrame(wx.Frame):
         return binneddata
 
     def CorrectLineTime(self, event):
-        percent = np.float(self.linespin.GetValue())
+        percent = float(self.linespin.GetValue())
         if self.t_linescan is not None:
-            # Set the new linetime
-            self.t_linescan = np.float(self.t_linescan) * (1. + percent / 100.)
+            # Set the new linetime (used as is by the next binning)
+            self.t_linescan = float(self.t_linescan) * (1. + percent / 100.)
             self.percent = percent
             self.UpdateInfo()
 
     def GetTotalTime(self):
         """ 
         Sums over self.datData to find out the total time of the measurement.
+        Uses the checkpoint index self.datIndex if available.
         Sets variable self.T_total
         """
         # Need to set float variable here, because uint32 are not
         # large enough. T_total in system clocks.
-        self.T_total = np.sum(self.datData, dtype="float")
+        if self.datIndex is not None:
+            self.T_total = float(self.datIndex.total_time)
+        elif isinstance(self.datData, multistream.ConcatenatedStream):
+            self.T_total = float(self.datData.total_time())
+        else:
+            self.T_total = np.sum(self.datData, dtype="float")
         self.Update()
 
     def GetTraceFromIntData(self, intData, coords, title="Trace"):
@@ -463,12 +526,17 @@ class MyFrame(wx.Frame):
         # the array linewise later.
         traceData = np.zeros((bins_in_row, bins_in_col))
 
-        # We start from x1 (lowest time available) and
-        # successively fill the traceData array:
-        pos = x1 * self.bins_per_line
-        for i in np.arange(len(traceData)):
-            traceData[i] = intData[pos + y1:pos + y2]
-            pos = pos + self.bins_per_line
+        if (isinstance(intData, kymostore.KymographStore) and
+                intData.bins_per_line == self.bins_per_line):
+            # Only read the lines of the region from disk
+            traceData[:] = intData.read_lines(x1, x2)[:, y1:y2]
+        else:
+            # We start from x1 (lowest time available) and
+            # successively fill the traceData array:
+            pos = x1 * self.bins_per_line
+            for i in np.arange(len(traceData)):
+                traceData[i] = intData[pos + y1:pos + y2]
+                pos = pos + self.bins_per_line
 
         # Get the actual trace
         # Calculate trace from maximum
@@ -683,6 +751,13 @@ class MyFrame(wx.Frame):
                                    max=500000000, value="0")
         prespinshift.SetMinSize(minsize)
         presizer.Add(prespinshift)
+        # Checkbox for windows spread over the measurement
+        prespread = wx.CheckBox(self.buttonarea,
+                                label="Spread over measurement")
+        prespread.SetToolTip("Bin {} short windows distributed over the "
+                             "entire measurement instead of the first "
+                             "events.".format(preview.N_WINDOWS))
+        presizer.Add(prespread)
         # Button
         prebutt = wx.Button(self.buttonarea, label="Calculate and plot")
         self.Bind(wx.EVT_BUTTON, self.OnBinning_Prebin, prebutt)
@@ -699,6 +774,7 @@ class MyFrame(wx.Frame):
         self.BoxPrebin.append(self.prebpl)  # 8 spin: bins per line
         self.BoxPrebin.append(preshifttextt)  # 9 text: bin shift
         self.BoxPrebin.append(prespinshift)  # 10 spin: bin shift
+        self.BoxPrebin.append(prespread)    # 11 checkbox: spread windows
 
         # Total-binning
         binbox = wx.StaticBox(self.buttonarea, label="Total-binning")
@@ -979,9 +1055,11 @@ class MyFrame(wx.Frame):
         self.linespin.SetValue(0)
         # Calculate binned data
         self.intData = self.Bin_Photon_Events(n_events=n_events, t_bin=t_bin)
+        self.intPyramid = binning.BinPyramid.from_binned(
+            self.intData, t_bin, binshift=self.BoxPrebin[10].GetValue())
 
         # Add to cache
-        self.AddToCache(self.intData, self.filename)
+        self.AddToCache(self.intData, self.filename, pyramid=self.intPyramid)
 
         # Then Plot the data somehow
         self.Update()
@@ -1003,6 +1081,7 @@ class MyFrame(wx.Frame):
         self.linespin.SetValue(0)
         # Calculate binned data
         self.intData = self.Bin_All_Photon_Events(self.datData)
+        self.intPyramid = None
 
         # Add to cache
         self.AddToCache(self.intData, self.filename)
@@ -1015,15 +1094,24 @@ class MyFrame(wx.Frame):
         Find the time that the confocal microscope uses to capture a line
         of data. This is done via FFT.
         """
+        if self.intPyramid is not None:
+            # Use a coarser bin time for long traces (the frequency
+            # resolution is the same).
+            level = self.intPyramid.level_for_length(FFT_LENGTH)
+            trace = self.intPyramid[level]
+            t_bin = self.intPyramid.bin_time(level)
+        else:
+            trace = self.intData
+            t_bin = self.t_bin
         # Fourier Transform
-        cnData = fft(self.intData)
+        cnData = fft(trace)
         N = len(cnData)
         # We only need positive/negative frequencies
         amplitude = np.abs(cnData[0:N // 2] * np.conjugate(cnData[0:N // 2]))
         #n_bins = len(self.intData)
 
         # Calculate the correct frequencies
-        rate = 1. / self.t_bin
+        rate = 1. / t_bin
         frequency = fftfreq(N)[0:N // 2] * rate
 
         if self.BoxLineScan[1].GetValue() == True:
@@ -1125,6 +1213,16 @@ class MyFrame(wx.Frame):
                 # defaults to linux style:
                 os.system("xdg-open " + filename + " &")
 
+    def OnClose(self, e=None):
+        # Remove the binned data
+        if self.binned_dir is not None:
+            self.cache = dict()
+            self.intData = None
+            shutil.rmtree(self.binned_dir, ignore_errors=True)
+            self.binned_dir = None
+        if e is not None:
+            e.Skip()
+
     def OnMenuExit(self, e=None):
         # Exit the Program
         self.Close(True)  # Close the frame.
@@ -1227,7 +1325,7 @@ class MyFrame(wx.Frame):
 
         # Define zip file name
         # filenamedummy is a non-wildcard filename
-        wildcards = ["A.dat", ".dat", "A.fits", ".fits"]
+        wildcards = ["A.dat", ".dat", "A.fits", ".fits", ".lsm"]
         filenamedummy = self.filename
         for card in wildcards:
             lwc = len(card)
@@ -1247,12 +1345,10 @@ class MyFrame(wx.Frame):
             if self.filename[-6:] == "A.fits":
                 # Open fits file and load second intData
                 filename = self.filename[:-6] + "B.fits"
-                fits = pyfits.open(os.path.join(self.dirname, filename))
-                series = fits[0]
-                intData2 = series.data
-                # Set proper 1D shape for intdata
-                length = self.intData2.shape[0] * self.intData2.shape[1]
-                intData2.shape = length
+                info = openfile.openFITS(os.path.join(self.dirname,
+                                                      filename))
+                # 1D view of the memory-mapped data
+                intData2 = info["data_binned"].reshape(info["size"])
             elif self.filename[-5:] == "A.dat":
                 # Check if we have B.dat in the cache
                 #
@@ -1269,22 +1365,37 @@ class MyFrame(wx.Frame):
                     # Open B.dat and add to cache
                     path = os.path.join(self.dirname, filename)
 
-                    wxdlg = uilayer.wxdlg(parent=self, steps=3,
-                                          title="Importing dat file...")
-                    datData2 = openfile.openDAT(
-                        path, callback=wxdlg.Iterate)["data_stream"]
-                    wxdlg.Finalize()
+                    if isinstance(self.datData,
+                                  multistream.ConcatenatedStream):
+                        # B channel of a split acquisition
+                        datData2 = multistream.ConcatenatedStream(
+                            [p[:-5] + "B.dat" for p in self.datData.paths],
+                            mmap=True, cache=self.stream_cache)
+                    else:
+                        wxdlg = uilayer.wxdlg(parent=self, steps=3,
+                                              title="Importing dat file...")
+                        datData2 = openfile.openDAT(
+                            path, callback=wxdlg.Iterate, mmap=True,
+                            cache=self.stream_cache)["data_stream"]
+                        wxdlg.Finalize()
 
                     # Bin to obtain intData2
                     intData2 = self.Bin_All_Photon_Events(datData2)
                     # Add to cache
                     self.AddToCache(intData2, filename, background=True)
                 else:
-                    intData2 = 1 * bcache["data"]
-
+                    intData2 = bcache["data"]
+                    if not isinstance(intData2, kymostore.KymographStore):
+                        intData2 = 1 * intData2
+
+            elif (self.intDataChannels is not None and
+                  len(self.intDataChannels) > 1):
+                # Second channel of an LSM file
+                intData2 = self.intDataChannels[1]
             else:
                 # We should not be here.
-                print("No A.dat or A.fits file opened. Aborting.")
+                print("No A.dat, A.fits, or two-channel .lsm file opened. "
+                      "Aborting.")
                 return
 
         # Start plotting?
@@ -1495,13 +1606,25 @@ class MyFrame(wx.Frame):
             #self.filename = dlg.GetFilename()
             #self.dirname = dlg.GetDirectory()
 
-            info = openfile.openAny(os.path.join(self.dirname, self.filename))
+            path = os.path.join(self.dirname, self.filename)
+            if openfile.detect_format(path) == "lsm":
+                # read all channels at once for two-colour correlation
+                info = openfile.openAny(path, channels="all")
+                self.intDataChannels = [d.reshape(info["size"]) for d in
+                                        info["data_binned_channels"]]
+            else:
+                info = openfile.openAny(path)
+                self.intDataChannels = None
 
             print(info)
 
             self.imgData = None
-            self.intData = info["data_binned"]
+            # Set proper 1D shape for intdata (a view of memory-mapped
+            # data is not copied)
+            self.intData = info["data_binned"].reshape(info["size"])
+            self.intPyramid = None
             self.datData = None
+            self.datIndex = None
 
             # Set all variables
             self.system_clock = info['system_clock']
@@ -1516,9 +1639,6 @@ class MyFrame(wx.Frame):
             self.prebpl.SetValue(self.bins_per_line)
 
             # Plot
-            # Set proper 1D shape for intdata
-            length = info["size"]
-            self.intData.shape = length
             self.Update()
             self.PlotImage()
 
@@ -1561,13 +1681,34 @@ class MyFrame(wx.Frame):
             #self.dirname = dlg.GetDirectory()
             filename = os.path.join(self.dirname, self.filename)
 
-            wxdlg = uilayer.wxdlg(parent=self, steps=3,
-                                  title="Importing photon stream...")
-            info = openfile.openAny(filename, callback=wxdlg.Iterate)
-            self.system_clock = info["system_clock"]
-            self.datData = info["data_stream"]
-
-            wxdlg.Finalize()
+            paths = multistream.find_split_files(filename)
+            if len(paths) > 1:
+                msg = ("Found {} consecutive files of a split acquisition "
+                       "starting with\n{}\n\nOpen them as one photon "
+                       "stream?").format(len(paths), self.filename)
+                dlgsplit = wx.MessageDialog(self, msg, "Split acquisition",
+                                            wx.YES_NO | wx.ICON_QUESTION)
+                if dlgsplit.ShowModal() != wx.ID_YES:
+                    paths = [filename]
+
+            if len(paths) > 1:
+                # Files are decoded lazily
+                self.datData = multistream.ConcatenatedStream(
+                    paths, mmap=True, cache=self.stream_cache)
+                self.system_clock = self.datData.system_clock
+                self.datIndex = None
+            else:
+                wxdlg = uilayer.wxdlg(parent=self, steps=3,
+                                      title="Importing photon stream...")
+                info = openfile.openAny(filename, callback=wxdlg.Iterate,
+                                        mmap=True, index=True,
+                                        cache=self.stream_cache)
+                self.system_clock = info["system_clock"]
+                self.datData = info["data_stream"]
+                self.datIndex = info.get("index", None)
+
+                wxdlg.Finalize()
+            self.intDataChannels = None
             self.GetTotalTime()
             self.Update()
 
@@ -1595,49 +1736,20 @@ class MyFrame(wx.Frame):
             (self.dirname, newfilename) = os.path.split(dlg.GetPath())
             #newfilename = dlg.GetFilename()
             #self.dirname = dlg.GetDirectory()
-            # Creating image array
-            M = len(self.intData)
-            Ny = self.bins_per_line
-            Nx = int(M / Ny) + 1
-            # Plotting data will have some zeros at the end
-            plotdata = np.zeros(Nx * Ny)
-            # Check for maximum in self.intData
-            maxint = np.max(self.intData)
-            if maxint < 256:
-                plotdata = np.uint8(plotdata)
-                plotdata[0:M] = np.uint8(self.intData)
-            else:
-                plotdata[0:M] = self.intData
-            plotdata.shape = (Nx, Ny)
-            hdu = pyfits.PrimaryHDU(plotdata)
-            hdulist = pyfits.HDUList([hdu])
-            header = hdulist[0].header
-            # Add some constants:
-            cards = []
-            cards.append(pyfits.Card('SysClck', self.system_clock,
-                                     "System clock [MHz]"))
-            if self.T_total is not None:
-                cards.append(pyfits.Card('Total', self.T_total,
-                                         "Total time in system clock ticks"))
             if self.t_linescan is not None:
                 t_linescan = self.t_linescan
             else:
                 t_linescan = self.t_bin * len(self.imgData)
-
-            cards.append(pyfits.Card('Tcycle', t_linescan,
-                                     "Time for each linescan in system clock ticks"))
-            cards.append(pyfits.Card('Tbin', self.t_bin,
-                                     "Time for each bin in system clock ticks"))
-            eb = self.BoxPrebin[10].GetValue()
-            cards.append(pyfits.Card('Binshift', eb,
-                                     "Empty bins before actual binning of data"))
-
-            for c in cards:
-                c.verify()
-                header.update(c.key, c.value, c.comment)
-            # clobber=True: Overwrites file.
-            hdulist.writeto(os.path.join(
-                self.dirname, newfilename), clobber=True)
+            # The data are written in blocks of lines with the
+            # smallest integer type.
+            fitsfile.save_fits(os.path.join(self.dirname, newfilename),
+                               self.intData,
+                               bins_per_line=self.bins_per_line,
+                               system_clock=self.system_clock,
+                               line_time=t_linescan,
+                               bin_time=self.t_bin,
+                               bin_shift=self.BoxPrebin[10].GetValue(),
+                               total_time=self.T_total)
 
     def OnSaveDat(self, e=None):
         # Save the Data
@@ -1654,12 +1766,7 @@ class MyFrame(wx.Frame):
             time = 4 bytes/system clock
         """
         # Make a reasonable 32bit filename
-        if self.filename[-5:] == "A.dat":
-            newfilename = self.filename[:-5] + "_32bit_A.dat"
-        elif self.filename[-5:] == "B.dat":
-            newfilename = self.filename[:-5] + "_32bit_B.dat"
-        else:
-            newfilename = self.filename[:-4] + "_32bit.dat"
+        newfilename = convert.dat32_name(self.filename)
         dlg = wx.FileDialog(self, "Choose a data file", self.dirname, newfilename,
                             "DAT files (*.dat)|*.dat;*.daT;*.dAt;*.dAT;*.Dat;*.DaT;*.DAt;*.DAT",
                             wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
@@ -1696,17 +1803,30 @@ class MyFrame(wx.Frame):
         if linetime is not None:
             self.BoxInfo[2].SetValue(str(linetime / self.system_clock / 1e3))
         self.t_linescan = linetime
-        self.intData = 1 * cache["data"]
+        self.intData = cache["data"]
+        if not isinstance(self.intData, kymostore.KymographStore):
+            self.intData = 1 * self.intData
+        self.intDataChannels = None
+        self.intPyramid = cache.get("pyramid", None)
         self.filename = cachename
         self.dirname = cache["dirname"]
         filename = os.path.join(self.dirname, self.filename)
 
-        wxdlg = uilayer.wxdlg(parent=self, steps=3,
-                              title="Importing dat file...")
-        info = openfile.openDAT(filename, callback=wxdlg.Iterate)
-        self.system_clock = info["system_clock"]
-        self.datData = info["data_stream"]
-        wxdlg.Finalize()
+        if cache.get("paths", None) is not None:
+            self.datData = multistream.ConcatenatedStream(
+                cache["paths"], mmap=True, cache=self.stream_cache)
+            self.system_clock = self.datData.system_clock
+            self.datIndex = None
+        else:
+            wxdlg = uilayer.wxdlg(parent=self, steps=3,
+                                  title="Importing dat file...")
+            info = openfile.openAny(filename, callback=wxdlg.Iterate,
+                                    mmap=True, index=True,
+                                    cache=self.stream_cache)
+            self.system_clock = info["system_clock"]
+            self.datData = info["data_stream"]
+            self.datIndex = info.get("index", None)
+            wxdlg.Finalize()
 
         self.GetTotalTime()
         self.Update()
@@ -1741,7 +1861,7 @@ class MyFrame(wx.Frame):
         # Calculate how much percent that is
         percent = delta * 100.
 
-        self.linespin.SetValue(np.float(percent))
+        self.linespin.SetValue(float(percent))
         self.percent = percent
         self.CorrectLineTime(event=None)
 
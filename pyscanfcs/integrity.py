@@ -0,0 +1,208 @@
+"""Integrity checks and salvage of .dat photon stream files
+
+Interrupted acquisitions may leave .dat files that end in the middle
+of a photon event (e.g. an incomplete 16 bit escape sequence) and
+corrupted files may contain implausible time differences.
+:func:`scan_dat` decodes a file and validates it in a few vectorized
+passes, :func:`salvage_dat` returns the consistent part of the photon
+stream.
+"""
+import os
+
+import numpy as np
+
+from . import openfile
+
+
+#: default number of consecutive zero time differences that are
+#: still plausible (e.g. photon events in the same clock tick)
+MAX_ZERO_RUN = 1
+
+
+def scan_dat(path, max_interval=None, max_zero_run=MAX_ZERO_RUN,
+             workers=None):
+    """Decode and validate a .dat file
+
+    Parameters
+    ----------
+    path : str
+        Path to .dat file
+    max_interval : int or None
+        Time differences (system clock ticks) larger than this value
+        are considered implausible
+    max_zero_run : int
+        Runs of more than `max_zero_run` consecutive zero time
+        differences are considered implausible; set to 0 to reject
+        every zero time difference
+    workers : int or None
+        Number of threads for decoding 16 bit files, see
+        :func:`openfile.openDAT`
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        All complete photon events of the file
+    report : dict
+        Result of the scan with the keys
+
+        - "format", "system_clock": from the file header
+        - "n_events": number of complete photon events
+        - "trailing_bytes": bytes at the end of the file that do not
+          form a complete photon event (incomplete words, incomplete
+          16 bit escape sequences)
+        - "truncated_escape": whether the file ends with an incomplete
+          16 bit escape sequence
+        - "zero_intervals", "large_intervals": number of zero and
+          of implausibly large time differences
+        - "first_invalid": index of the first event with an
+          implausible time difference or of the first event of an
+          implausible run of zeros (None if there is none)
+        - "last_consistent": index of the last event before
+          "first_invalid" (-1 if there is none)
+        - "ok": True if the file has no defects
+    """
+    with open(path, "rb") as filed:
+        fformat, system_clock = openfile._read_dat_header(filed)
+    if system_clock == 0:
+        raise ValueError("Invalid system clock in {}".format(path))
+    size = os.path.getsize(path) - 2
+    truncated_escape = False
+    if fformat == 32:
+        data = openfile._map_words(path, dtype="<u4")
+        trailing = size % 4
+    elif fformat == 16:
+        words = openfile._map_words(path, dtype="<u2")
+        if workers is None:
+            workers = os.cpu_count() if words.nbytes > 2**26 else 1
+        if workers > 1 and openfile.decode_dat is not None:
+            data, consumed = openfile._decode_16bit_parallel(words, workers)
+        else:
+            data, consumed = openfile._decode_16bit(words)
+        truncated_escape = consumed != words.size
+        trailing = size % 2 + 2 * (words.size - consumed)
+    elif fformat == 8:
+        # Trailing 0xFF bytes are not a defect (time passed without
+        # a photon event).
+        data, _ = openfile._decode_8bit(openfile._map_words(path,
+                                                            dtype="<u1"))
+        trailing = 0
+    else:
+        raise ValueError("Unknown format: {} bit".format(fformat))
+
+    n_zero, n_large, first_invalid = _find_invalid(
+        data, max_interval, max_zero_run=max_zero_run)
+
+    report = {"format": fformat,
+              "system_clock": system_clock,
+              "n_events": int(data.size),
+              "trailing_bytes": int(trailing),
+              "truncated_escape": truncated_escape,
+              "zero_intervals": n_zero,
+              "large_intervals": n_large,
+              "first_invalid": first_invalid,
+              "last_consistent": (data.size if first_invalid is None
+                                  else first_invalid) - 1,
+              }
+    report["ok"] = (trailing == 0 and first_invalid is None)
+    return data, report
+
+
+def salvage_dat(path, max_interval=None, max_zero_run=MAX_ZERO_RUN,
+                workers=None):
+    """Load the consistent part of a (damaged) .dat file
+
+    Incomplete events at the end of the file are ignored and the
+    photon stream is truncated before the first implausible time
+    difference, because the events after it cannot be trusted.
+
+    Parameters
+    ----------
+    path : str
+        Path to .dat file
+    max_interval, max_zero_run, workers
+        See :func:`scan_dat`
+
+    Returns
+    -------
+    info : dict
+        Dictionary containing the "system_clock" in MHz and the
+        "data_stream" (photon arrival time event stream), as
+        returned by :func:`openfile.openDAT`
+    report : dict
+        Report of :func:`scan_dat` with the additional key
+        "n_salvaged" (number of events in "data_stream")
+    """
+    data, report = scan_dat(path, max_interval=max_interval,
+                            max_zero_run=max_zero_run, workers=workers)
+    data = data[:report["last_consistent"] + 1]
+    report["n_salvaged"] = int(data.size)
+    info = {"data_stream": data,
+            "system_clock": report["system_clock"],
+            }
+    return info, report
+
+
+def _find_invalid(data, max_interval=None, max_zero_run=0,
+                  chunk_size=1048576):
+    """Find implausible time differences
+
+    Uses the compiled :func:`pyscanfcs.decode_dat.find_invalid` if
+    available. The NumPy fallback checks the data in blocks that fit
+    into the CPU cache with a single comparison per event:
+    subtracting one maps zero to the largest uint32 value, so that
+    zero and large time differences are found at once. Only blocks
+    that contain such time differences are inspected further.
+
+    Returns
+    -------
+    n_zero : int
+        Number of zero time differences
+    n_large : int
+        Number of time differences larger than `max_interval`
+    first_invalid : int or None
+        Index of the first implausible time difference (the first
+        event of a run of more than `max_zero_run` zeros)
+    """
+    if openfile.decode_dat is not None:
+        return openfile.decode_dat.find_invalid(data, max_interval,
+                                                max_zero_run)
+    if max_interval is None:
+        limit = np.uint32(0xFFFFFFFF)
+    else:
+        limit = np.uint32(min(max_interval, 0xFFFFFFFF))
+    n_zero = 0
+    n_large = 0
+    first_invalid = None
+    run = 0  # zeros at the end of the previous block
+    tmp = np.empty(chunk_size, dtype=np.uint32)
+    for ii in range(0, data.size, chunk_size):
+        block = data[ii:ii + chunk_size]
+        shifted = np.subtract(block, np.uint32(1), out=tmp[:block.size])
+        if (shifted < limit).all():
+            run = 0
+            continue
+        zero = block == 0
+        large = block > limit
+        n_zero += int(np.count_nonzero(zero))
+        n_large += int(np.count_nonzero(large))
+        candidates = []
+        if large.any():
+            candidates.append(ii + int(np.argmax(large)))
+        if zero.any():
+            # runs of zeros, continuing the run of the previous block
+            edges = np.flatnonzero(np.diff(np.concatenate(
+                ([0], zero.view(np.int8), [0]))))
+            starts = edges[::2] + ii
+            lengths = edges[1::2] - edges[::2]
+            if edges[0] == 0:
+                starts[0] -= run
+                lengths[0] += run
+            run = int(lengths[-1]) if edges[-1] == block.size else 0
+            long_runs = np.flatnonzero(lengths > max_zero_run)
+            if long_runs.size:
+                candidates.append(int(starts[long_runs[0]]))
+        else:
+            run = 0
+        if first_invalid is None and candidates:
+            first_invalid = min(candidates)
+    return n_zero, n_large, first_invalid
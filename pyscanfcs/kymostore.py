@@ -0,0 +1,272 @@
+"""Chunked on-disk store for binned kymographs
+
+A binned kymograph is a long 1D array of intensities that is
+interpreted as lines of `bins_per_line` bins. The
+:class:`KymographStore` keeps it in a directory of .npy files, each
+containing `lines_per_chunk` lines, and a JSON manifest with the
+binning parameters (bin time, line time, bin shift). The chunks are
+memory-mapped, so that plotting, the extraction of regions of
+interest, and correlation only read the lines they need.
+
+Directory layout::
+
+    manifest.json
+    chunk_000000.npy
+    chunk_000001.npy
+    ...
+"""
+import json
+import os
+
+import numpy as np
+
+
+#: default number of lines per chunk
+LINES_PER_CHUNK = 4096
+
+MANIFEST = "manifest.json"
+
+
+class KymographWriter(object):
+    def __init__(self, directory, bins_per_line,
+                 lines_per_chunk=LINES_PER_CHUNK, bin_time=None,
+                 line_time=None, bin_shift=0, system_clock=None):
+        """Write binned data to a :class:`KymographStore`
+
+        Parameters
+        ----------
+        directory : str
+            Store directory (created if it does not exist)
+        bins_per_line : int
+            Number of bins per line
+        lines_per_chunk : int
+            Number of lines per chunk file
+        bin_time, line_time : float or None
+            Bin time and line time in system clock ticks
+        bin_shift : int
+            Empty bins before actual binning of data
+        system_clock : float or None
+            System clock [MHz]
+
+        Notes
+        -----
+        Each chunk is stored with the smallest unsigned integer type
+        (8 or 16 bit, 32 bit for larger values). The manifest is
+        written by :func:`KymographWriter.close`, which returns the
+        store.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {"version": 1,
+                         "bins_per_line": int(bins_per_line),
+                         "lines_per_chunk": int(lines_per_chunk),
+                         "bin_time": bin_time,
+                         "line_time": line_time,
+                         "bin_shift": bin_shift,
+                         "system_clock": system_clock,
+                         "n_bins": 0,
+                         "chunks": [],
+                         }
+        self.chunk_bins = int(bins_per_line) * int(lines_per_chunk)
+        self._buffer = np.zeros(0, dtype=np.uint32)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_chunk(self, data):
+        maxval = int(data.max()) if data.size else 0
+        for dtype in [np.uint8, np.uint16, np.uint32]:
+            if maxval <= np.iinfo(dtype).max:
+                break
+        name = "chunk_{:06d}.npy".format(len(self.manifest["chunks"]))
+        np.save(os.path.join(self.directory, name), data.astype(dtype))
+        self.manifest["chunks"].append({"file": name,
+                                        "n_bins": data.size,
+                                        "dtype": np.dtype(dtype).name})
+        self.manifest["n_bins"] += data.size
+
+    def append(self, data):
+        """Append binned data (1D, continuation of the previous data)"""
+        data = np.asarray(data).reshape(-1)
+        if self._buffer.size:
+            data = np.concatenate((self._buffer, data))
+        nfull = data.size - data.size % self.chunk_bins
+        for ii in range(0, nfull, self.chunk_bins):
+            self._write_chunk(data[ii:ii + self.chunk_bins])
+        self._buffer = data[nfull:].copy()
+
+    def close(self):
+        """Write the last chunk and the manifest
+
+        Returns
+        -------
+        store : KymographStore
+        """
+        if self._buffer.size:
+            self._write_chunk(self._buffer)
+            self._buffer = np.zeros(0, dtype=np.uint32)
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as fd:
+            json.dump(self.manifest, fd, indent=2)
+        os.replace(path + ".tmp", path)
+        return KymographStore(self.directory)
+
+
+class KymographStore(object):
+    def __init__(self, directory):
+        """Random access to a chunked kymograph
+
+        The store behaves like a read-only 1D array of bins: it
+        supports `len` and indexing with integers and slices, which
+        only read the required chunks. Use
+        :func:`KymographStore.read_lines` to obtain 2D blocks of
+        lines.
+
+        Parameters
+        ----------
+        directory : str
+            Store directory written by :class:`KymographWriter`
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as fd:
+            self.manifest = json.load(fd)
+        self.bins_per_line = self.manifest["bins_per_line"]
+        self.lines_per_chunk = self.manifest["lines_per_chunk"]
+        self.bin_time = self.manifest["bin_time"]
+        self.line_time = self.manifest["line_time"]
+        self.bin_shift = self.manifest["bin_shift"]
+        self.system_clock = self.manifest["system_clock"]
+        self.chunk_bins = self.bins_per_line * self.lines_per_chunk
+        self._chunks = {}
+
+    def __len__(self):
+        return self.manifest["n_bins"]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step < 0:
+                return self[stop + 1:start + 1][::-1][::-step]
+            parts = [np.zeros(0, dtype=self.dtype)]
+            for ii in range(self.n_chunks):
+                c0 = ii * self.chunk_bins
+                c1 = c0 + self.manifest["chunks"][ii]["n_bins"]
+                if c1 <= start or c0 >= stop:
+                    continue
+                # first selected index in this chunk
+                first = start + max(0, -(-(c0 - start) // step)) * step
+                if first >= min(stop, c1):
+                    continue
+                parts.append(self._chunk(ii)[first - c0:min(stop, c1) - c0:
+                                             step])
+            return np.concatenate(parts).astype(self.dtype, copy=False)
+        else:
+            key = int(key)
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("Bin {} out of range".format(key))
+            return self._chunk(key // self.chunk_bins)[key % self.chunk_bins]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    @property
+    def dtype(self):
+        """The widest data type of all chunks"""
+        dtypes = [c["dtype"] for c in self.manifest["chunks"]]
+        return np.result_type(np.uint8, *dtypes)
+
+    @property
+    def n_chunks(self):
+        return len(self.manifest["chunks"])
+
+    @property
+    def n_lines(self):
+        """Number of lines (including an incomplete last line)"""
+        return -(-len(self) // self.bins_per_line)
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def size(self):
+        return len(self)
+
+    def _chunk(self, index):
+        """Return the memory-mapped `index`-th chunk"""
+        if index not in self._chunks:
+            path = os.path.join(self.directory,
+                                self.manifest["chunks"][index]["file"])
+            self._chunks[index] = np.load(path, mmap_mode="r")
+        return self._chunks[index]
+
+    def iter_chunks(self):
+        """Iterate over the (memory-mapped) chunks"""
+        for ii in range(self.n_chunks):
+            yield self._chunk(ii)
+
+    def max(self):
+        """Maximum of all bins (computed chunk by chunk)"""
+        return max([c.max() for c in self.iter_chunks() if c.size],
+                   default=0)
+
+    def read_lines(self, start, stop):
+        """Read a range of lines
+
+        Parameters
+        ----------
+        start, stop : int
+            First and last (exclusive) line
+
+        Returns
+        -------
+        lines : ndarray of shape (stop - start, bins_per_line)
+            The lines; bins after the end of the data are zero
+        """
+        bpl = self.bins_per_line
+        start = max(0, start)
+        stop = max(start, stop)
+        data = self[start * bpl:stop * bpl]
+        lines = np.zeros((stop - start) * bpl, dtype=self.dtype)
+        lines[:data.size] = data
+        return lines.reshape(stop - start, bpl)
+
+
+def from_file(path, directory, dtype=np.uint16, chunk_size=16777216,
+              **kwargs):
+    """Create a store from a raw binary file of binned data
+
+    Parameters
+    ----------
+    path : str
+        Binary file, e.g. written by
+        :func:`pyscanfcs.binning.bin_photon_events`
+    directory : str
+        Store directory
+    dtype : dtype
+        Data type of the binary file
+    chunk_size : int
+        Number of bins read at a time
+    **kwargs : dict
+        Metadata, see :class:`KymographWriter`
+
+    Returns
+    -------
+    store : KymographStore
+    """
+    with KymographWriter(directory, **kwargs) as kw, \
+            open(path, "rb") as fd:
+        while True:
+            data = np.fromfile(fd, dtype=dtype, count=chunk_size)
+            kw.append(data)
+            if data.size < chunk_size:
+                break
+    return KymographStore(directory)
@@ -0,0 +1,170 @@
+"""Virtual concatenation of photon streams split across files
+
+Long acquisitions are often split into several consecutive .dat
+files, e.g. "run_001A.dat", "run_002A.dat", ... The
+:class:`ConcatenatedStream` presents these files as one photon stream
+without concatenating them in memory. The files are decoded lazily,
+one at a time.
+"""
+import os
+import re
+
+import numpy as np
+
+from . import openfile
+
+
+class ConcatenatedStream(object):
+    def __init__(self, paths, **kwargs):
+        """Photon stream of consecutive .dat files
+
+        Parameters
+        ----------
+        paths : list of str
+            Paths to the .dat files in the order of acquisition
+        **kwargs : dict
+            Keyword arguments for :func:`openfile.openDAT` used
+            for decoding the individual files (e.g. `mmap`, `cache`)
+
+        Notes
+        -----
+        Only the number of events and the system clock are read when
+        the stream is created (see :func:`openfile.probeDAT`). The
+        most recently decoded file is kept in memory.
+        """
+        if len(paths) == 0:
+            raise ValueError("No files given!")
+        self.paths = list(paths)
+        self.kwargs = kwargs
+        probes = [openfile.probeDAT(p) for p in self.paths]
+        clocks = set(p["system_clock"] for p in probes)
+        if len(clocks) != 1:
+            raise ValueError("System clock differs between files: "
+                             "{}".format(sorted(clocks)))
+        self.system_clock = clocks.pop()
+        self._probes = probes
+        #: event index of the first event of each file
+        self.offsets = np.cumsum([0] + [p["n_events"] for p in probes])
+        self._current = (None, None)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step < 0:
+                return self[stop + 1:start + 1][::-1][::-step]
+            if step != 1:
+                return self[start:stop][::step]
+            parts = []
+            for ii in range(len(self.paths)):
+                fstart, fstop = self.offsets[ii], self.offsets[ii + 1]
+                if fstop <= start or fstart >= stop:
+                    continue
+                data = self.get_file_data(ii)
+                parts.append(data[max(start - fstart, 0):
+                                  min(stop, fstop) - fstart])
+            if parts:
+                return np.concatenate(parts)
+            return np.zeros(0, dtype=np.uint32)
+        else:
+            key = int(key)
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError("Event {} out of range".format(key))
+            ii = np.searchsorted(self.offsets, key, side="right") - 1
+            return self.get_file_data(ii)[key - self.offsets[ii]]
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint32)
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def size(self):
+        return len(self)
+
+    def get_file_data(self, index):
+        """Return the decoded photon stream of the `index`-th file"""
+        if self._current[0] != index:
+            info = openfile.openDAT(self.paths[index], **self.kwargs)
+            self._current = (index, info["data_stream"])
+        return self._current[1]
+
+    def iter_chunks(self):
+        """Iterate over the photon stream file by file"""
+        for ii in range(len(self.paths)):
+            yield self.get_file_data(ii)
+
+    def tofile(self, fd):
+        """Write the photon stream to an open file (like ndarray.tofile)"""
+        for data in self.iter_chunks():
+            np.asarray(data, dtype=np.uint32).tofile(fd)
+
+    def file_times(self):
+        """Time before the first event of each file
+
+        The total times of the files are taken from the checkpoint
+        index of each file if available and are computed from the
+        data (once) otherwise.
+
+        Returns
+        -------
+        times : list of int
+            Times in system clock ticks (one entry per file plus the
+            total time of the measurement)
+        """
+        times = [0]
+        for ii, probe in enumerate(self._probes):
+            if probe["total_time"] is None:
+                probe["total_time"] = int(np.sum(self.get_file_data(ii),
+                                                 dtype=np.uint64))
+            times.append(times[-1] + probe["total_time"])
+        return times
+
+    def total_time(self):
+        """Total time of the measurement in system clock ticks
+
+        See :func:`ConcatenatedStream.file_times`.
+        """
+        return self.file_times()[-1]
+
+
+def find_split_files(path):
+    """Find the consecutive files of a split acquisition
+
+    The file names of split acquisitions end with a running number,
+    optionally followed by the channel ("A" or "B"), e.g.
+    "run_001A.dat", "run_002A.dat", ... Starting with `path`, all
+    files with consecutive numbers are returned.
+
+    Parameters
+    ----------
+    path : str
+        Path to the first file
+
+    Returns
+    -------
+    paths : list of str
+        Paths to `path` and all consecutive files
+    """
+    dirname, name = os.path.split(path)
+    match = re.match(r"^(.*?)(\d+)([AB]?)(\.dat)$", name)
+    if match is None:
+        return [path]
+    prefix, number, channel, ext = match.groups()
+    paths = [path]
+    num = int(number)
+    while True:
+        num += 1
+        new = os.path.join(dirname, "{}{}{}{}".format(
+            prefix, str(num).zfill(len(number)), channel, ext))
+        if not os.path.exists(new):
+            break
+        paths.append(new)
+    return paths
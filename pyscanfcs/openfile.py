@@ -1,20 +1,121 @@
-"""filetype definitions"""
-import astropy.io.fits
+"""filetype definitions
+
+File formats are registered with :func:`register_format`. Readers
+of formats with heavy dependencies (e.g. astropy for FITS files) import
+these dependencies only when a file is actually opened.
+"""
+import concurrent.futures
+import importlib
+import os
+import struct
+
 import numpy as np
-import tifffile
 
+try:
+    from . import decode_dat
+except ImportError:
+    # compiled decoder not available
+    decode_dat = None
+
+
+def openAny(path, callback=None, **kwargs):
+    """load any supported file type
 
-def openAny(path, callback=None):
-    """load any supported file type"""
+    The file format is determined from the magic bytes of the file
+    and from the file suffix (see :func:`detect_format`).
+    Additional keyword arguments are passed to the file format
+    specific loader (e.g. `mmap` for :func:`openDAT`).
+    """
+    key = detect_format(path)
+    if key is None:
+        raise ValueError("Unknown file format: {}".format(path))
     methods = methods_binned.copy()
     methods.update(methods_stream)
+    return methods[key](path, callback, **kwargs)
+
+
+def detect_format(path):
+    """Determine the format of a file
+
+    Formats with unambiguous magic bytes are detected from the
+    file content, the others by the file suffix. Files with an
+    unknown suffix are checked for a valid .dat header.
+
+    Returns
+    -------
+    key : str or None
+        The key (suffix) of the format in `methods_stream` or
+        `methods_binned`; None if the format is not supported
+    """
+    with open(path, "rb") as fd:
+        header = fd.read(64)
+    for key, magic in _magic.items():
+        if magic is not None and magic(header, path):
+            return key
+    for key in list(methods_stream) + list(methods_binned):
+        if path.lower().endswith("." + key):
+            return key
+    if _is_dat(header):
+        return "dat"
+    return None
+
+
+def register_format(suffix, kind, reader, magic=None):
+    """Register a file format reader
 
-    for key in list(methods.keys()):
-        if path.endswith(key):
-            return methods[key](path, callback)
+    Parameters
+    ----------
+    suffix : str
+        File suffix (without the dot)
+    kind : str
+        "stream" for photon streams or "binned" for binned data
+    reader : callable or str
+        Function `reader(path, callback=None, **kwargs)` that returns
+        an info dictionary. A string "module:function" is imported
+        when the first file of this format is opened.
+    magic : bytes, callable, or None
+        Magic bytes at the beginning of the file or a function
+        `magic(header, path)` that returns True if the file belongs
+        to this format (`header` are the first 64 bytes of the file).
+    """
+    if isinstance(reader, str):
+        reader = LazyReader(reader)
+    if isinstance(magic, bytes):
+        prefix = magic
+
+        def magic(header, path):
+            return header.startswith(prefix)
+    if kind == "stream":
+        methods_stream[suffix] = reader
+    elif kind == "binned":
+        methods_binned[suffix] = reader
+    else:
+        raise ValueError("Unknown kind: {}".format(kind))
+    _magic[suffix] = magic
+
+
+class LazyReader(object):
+    def __init__(self, target):
+        """File format reader that is imported on first use
 
+        Parameters
+        ----------
+        target : str
+            Reader location in the form "module:function"
+        """
+        self.target = target
+        self._reader = None
 
-def openDAT(path, callback=None, cb_kwargs={}):
+    def __call__(self, *args, **kwargs):
+        if self._reader is None:
+            module, name = self.target.split(":")
+            self._reader = getattr(importlib.import_module(module), name)
+        return self._reader(*args, **kwargs)
+
+
+def openDAT(path, callback=None, cb_kwargs={}, mmap=False, workers=None,
+            index=False, cache=None, t_start=None, t_stop=None,
+            time_unit="s", salvage=False):
     """Load "Flex02-12D" correlator.com files
 
     We open a .dat file as produced by the "Flex02-12D" correlator in photon
@@ -31,12 +132,54 @@ def openDAT(path, callback=None, cb_kwargs={}):
         Number of function calls: 3
     cb_kwargs : dict, optional
         Keyword arguments for `callback` (e.g. "pid" of process).
+    mmap : bool
+        If True and the file is in the 32 bit format, return a
+        read-only :class:`numpy.memmap` of the photon stream instead
+        of loading the data into memory. The memory map is shared
+        via the page cache of the operating system and can be used
+        everywhere a regular array is used. This option has no
+        effect for the 16 bit format, which must be decoded.
+    workers : int or None
+        Number of threads for decoding the 16 bit format. The data are
+        split into segments that are decoded in parallel. If None,
+        all CPUs are used for files larger than 64MiB. Requires the
+        compiled decoder :mod:`pyscanfcs.decode_dat`.
+    index : bool
+        Load the :class:`pyscanfcs.checkpoint.CheckpointIndex` of the
+        file from its sidecar file. If the index does not exist (or
+        if it is outdated), it is built from the decoded data and
+        saved as a sidecar file.
+    cache : pyscanfcs.streamcache.StreamCache or None
+        Persistent cache for decoded photon streams. If the file is
+        in the cache, the decoded stream is memory-mapped from the
+        cache instead of decoding the file. Otherwise, the decoded
+        stream is added to the cache. Memory-mapped 32 bit files
+        are not cached.
+    t_start, t_stop : float or None
+        Only decode the photon events arriving within the time window
+        [t_start, t_stop). The first time difference of the returned
+        photon stream is measured from `t_start`. The checkpoint index
+        is used to seek to `t_start` if it exists. The options `mmap`
+        and `cache` have no effect for time windows.
+    time_unit : str
+        Unit of `t_start` and `t_stop`: "s" for seconds or "ticks"
+        for system clock ticks
+    salvage : bool
+        Validate the file and only load its consistent part instead
+        of raising an exception for damaged files (see
+        :func:`pyscanfcs.integrity.salvage_dat`). The report of the
+        scan is stored as "integrity". The options `mmap`, `index`,
+        and `cache` have no effect and time windows are not
+        supported (ValueError).
 
     Returns
     -------
     info: dict
         Dictionary containing the "system_clock" in MHz and the
         "data_stream" (photon arrival time event stream).
+        If `index` is True, the checkpoint index is stored as
+        "index". For time windows, "time_offset" is the start of
+        the window in system clock ticks.
         Returns `None` if the progress was aborted through the
         callback function.
 
@@ -58,76 +201,669 @@ def openDAT(path, callback=None, cb_kwargs={}):
         photon events. The time series are 0x0A+1, 0x0B+1, 0xFF+8+1.
 
     """
+    if salvage and (t_start is not None or t_stop is not None):
+        raise ValueError("Time windows are not supported with salvage!")
     # open file
     filed = open(path, 'rb')
-    # 1st byte: get file format
-    # should be 16 - for 16 bit
-    fformat = int(np.fromfile(filed, dtype="<u1", count=1))
-    # 2nd byte: read system clock
-    system_clock = int(np.fromfile(filed, dtype="<u1", count=1))
-    if fformat == 8:
-        # No 8 bit format supported
-        raise ValueError("8 bit format not supported!")
+    fformat, system_clock = _read_dat_header(filed)
+    if t_start is not None or t_stop is not None:
+        filed.close()
+        return _open_dat_window(path, system_clock, t_start, t_stop,
+                                time_unit, index)
+    if salvage:
+        filed.close()
+        from .integrity import salvage_dat
+        info, report = salvage_dat(path, workers=workers)
+        info["integrity"] = report
+        return info
+    cached = None
+    if cache is not None and not (fformat == 32 and mmap):
+        cached = cache.get(path)
+    if cached is not None:
+        # decoded photon stream from the persistent cache
+        data = cached["data_stream"]
+    elif fformat == 8:
+        data8 = _map_words(path, dtype="<u1")
+        # Trailing 0xFF bytes without photon event are ignored
+        data, _ = _decode_8bit(data8)
+        del data8
+    elif fformat == 32 and mmap:
+        # Zero-copy view on the file, skipping the two header bytes
+        data = _map_words(path, dtype="<u4")
     elif fformat == 32:
         # (There is an utility to convert data to 32bit)
         data = np.fromfile(filed, dtype="<u4", count=-1)
     elif fformat == 16:
         # convert 16bit to 32bit
-        # Read the rest of the file in 16 bit format.
-        # Load bunch of Data
-        data16 = np.fromfile(filed, dtype="<u2", count=-1)
-        # Now we need to check if there are any 0xFFFF values which would
-        # mean, that we do not yet have the true data in our array.
-        # There is 32 bit data after a 0xFFFF = 65535
+        # Read the rest of the file in 16 bit format (memory-mapped,
+        # the decoder writes to a single output array).
+        data16 = _map_words(path, dtype="<u2")
         if callback is not None:
             ret = callback(**cb_kwargs)
             if ret is not None:
                 return
 
-        # occurences of large values
-        occ = np.where(data16 == 65535)[0]
-        N = len(occ)
+        # There is 32 bit data after a 0xFFFF = 65535
+        if workers is None:
+            workers = os.cpu_count() if data16.nbytes > 2**26 else 1
+        if workers > 1 and decode_dat is not None:
+            data, consumed = _decode_16bit_parallel(data16, workers)
+        else:
+            data, consumed = _decode_16bit(data16)
+        if consumed != data16.size:
+            raise ValueError("Truncated 16 bit escape sequence at end "
+                             "of file: {}".format(path))
 
         if callback is not None:
             ret = callback(**cb_kwargs)
             if ret is not None:
                 return
 
-        # Make a 32 bit array
-        data = np.uint32(data16)
-        data[occ] = data[occ + 1] + data[occ + 2] * 65536
+        del data16
 
         if callback is not None:
             ret = callback(**cb_kwargs)
             if ret is not None:
                 return None
-
-        # Now delete the zeros
-        zeroids = np.zeros(N * 2, dtype=int)
-        zeroids[::2] = occ + 1
-        zeroids[1::2] = occ + 2
-        data = np.delete(data, zeroids)
     else:
         raise ValueError("Unknown format: {} bit".format(fformat))
     filed.close()
 
+    if cache is not None and cached is None and not (fformat == 32 and mmap):
+        cache.put(path, data, system_clock)
+
     info = {"data_stream": data,
             "system_clock": system_clock
             }
 
+    if index:
+        from .checkpoint import CheckpointIndex
+        cpi = CheckpointIndex.load(path)
+        if cpi is None:
+            cpi = CheckpointIndex.build(path, data=data)
+            cpi.save()
+        info["index"] = cpi
+
+    return info
+
+
+def probeDAT(path):
+    """Read the metadata of a .dat file without decoding it
+
+    Only the header bytes are read. The number of photon events is
+    computed from the file size (8 and 32 bit formats need at most
+    a byte count) or from a count of the escape sequences (16 bit
+    format). The total time is taken from the checkpoint index
+    sidecar file if it exists (see :mod:`pyscanfcs.checkpoint`).
+
+    Parameters
+    ----------
+    path : str
+        Path to file
+
+    Returns
+    -------
+    info : dict
+        Dictionary with the keys "format" (bits per event),
+        "system_clock" (MHz), "n_events" and "total_time" (system
+        clock ticks or None if there is no index).
+    """
+    from .checkpoint import CheckpointIndex
+    with open(path, "rb") as filed:
+        fformat, system_clock = _read_dat_header(filed)
+    if fformat == 32:
+        n_events = (os.path.getsize(path) - 2) // 4
+    elif fformat == 16:
+        words = _map_words(path, dtype="<u2")
+        if decode_dat is not None:
+            n_events, _ = decode_dat.count_16bit(words)
+        else:
+            occ = _escape_markers(words)
+            n_events = words.size - 2 * occ.size
+            if occ.size and occ[-1] + 2 >= words.size:
+                # incomplete escape sequence
+                n_events = occ[-1] - 2 * (occ.size - 1)
+    elif fformat == 8:
+        n_events = _count_8bit(_map_words(path, dtype="<u1"))
+    else:
+        raise ValueError("Unknown format: {} bit".format(fformat))
+
+    cpi = CheckpointIndex.load(path)
+    info = {"format": fformat,
+            "system_clock": system_clock,
+            "n_events": int(n_events),
+            "total_time": cpi.total_time if cpi is not None else None,
+            }
+    return info
+
+
+def _count_8bit(words, block_size=16777216):
+    """Count the photon events of 8 bit .dat words block by block
+
+    Every byte that is not 0xFF is a photon event. Counting in
+    blocks keeps the memory usage constant for memory-mapped files.
+    """
+    n_events = 0
+    for ii in range(0, words.size, block_size):
+        block = words[ii:ii + block_size]
+        n_events += block.size - int(np.count_nonzero(block == 0xFF))
+    return n_events
+
+
+def _open_dat_window(path, system_clock, t_start, t_stop, time_unit,
+                     index):
+    """Time window loading for :func:`openDAT`"""
+    start, stop = _window_ticks(t_start, t_stop, time_unit, system_clock)
+    info = {"data_stream": _read_time_window(path, start, stop),
+            "system_clock": system_clock,
+            "time_offset": start,
+            }
+    if index:
+        from .checkpoint import CheckpointIndex
+        info["index"] = CheckpointIndex.load(path)
     return info
 
 
-def openFITS(fname, callback=None):
-    """ load .fits files """
+def _window_ticks(t_start, t_stop, time_unit, system_clock):
+    """Convert a time window to system clock ticks
+
+    Returns
+    -------
+    start, stop : int
+        Time window in system clock ticks (`t_start` None: 0,
+        `t_stop` None: the largest uint64 value)
+    """
+    if time_unit == "s":
+        # seconds to system clock ticks
+        factor = system_clock * 1e6
+    elif time_unit == "ticks":
+        factor = 1
+    else:
+        raise ValueError("Unknown time unit: {}".format(time_unit))
+    start = 0 if t_start is None else int(round(t_start * factor))
+    stop = np.iinfo(np.uint64).max if t_stop is None \
+        else int(round(t_stop * factor))
+    return start, stop
+
+
+def iterDAT(path, chunk_size=1048576):
+    """Iterate over the photon stream of a "Flex02-12D" .dat file
+
+    This is the streaming counterpart of :func:`openDAT`. The file
+    is decoded block by block and the memory usage is bounded by
+    `chunk_size`, independent of the size of the file. Escape
+    sequences in the 16 bit format that span a block boundary
+    are carried over to the next block.
+
+    Parameters
+    ----------
+    path : str
+        Path to file
+    chunk_size : int
+        Number of photon events per block
+
+    Yields
+    ------
+    data_stream : ndarray (uint32)
+        Photon arrival time differences. All blocks have the length
+        `chunk_size`, except for the last one.
+
+    See Also
+    --------
+    openDAT : load the entire file
+    """
+    yield from _regroup(_iter_from(path, 2, chunk_size), chunk_size)
+
+
+def _iter_from(path, offset, chunk_size):
+    """Decode a .dat file block by block, starting at a byte offset
+
+    The blocks have at most `chunk_size` events, see :func:`iterDAT`
+    for blocks of fixed size.
+    """
+    with open(path, "rb") as filed:
+        fformat, _ = _read_dat_header(filed)
+        filed.seek(int(offset))
+        if fformat == 32:
+            while True:
+                data = np.fromfile(filed, dtype="<u4", count=chunk_size)
+                if data.size:
+                    yield data
+                if data.size < chunk_size:
+                    break
+        elif fformat == 16:
+            yield from _iter_decoded(filed, "<u2", _decode_16bit, chunk_size)
+        elif fformat == 8:
+            yield from _iter_decoded(filed, "<u1", _decode_8bit, chunk_size)
+        else:
+            raise ValueError("Unsupported format: {} bit".format(fformat))
+
+
+def _read_time_window(path, t_start, t_stop, chunk_size=1048576):
+    """Decode the photon events of a .dat file within a time window
+
+    Parameters
+    ----------
+    path : str
+        Path to .dat file
+    t_start, t_stop : int
+        Time window [t_start, t_stop) in system clock ticks
+    chunk_size : int
+        Number of events decoded at a time
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        Photon arrival time differences of all events arriving within
+        the time window. The first value is the time difference
+        between `t_start` and the first event.
+
+    Notes
+    -----
+    If the file has a checkpoint index (see :mod:`pyscanfcs.checkpoint`),
+    decoding starts at the last checkpoint before `t_start`. Otherwise,
+    the file is decoded from the start, but only the events within
+    the time window are kept in memory.
+    """
+    from .checkpoint import CheckpointIndex
+    cpi = CheckpointIndex.load(path)
+    if cpi is not None and cpi.times.size:
+        _, offset, time = cpi.seek(t_start)
+    else:
+        offset, time = 2, 0
+    return _select_time_window(_iter_from(path, offset, chunk_size),
+                               time, t_start, t_stop)
+
+
+def _select_time_window(blocks, time, t_start, t_stop):
+    """Select the photon events of consecutive blocks in a time window
+
+    Parameters
+    ----------
+    blocks : iterable of ndarray (uint32)
+        Consecutive blocks of photon arrival time differences; the
+        iteration stops after the first block that reaches `t_stop`
+    time : int
+        Arrival time before the first event of the first block
+    t_start, t_stop : int
+        Time window [t_start, t_stop) in system clock ticks
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        See :func:`_read_time_window`
+    """
+    selected = []
+    first_arrival = None
+    for block in blocks:
+        if block.size == 0:
+            continue
+        arrival = np.cumsum(block, dtype=np.uint64)
+        arrival += np.uint64(time)
+        time = int(arrival[-1])
+        start = np.searchsorted(arrival, t_start)
+        stop = np.searchsorted(arrival, t_stop)
+        if stop > start:
+            if first_arrival is None:
+                first_arrival = int(arrival[start])
+            selected.append(block[start:stop])
+        if time >= t_stop:
+            break
+    if not selected:
+        return np.zeros(0, dtype=np.uint32)
+    data = np.concatenate(selected)
+    # time relative to the start of the window
+    data[0] = first_arrival - t_start
+    return data
+
+
+def _event_offsets(path, events):
+    """Byte offsets of photon events in a .dat file
+
+    Parameters
+    ----------
+    path : str
+        Path to .dat file
+    events : ndarray (int)
+        Event indices (sorted)
+
+    Returns
+    -------
+    offsets : ndarray (uint64)
+        Position of the first byte of each event in the file
+    """
+    events = np.asarray(events, dtype=np.uint64)
+    with open(path, "rb") as filed:
+        fformat, _ = _read_dat_header(filed)
+    if fformat == 32:
+        offsets = 2 + 4 * events
+    elif fformat == 16:
+        occ = _escape_markers(_map_words(path, dtype="<u2"))
+        # event index of each escape sequence
+        escaped = occ - 2 * np.arange(occ.size)
+        offsets = 2 + 2 * events + 4 * np.searchsorted(escaped, events)
+    elif fformat == 8:
+        ends = np.flatnonzero(_map_words(path, dtype="<u1") != 0xFF) + 1
+        offsets = 2 + np.concatenate(([0], ends))[events.astype(np.intp)]
+    else:
+        raise ValueError("Unsupported format: {} bit".format(fformat))
+    return offsets.astype(np.uint64)
+
+
+def _read_events(path, offset, count=-1):
+    """Decode photon events of a .dat file from a byte offset
+
+    Parameters
+    ----------
+    path : str
+        Path to .dat file
+    offset : int
+        Byte offset of the first event (see :func:`_event_offsets`)
+    count : int
+        Maximum number of events to decode; -1 decodes all events
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        Decoded photon events
+    nbytes : int
+        Number of bytes that were decoded
+    """
+    with open(path, "rb") as filed:
+        fformat, _ = _read_dat_header(filed)
+    offset = int(offset)
+    if fformat == 32:
+        raw = np.fromfile(path, dtype="<u4", count=count, offset=offset)
+        return raw.astype(np.uint32), raw.nbytes
+    elif fformat == 16:
+        # an event has at most three words
+        raw = np.fromfile(path, dtype="<u2", offset=offset,
+                          count=3 * count if count >= 0 else -1)
+        data, consumed = _decode_16bit(raw)
+    elif fformat == 8:
+        # an event may have any number of overflow bytes
+        nread = 2 * count + 1024 if count >= 0 else -1
+        while True:
+            raw = np.fromfile(path, dtype="<u1", offset=offset, count=nread)
+            data, consumed = _decode_8bit(raw)
+            if count < 0 or data.size >= count or raw.size < nread:
+                break
+            nread *= 2
+    else:
+        raise ValueError("Unsupported format: {} bit".format(fformat))
+    if count == 0:
+        data, consumed = data[:0], 0
+    elif 0 < count < data.size:
+        # number of raw items of the first `count` events
+        data = data[:count]
+        if fformat == 16:
+            occ = _escape_markers(raw)
+            escaped = occ - 2 * np.arange(occ.size)
+            consumed = count + 2 * np.searchsorted(escaped, count)
+        else:
+            consumed = np.flatnonzero(raw != 0xFF)[count - 1] + 1
+    return data, int(consumed) * raw.itemsize
+
+
+def _iter_decoded(filed, dtype, decoder, chunk_size):
+    """Decode an open .dat file block by block
+
+    Raw data that `decoder` could not consume at the end of a block
+    (incomplete escape sequences or overflow bytes) are carried over
+    to the next block.
+    """
+    carry = np.zeros(0, dtype=dtype)
+    while True:
+        raw = np.fromfile(filed, dtype=dtype, count=chunk_size)
+        eof = raw.size < chunk_size
+        if carry.size:
+            raw = np.concatenate((carry, raw))
+        data, consumed = decoder(raw)
+        carry = raw[consumed:]
+        if data.size:
+            yield data
+        if eof:
+            break
+    # Trailing overflow bytes of the 8 bit format do not contain
+    # photon events, but a 16 bit escape sequence must be complete.
+    if carry.size and decoder is _decode_16bit:
+        raise ValueError("Truncated 16 bit escape sequence at end "
+                         "of file: {}".format(filed.name))
+
+
+def _regroup(blocks, chunk_size):
+    """Regroup an iterable of arrays to arrays of size `chunk_size`"""
+    buffer = []
+    nbuffer = 0
+    for data in blocks:
+        buffer.append(data)
+        nbuffer += data.size
+        if nbuffer >= chunk_size:
+            data = np.concatenate(buffer)
+            nfull = data.size - data.size % chunk_size
+            for ii in range(0, nfull, chunk_size):
+                yield data[ii:ii + chunk_size]
+            buffer = [data[nfull:]]
+            nbuffer = buffer[0].size
+    if nbuffer:
+        yield np.concatenate(buffer)
+
+
+def _decode_8bit(bytes8):
+    """Decode 8 bit .dat bytes to photon arrival time differences
+
+    Every byte is a photon event, unless it is 0xFF, which means that
+    255 clock ticks passed without a photon event. The photon event
+    `b` following `n` overflow bytes has the time difference
+    `n*255 + b + 1`.
+
+    Parameters
+    ----------
+    bytes8 : ndarray (uint8)
+        8 bit data of the photon stream
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        Decoded photon events
+    consumed : int
+        Number of decoded bytes; smaller than `len(bytes8)` if
+        `bytes8` ends with overflow bytes.
+    """
+    events = np.flatnonzero(bytes8 != 0xFF)
+    consumed = events[-1] + 1 if events.size else 0
+    # Number of overflow bytes preceding each event: the run lengths
+    # of the segments between consecutive events.
+    overflows = np.diff(events, prepend=-1) - 1
+    data = overflows.astype(np.uint32)
+    data *= 255
+    data += bytes8[events]
+    data += 1
+    return data, consumed
+
+
+def _decode_16bit(words):
+    """Decode 16 bit .dat words to photon arrival time differences
+
+    Uses the compiled decoder :mod:`pyscanfcs.decode_dat` if available
+    and falls back to NumPy otherwise.
+
+    Parameters
+    ----------
+    words : ndarray (uint16)
+        16 bit words of the photon stream
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        Decoded photon events
+    consumed : int
+        Number of decoded words; smaller than `len(words)` if `words`
+        ends with an incomplete escape sequence.
+    """
+    if decode_dat is not None:
+        return decode_dat.decode_16bit(words)
+
+    occ = _escape_markers(words)
+    consumed = words.size
+    if occ.size and occ[-1] + 2 >= words.size:
+        consumed = occ[-1]
+        occ = occ[:-1]
+        words = words[:consumed]
+    # Make a 32 bit array
+    data = np.uint32(words)
+    data[occ] = data[occ + 1] + data[occ + 2] * 65536
+    # Now delete the payload of the escape sequences
+    keep = np.ones(data.size, dtype=bool)
+    keep[occ + 1] = False
+    keep[occ + 2] = False
+    return data[keep], consumed
+
+
+def _decode_16bit_parallel(words, workers):
+    """Decode 16 bit .dat words using multiple threads
+
+    The words are split into `workers` segments (see
+    :func:`_split_16bit`). The segments are counted and decoded
+    by the compiled decoder in a thread pool (the GIL is released)
+    and written to a single output array.
+
+    Returns
+    -------
+    data : ndarray (uint32)
+        Decoded photon events
+    consumed : int
+        Number of decoded words, see :func:`_decode_16bit`
+    """
+    bounds = _split_16bit(words, workers)
+    segments = [words[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        counts = list(pool.map(decode_dat.count_16bit, segments))
+        # Only the last segment may end with an incomplete escape
+        offsets = np.cumsum([0] + [c[0] for c in counts])
+        data = np.empty(offsets[-1], dtype=np.uint32)
+        outs = [data[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        list(pool.map(decode_dat.decode_16bit, segments, outs))
+    consumed = bounds[-2] + counts[-1][1]
+    return data, consumed
+
+
+def _split_16bit(words, n_segments):
+    """Split 16 bit .dat words into segments at event boundaries
+
+    A word at position `p` is the start of a photon event if neither
+    of the two preceding words is an escape marker. This is the case
+    if both are not 0xFFFF. For each of the equally-spaced split
+    positions, the next such resynchronisation point is used.
+
+    Returns
+    -------
+    bounds : list of int
+        Segment boundaries, starting with 0 and ending with
+        `len(words)`
+    """
+    size = words.size
+    bounds = [0]
+    window = 1024
+    for ii in range(1, n_segments):
+        pos = max(bounds[-1], ii * size // n_segments, 2)
+        while pos < size:
+            chunk = words[pos - 2:pos + window]
+            notff = chunk != 0xFFFF
+            ok = np.flatnonzero(notff[:-2] & notff[1:-1])
+            if ok.size:
+                pos += ok[0]
+                break
+            pos += window
+        if pos >= size:
+            break
+        if pos > bounds[-1]:
+            bounds.append(int(pos))
+    bounds.append(size)
+    return bounds
+
+
+def _escape_markers(words):
+    """Find the positions of escape words (0xFFFF) in 16 bit .dat data
+
+    A 0xFFFF word is only an escape marker if it is not part of the
+    32 bit payload of a preceding escape sequence.
+    """
+    occ = np.flatnonzero(words == 0xFFFF)
+    if occ.size > 1 and np.any(np.diff(occ) <= 2):
+        # Rare case: 0xFFFF within a payload; resolve sequentially
+        markers = []
+        start = 0
+        for pos in occ:
+            if pos >= start:
+                markers.append(pos)
+                start = pos + 3
+        occ = np.array(markers, dtype=occ.dtype)
+    return occ
+
+
+def _map_words(path, dtype):
+    """Read-only memory map of the data in a .dat file (after header)"""
+    itemsize = np.dtype(dtype).itemsize
+    size = (os.path.getsize(path) - 2) // itemsize
+    if size <= 0:
+        # empty files cannot be memory-mapped
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=2, shape=(size,))
+
+
+def _read_dat_header(filed):
+    """Return file format (bits) and system clock (MHz) of a .dat file"""
+    # 1st byte: get file format
+    # should be 16 - for 16 bit
+    # 2nd byte: read system clock
+    header = np.fromfile(filed, dtype="<u1", count=2)
+    if header.size != 2:
+        raise ValueError("Not a valid .dat file: {}".format(filed.name))
+    fformat, system_clock = [int(b) for b in header]
+    return fformat, system_clock
+
+
+def openFITS(fname, callback=None, memmap=True):
+    """ load .fits files
+
+    Parameters
+    ----------
+    fname : str
+        Path to file
+    callback : callable or None
+        Not used
+    memmap : bool
+        If True, the data are memory-mapped and only the parts that
+        are accessed are read from disk. Only the header is parsed
+        when the file is opened. Scaled data (BSCALE/BZERO keywords)
+        are always loaded into memory.
+
+    Returns
+    -------
+    info : dict
+        Dictionary with the 2D "data_binned" (lines x bins per line)
+        and the metadata from the header. Use
+        `info["data_binned"].reshape(-1)` to obtain the 1D intensity
+        data (a view, not a copy).
+    """
+    import astropy.io.fits
+
     info = dict()
 
-    fits = astropy.io.fits.open(fname)
+    # Do not let astropy scale the data, because this would read
+    # the entire file into memory.
+    fits = astropy.io.fits.open(fname, memmap=memmap,
+                                do_not_scale_image_data=True)
     series = fits[0]
     head = series.header
 
     info["type"] = "binned"
-    info["data_binned"] = series.data
+    if head.get("BSCALE", 1) == 1 and head.get("BZERO", 0) == 0:
+        info["data_binned"] = series.data
+    else:
+        fits.close()
+        info["data_binned"] = astropy.io.fits.getdata(fname)
     info["system_clock"] = head['SysClck']
 
     try:
@@ -148,25 +884,59 @@ def openFITS(fname, callback=None):
     except KeyError:
         info["bin_shift"] = None
 
-    info["bins_per_line"] = len(series.data[0])
+    info["bins_per_line"] = head["NAXIS1"]
 
-    info["size"] = series.data.shape[0] * series.data.shape[1]
+    info["size"] = head["NAXIS1"] * head["NAXIS2"]
 
     return info
 
 
-def openLSM(fname, callback=None):
-    """ open LSM780 file using tifffile """
+def openLSM(fname, callback=None, channel=0, channels=None):
+    """ open LSM780 file using tifffile
+
+    Parameters
+    ----------
+    fname : str
+        Path to file
+    callback : callable or None
+        Not used
+    channel : int
+        Channel returned as "data_binned"
+    channels : list of int, "all", or None
+        Additional channels that are returned as a list in
+        "data_binned_channels". All channels are read in one pass.
+
+    Notes
+    -----
+    Only the requested channels are read (see
+    :func:`_read_tiff_channels`). Uncompressed files are
+    memory-mapped.
+    """
+    import tifffile
+
     info = dict()
     info["type"] = "binned"
 
     lsm = tifffile.TiffFile(fname)
+    page = lsm.pages[0]
 
-    # two channels 0, 1?
-    info["data_binned"] = lsm.asarray()[0]
+    info["n_channels"] = page.samplesperpixel
+    if channels is None:
+        read = [channel]
+    else:
+        if channels == "all":
+            channels = list(range(page.samplesperpixel))
+        read = [channel] + [c for c in channels if c != channel]
+    try:
+        data = dict(zip(read, _read_tiff_channels(lsm, page, read)))
+    except BaseException:
+        lsm.close()
+        raise
+    info["data_binned"] = data[channel]
+    if channels is not None:
+        info["data_binned_channels"] = [data[c] for c in channels]
     info["system_clock"] = 1
 
-    page = lsm.pages[0]
     # pixel time in us
     info["bin_time"] = page.cz_lsm_scan_information["tracks"][0]["pixel_time"]
 
@@ -182,14 +952,125 @@ def openLSM(fname, callback=None):
     info["size"] = info["data_binned"].shape[0] * info["data_binned"].shape[1]
     info["bin_shift"] = None
 
+    lsm.close()
     return info
 
 
-methods_stream = {"dat": openDAT}
+def _read_tiff_channels(tif, page, channels):
+    """Read channels (samples) of a TIFF page
+
+    Parameters
+    ----------
+    tif : tifffile.TiffFile
+        The opened file
+    page : tifffile.TiffPage
+        The page
+    channels : list of int
+        Channel indices
+
+    Returns
+    -------
+    data : list of ndarray
+        2D image data of each channel
+
+    Notes
+    -----
+    Uncompressed pages are memory-mapped, so that only the parts
+    of the channels that are accessed are read. For compressed pages
+    with separately stored channels (planar configuration 2), only
+    the strips of the requested channels are decoded. Otherwise, the
+    page is decoded once.
+    """
+    nsamples = page.samplesperpixel
+    for ch in channels:
+        if not 0 <= ch < nsamples:
+            raise IndexError("Channel {} not in {} (channels: {})".format(
+                ch, tif.filehandle.path, nsamples))
+    separate = nsamples > 1 and page.planarconfig == 2
+    if page.is_contiguous:
+        # (offset, bytecount) in older versions of tifffile
+        if isinstance(page.is_contiguous, tuple):
+            offset = page.is_contiguous[0]
+        else:
+            offset = page.dataoffsets[0]
+        dtype = page.dtype.newbyteorder(tif.byteorder)
+        mm = np.memmap(tif.filehandle.path, dtype=dtype, mode="r",
+                       offset=offset, shape=page.shape)
+        if nsamples == 1:
+            return [mm for _ in channels]
+        elif separate:
+            return [mm[ch] for ch in channels]
+        else:
+            return [mm[..., ch] for ch in channels]
+    elif separate and not page.is_tiled and hasattr(page, "decode"):
+        fh = tif.filehandle
+        nstrips = len(page.dataoffsets) // nsamples
+        result = []
+        for ch in channels:
+            out = np.empty(page.shape[1:], dtype=page.dtype)
+            for ii in range(ch * nstrips, (ch + 1) * nstrips):
+                fh.seek(page.dataoffsets[ii])
+                raw = fh.read(page.databytecounts[ii])
+                segment, indices, shape = page.decode(raw, ii)
+                out[indices[2]:indices[2] + shape[1]] = segment[0, :, :, 0]
+            result.append(out)
+        return result
+    else:
+        data = page.asarray()
+        if nsamples == 1:
+            return [data for _ in channels]
+        elif separate:
+            return [data[ch] for ch in channels]
+        else:
+            return [data[..., ch] for ch in channels]
+
+
+def _is_lsm(header, path):
+    """Check for LSM files: TIFF files with a CZ_LSMINFO tag
+
+    Only the tags of the first image file directory are read.
+    """
+    if header[:4] == b"II*\x00":
+        byteorder = "<"
+    elif header[:4] == b"MM\x00*":
+        byteorder = ">"
+    else:
+        return False
+    offset = struct.unpack(byteorder + "I", header[4:8])[0]
+    with open(path, "rb") as fd:
+        fd.seek(offset)
+        raw = fd.read(2)
+        if len(raw) < 2:
+            return False
+        n_tags = struct.unpack(byteorder + "H", raw)[0]
+        entries = fd.read(12 * n_tags)
+    entries = entries[:len(entries) - len(entries) % 12]
+    # each entry: tag (uint16), type (uint16), count, value/offset
+    tags = np.frombuffer(entries, dtype=byteorder + "u2")[::6]
+    return bool(np.any(tags == 34412))
+
+
+def _is_dat(header):
+    """Weak check for .dat files: format byte and nonzero clock"""
+    return len(header) >= 2 and header[0] in [8, 16, 32] and header[1] > 0
+
+
+methods_stream = {}
+methods_binned = {}
+#: magic byte checks of the formats, in the order of registration
+_magic = {}
 
-methods_binned = {"fits": openFITS,
-                  "lsm": openLSM}
-#                  "tif": openTIF}
+register_format("fits", "binned", openFITS, magic=b"SIMPLE  =")
+# LSM files are TIFF files with Zeiss metadata
+register_format("lsm", "binned", openLSM, magic=_is_lsm)
+# The .dat header is not unique (see `_is_dat`)
+register_format("dat", "stream", openDAT)
+# compressed photon stream archive (see `archive.MAGIC`)
+register_format("psz", "stream", "pyscanfcs.archive:openPSZ",
+                magic=b"PSCFCSZ\x01")
+# PicoQuant time-tagged time-resolved data (see `ptu.MAGIC`)
+register_format("ptu", "stream", "pyscanfcs.ptu:openPTU",
+                magic=b"PQTTTR\x00\x00")
 
 wx_dlg_wc_stream = "stream format ("
 wx_dlg_wc_stream_end = ")|"
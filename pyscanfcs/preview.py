@@ -0,0 +1,148 @@
+"""Stratified preview binning of photon streams
+
+Binning the first photon events of a measurement only shows its
+beginning. :func:`bin_windows` bins several short windows that are
+spread over the entire measurement and stitches the complete lines
+of each window to one preview kymograph. The number of binned photon
+events is the same as for a preview of the first events.
+"""
+import numpy as np
+
+
+#: default number of windows of a preview
+N_WINDOWS = 10
+
+
+def bin_windows(data, t_bin, bins_per_line, n_events, n_windows=N_WINDOWS,
+                binshift=0, index=None):
+    """Bin windows spread over a photon stream
+
+    Parameters
+    ----------
+    data : ndarray (uint32) or photon stream object
+        Photon arrival time differences; objects must support
+        `len` and slicing (e.g.
+        :class:`pyscanfcs.multistream.ConcatenatedStream`)
+    t_bin : float
+        Bin time in system clock ticks
+    bins_per_line : int
+        Number of bins per line (scan cycle)
+    n_events : int
+        Total number of photon events to bin
+    n_windows : int
+        Number of windows
+    binshift : int
+        Empty bins before actual binning of data (shifts the lines
+        relative to the photon stream)
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`. If given, the windows are spread
+        evenly in time and the start times of the windows are looked
+        up in the index. Otherwise, the windows are spread evenly
+        over the photon events and the start times are computed from
+        the data (see :func:`_window_times`).
+
+    Returns
+    -------
+    binned : ndarray (uint16)
+        Stitched complete lines of all windows (1D)
+    lines : list of tuple
+        First line in the measurement and number of lines of each
+        window in `binned`
+
+    Notes
+    -----
+    If there are fewer photon events than windows, the first
+    `n_events` photon events are binned (prefix preview).
+    """
+    n_total = len(data)
+    n_windows = max(1, min(n_windows, n_events))
+    size = min(n_events, n_total) // n_windows
+    if size == 0:
+        # prefix preview
+        n_windows = 1
+        size = min(n_events, n_total)
+        if size == 0:
+            return np.zeros(0, dtype=np.uint16), []
+    if index is not None:
+        starts = [index.time_to_event(index.total_time * k // n_windows,
+                                      data=data)
+                  for k in range(n_windows)]
+    else:
+        starts = [n_total * k // n_windows for k in range(n_windows)]
+    # windows must not overlap or exceed the data
+    for k in range(n_windows):
+        starts[k] = min(starts[k], n_total - size)
+        if k:
+            starts[k] = max(starts[k], starts[k - 1] + size)
+    starts = [s for s in starts if s + size <= n_total]
+
+    parts = []
+    lines = []
+    times = _window_times(data, starts, index=index)
+    for start, time in zip(starts, times):
+        window = np.asarray(data[start:start + size], dtype=np.uint32)
+        arrival = np.cumsum(window, dtype=np.uint64) + np.uint64(time)
+        bins = np.floor(arrival / t_bin).astype(np.int64) + binshift
+        first = bins[0] // bins_per_line
+        last = bins[-1] // bins_per_line
+        # Only use complete lines: the first and the last line of the
+        # window contain events from outside the window.
+        if last - first >= 2:
+            first += 1
+        nlines = max(last - first, 1)
+        bins = bins - first * bins_per_line
+        bins = bins[(bins >= 0) & (bins < nlines * bins_per_line)]
+        parts.append(np.bincount(bins, minlength=nlines * bins_per_line))
+        lines.append((int(first), int(nlines)))
+    if parts:
+        binned = np.concatenate(parts).astype(np.uint16)
+    else:
+        binned = np.zeros(0, dtype=np.uint16)
+    return binned, lines
+
+
+def _window_times(data, starts, index=None):
+    """Arrival time before the first event of each window
+
+    The times are looked up in the checkpoint `index` if given.
+    Otherwise, the time differences are summed from the closest
+    known time before each window: the start of the file for photon
+    streams that know the start times of their files (see
+    :func:`pyscanfcs.multistream.ConcatenatedStream.file_times`), or
+    the previous window.
+
+    Parameters
+    ----------
+    data : ndarray (uint32) or photon stream object
+        Photon arrival time differences
+    starts : list of int
+        First event of each window (sorted)
+    index : pyscanfcs.checkpoint.CheckpointIndex or None
+        Checkpoint index of `data`
+
+    Returns
+    -------
+    times : list of int
+        Time before `starts[k]` in system clock ticks
+    """
+    if index is not None:
+        return [index.event_time(s - 1, data=data) if s else 0
+                for s in starts]
+    if hasattr(data, "file_times"):
+        offsets = data.offsets
+        file_times = data.file_times()
+    else:
+        offsets = [0]
+        file_times = [0]
+    times = []
+    time = 0  # time before `pos`
+    pos = 0
+    for start in starts:
+        ii = int(np.searchsorted(offsets, start, side="right")) - 1
+        if offsets[ii] > pos:
+            pos = int(offsets[ii])
+            time = int(file_times[ii])
+        time += int(np.sum(data[pos:start], dtype=np.uint64))
+        pos = start
+        times.append(time)
+    return times
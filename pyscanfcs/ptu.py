@@ -0,0 +1,318 @@
+"""PicoQuant time-tagged time-resolved (TTTR) .ptu files
+
+PTU files consist of a tagged header followed by 32 bit records. In
+T2 mode, each record contains the time tag of a photon event, in T3
+mode the number of sync pulses (macro time) and the time since the
+last sync pulse (micro time). When the time tag of a record
+overflows, an overflow record is written.
+
+The records are decoded in vectorized blocks and converted to the
+photon arrival time differences used by the .dat file format, i.e.
+the data can be binned with :func:`pyscanfcs.binning.bin_photon_events`.
+Only the macro time is used for T3 records.
+"""
+import struct
+
+import numpy as np
+
+from . import openfile
+
+
+MAGIC = b"PQTTTR\x00\x00"
+
+#: maximum system clock [MHz] of the photon streams; the time tags of
+#: T2 files (ps resolution) are reduced to this resolution so that the
+#: arrival time differences fit into 32 bit
+MAX_CLOCK = 1000
+
+# header tag types
+_TY_EMPTY8 = 0xFFFF0008
+_TY_BOOL8 = 0x00000008
+_TY_INT8 = 0x10000008
+_TY_BITSET64 = 0x11000008
+_TY_COLOR8 = 0x12000008
+_TY_FLOAT8 = 0x20000008
+_TY_DATETIME = 0x21000008
+_TY_FLOAT8ARRAY = 0x2001FFFF
+_TY_ANSISTRING = 0x4001FFFF
+_TY_WIDESTRING = 0x4002FFFF
+_TY_BINARYBLOB = 0xFFFFFFFF
+
+#: record types: (mode, record layout)
+RECORD_TYPES = {
+    0x00010203: ("T2", "picoharp"),
+    0x00010303: ("T3", "picoharp"),
+    0x00010204: ("T2", "hydraharp1"),
+    0x00010304: ("T3", "hydraharp1"),
+    0x01010204: ("T2", "generic"),  # HydraHarp V2
+    0x01010304: ("T3", "generic"),
+    0x00010205: ("T2", "generic"),  # TimeHarp 260 N
+    0x00010305: ("T3", "generic"),
+    0x00010206: ("T2", "generic"),  # TimeHarp 260 P
+    0x00010306: ("T3", "generic"),
+    0x00010207: ("T2", "generic"),  # MultiHarp
+    0x00010307: ("T3", "generic"),
+}
+
+
+def openPTU(path, callback=None, channel=None, max_clock=MAX_CLOCK,
+            mmap=False, cache=None, t_start=None, t_stop=None,
+            time_unit="s", index=False, salvage=False):
+    """Load the photon stream of a PicoQuant .ptu file
+
+    Parameters
+    ----------
+    path : str
+        Path to file
+    callback : callable or None
+        Not used (for compatibility with the other readers)
+    channel : int, list of int, or None
+        Detection channel(s) of the photon stream; if None, the photon
+        events of all channels are combined. The channel numbers are
+        those of the records (0-based for PicoHarp T2 and the T2/T3
+        formats of the newer devices, 1-based for PicoHarp T3).
+    max_clock : float
+        Maximum system clock [MHz], see :data:`MAX_CLOCK`
+    mmap, cache
+        Ignored (the records are always decoded)
+    t_start, t_stop, time_unit
+        Time window, see :func:`openfile.openDAT`; decoding stops
+        after the end of the window.
+    index : bool
+        .ptu files have no checkpoint index; if True, "index" is
+        set to None.
+    salvage : bool
+        Not supported for .ptu files (ValueError)
+
+    Returns
+    -------
+    info: dict
+        Dictionary containing the "system_clock" in MHz, the
+        "data_stream" (photon arrival time event stream) and the
+        "header" tags of the file. For time windows, "time_offset"
+        is the start of the window in system clock ticks.
+    """
+    if salvage:
+        raise ValueError("Salvage not supported for .ptu files!")
+    tags, _ = read_header(path)
+    clock = system_clock(tags, max_clock=max_clock)
+    blocks = _iter_intervals(path, channel=channel, max_clock=max_clock)
+    info = {"system_clock": clock,
+            "header": tags,
+            }
+    if t_start is not None or t_stop is not None:
+        start, stop = openfile._window_ticks(t_start, t_stop, time_unit,
+                                             clock)
+        data = openfile._select_time_window(blocks, 0, start, stop)
+        info["time_offset"] = start
+    else:
+        blocks = list(blocks)
+        if blocks:
+            data = np.concatenate(blocks)
+        else:
+            data = np.zeros(0, dtype=np.uint32)
+    info["data_stream"] = data
+    if index:
+        info["index"] = None
+    return info
+
+
+def iterPTU(path, channel=None, chunk_size=1048576, max_clock=MAX_CLOCK):
+    """Iterate over the photon stream of a PicoQuant .ptu file
+
+    This is the streaming counterpart of :func:`openPTU`. The records
+    are decoded block by block and the memory usage is bounded by
+    `chunk_size`. The overflow state and the arrival time of the last
+    photon are carried over to the next block.
+
+    Parameters
+    ----------
+    path : str
+        Path to file
+    channel : int, list of int, or None
+        Detection channel(s), see :func:`openPTU`
+    chunk_size : int
+        Number of photon events per block
+    max_clock : float
+        Maximum system clock [MHz], see :data:`MAX_CLOCK`
+
+    Yields
+    ------
+    data_stream : ndarray (uint32)
+        Photon arrival time differences. All blocks have the length
+        `chunk_size`, except for the last one.
+    """
+    yield from openfile._regroup(
+        _iter_intervals(path, channel=channel, chunk_size=chunk_size,
+                        max_clock=max_clock),
+        chunk_size)
+
+
+def read_header(path):
+    """Read the header tags of a .ptu file
+
+    Returns
+    -------
+    tags : dict
+        Header tags; tags with an index are stored with the key
+        "Name(index)"
+    data_offset : int
+        Byte offset of the first record
+    """
+    tags = {}
+    with open(path, "rb") as fd:
+        if fd.read(8) != MAGIC:
+            raise ValueError("Not a PicoQuant .ptu file: {}".format(path))
+        fd.read(8)  # version
+        while True:
+            raw = fd.read(48)
+            if len(raw) < 48:
+                raise ValueError("Incomplete .ptu header: {}".format(path))
+            ident, idx, typ, value = struct.unpack("<32siIq", raw)
+            name = ident.rstrip(b"\x00").decode("ascii", "replace")
+            if idx > -1:
+                name = "{}({})".format(name, idx)
+            if typ in [_TY_ANSISTRING, _TY_WIDESTRING, _TY_FLOAT8ARRAY,
+                       _TY_BINARYBLOB]:
+                blob = fd.read(value)
+                if typ == _TY_ANSISTRING:
+                    value = blob.rstrip(b"\x00").decode("latin-1")
+                elif typ == _TY_WIDESTRING:
+                    value = blob.decode("utf-16-le").rstrip("\x00")
+                elif typ == _TY_FLOAT8ARRAY:
+                    value = np.frombuffer(blob, dtype="<f8")
+                else:
+                    value = blob
+            elif typ in [_TY_FLOAT8, _TY_DATETIME]:
+                value = struct.unpack("<d", struct.pack("<q", value))[0]
+            elif typ == _TY_BOOL8:
+                value = bool(value)
+            tags[name] = value
+            if name == "Header_End":
+                break
+        data_offset = fd.tell()
+    if tags.get("TTResultFormat_TTTRRecType") not in RECORD_TYPES:
+        raise ValueError("Unsupported record type {} in {}".format(
+            tags.get("TTResultFormat_TTTRRecType"), path))
+    return tags, data_offset
+
+
+def system_clock(tags, max_clock=MAX_CLOCK):
+    """System clock [MHz] of the photon stream of a .ptu file
+
+    This is the inverse of the global resolution of the file (for
+    T3 files the sync rate), reduced by an integer factor to at most
+    `max_clock` (see :func:`_clock_factor`).
+    """
+    native, factor = _clock_factor(tags, max_clock)
+    clock = native / factor
+    if abs(clock - round(clock)) < 1e-6:
+        clock = int(round(clock))
+    return clock
+
+
+def _clock_factor(tags, max_clock):
+    """Native clock [MHz] and integer factor for reducing it"""
+    native = 1e-6 / tags["MeasDesc_GlobalResolution"]
+    factor = max(1, int(np.ceil(native / max_clock - 1e-9)))
+    return native, factor
+
+
+def _iter_intervals(path, channel=None, chunk_size=1048576,
+                    max_clock=MAX_CLOCK):
+    """Decode a .ptu file to arrival time differences block by block
+
+    The blocks contain the photon events of at most `chunk_size`
+    records.
+    """
+    tags, data_offset = read_header(path)
+    mode, layout = RECORD_TYPES[tags["TTResultFormat_TTTRRecType"]]
+    _, factor = _clock_factor(tags, max_clock)
+    n_records = tags.get("TTResult_NumberOfRecords", -1)
+    overflow = 0
+    last = 0
+    with open(path, "rb") as fd:
+        fd.seek(data_offset)
+        while n_records != 0:
+            count = chunk_size if n_records < 0 else min(chunk_size,
+                                                         n_records)
+            records = np.fromfile(fd, dtype="<u4", count=count)
+            if records.size == 0:
+                break
+            n_records -= records.size
+            times, channels, overflow = _decode_records(
+                records, mode, layout, overflow)
+            if channel is not None:
+                times = times[np.isin(channels, channel)]
+            if times.size == 0:
+                continue
+            times //= np.uint64(factor)
+            deltas = np.diff(times, prepend=np.uint64(last))
+            last = int(times[-1])
+            if deltas.size and deltas.max() > np.iinfo(np.uint32).max:
+                raise ValueError("Arrival time difference exceeds 32 bit "
+                                 "in {}; use a lower `max_clock`.".format(
+                                     path))
+            yield deltas.astype(np.uint32)
+
+
+def _decode_records(records, mode, layout, overflow=0):
+    """Decode 32 bit TTTR records
+
+    Parameters
+    ----------
+    records : ndarray (uint32)
+        The records
+    mode : str
+        "T2" or "T3"
+    layout : str
+        Record layout, see :data:`RECORD_TYPES`
+    overflow : int
+        Time tag overflow correction before the first record
+
+    Returns
+    -------
+    times : ndarray (uint64)
+        Arrival times of the photon events in units of the global
+        resolution (macro time for T3 records)
+    channels : ndarray (uint8)
+        Detection channels of the photon events
+    overflow : int
+        Time tag overflow correction after the last record
+    """
+    records = records.astype(np.uint32, copy=False)
+    if layout == "picoharp":
+        channels = (records >> 28).astype(np.uint8)
+        special = channels == 0xF
+        if mode == "T2":
+            tag = records & 0x0FFFFFFF
+            wrap = special & ((tag & 0xF) == 0)
+            increment = np.uint64(210698240)
+        else:
+            tag = records & 0xFFFF
+            wrap = special & (((records >> 16) & 0xFFF) == 0)
+            increment = np.uint64(65536)
+        n_wraps = wrap.astype(np.uint64)
+    else:
+        special = (records >> 31).astype(bool)
+        channels = ((records >> 25) & 0x3F).astype(np.uint8)
+        if mode == "T2":
+            tag = records & 0x1FFFFFF
+            increment = np.uint64(33552000 if layout == "hydraharp1"
+                                  else 33554432)
+        else:
+            tag = records & 0x3FF
+            increment = np.uint64(1024)
+        wrap = special & (channels == 0x3F)
+        n_wraps = wrap.astype(np.uint64)
+        if layout == "generic":
+            # the time tag of an overflow record is the number of
+            # overflows (zero means one overflow in old files)
+            n_wraps[wrap] = np.maximum(tag[wrap], 1)
+    correction = np.cumsum(n_wraps * increment, dtype=np.uint64)
+    correction += np.uint64(overflow)
+    photon = ~special
+    times = correction[photon] + tag[photon]
+    if correction.size:
+        overflow = int(correction[-1])
+    return times, channels[photon], overflow
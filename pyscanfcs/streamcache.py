@@ -0,0 +1,195 @@
+"""Persistent disk cache for decoded photon streams
+
+Decoding a 16 bit .dat file takes time. The :class:`StreamCache`
+stores decoded photon streams as .npy files that are memory-mapped
+when the same file is opened again. Entries are keyed by a
+fingerprint of the file (path, size, modification time and a hash of
+samples of the content) and the least recently used entries are
+removed when the cache exceeds its size limit.
+
+Entries that are memory-mapped in the current session are never
+removed or replaced (this is not possible on Windows).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import warnings
+import weakref
+
+import numpy as np
+
+
+#: default cache size limit in bytes
+MAX_SIZE = 4 * 1024**3
+
+#: size of the content samples used for the fingerprint in bytes
+SAMPLE_SIZE = 65536
+
+
+class StreamCache(object):
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        """Disk cache for decoded photon streams
+
+        Parameters
+        ----------
+        directory : str or None
+            Cache directory; defaults to "pyscanfcs/streams" in the
+            user's cache directory (`$XDG_CACHE_HOME` or "~/.cache").
+        max_size : int
+            Maximum size of the cache in bytes
+        """
+        if directory is None:
+            base = os.environ.get("XDG_CACHE_HOME",
+                                  os.path.join(os.path.expanduser("~"),
+                                               ".cache"))
+            directory = os.path.join(base, "pyscanfcs", "streams")
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        # memory maps returned by `get` (key -> list of weak references)
+        self._mapped = {}
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".npy", base + ".json"
+
+    def _in_use(self, key):
+        """Whether an entry is memory-mapped in this session"""
+        refs = [r for r in self._mapped.get(key, []) if r() is not None]
+        if refs:
+            self._mapped[key] = refs
+        else:
+            self._mapped.pop(key, None)
+        return bool(refs)
+
+    def _remove(self, key):
+        """Remove an entry, returns False if that is not possible"""
+        if self._in_use(key):
+            # still memory-mapped in this session
+            return False
+        try:
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError:
+            # e.g. mapped by another process on Windows
+            return False
+        return True
+
+    def clear(self):
+        """Remove all entries from the cache
+
+        Entries that are in use are skipped.
+        """
+        for key, _, _ in self.entries():
+            self._remove(key)
+
+    def entries(self):
+        """Return a list of (key, size, access time) of all entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((name[:-4], stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self, reserve=0):
+        """Remove least recently used entries to respect `max_size`
+
+        Parameters
+        ----------
+        reserve : int
+            Additional number of bytes that should fit into the cache
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for key, size, _ in entries:
+            if total + reserve <= self.max_size:
+                break
+            if self._remove(key):
+                total -= size
+
+    def get(self, path):
+        """Return the cached photon stream of a file
+
+        Returns
+        -------
+        info : dict or None
+            Dictionary with the read-only memory-mapped "data_stream"
+            and the "system_clock" or None if the file is not cached.
+        """
+        key = fingerprint(path)
+        npy, meta = self._paths(key)
+        if not (os.path.exists(npy) and os.path.exists(meta)):
+            return None
+        with open(meta) as fd:
+            info = json.load(fd)
+        info["data_stream"] = np.load(npy, mmap_mode="r")
+        self._mapped.setdefault(key, []).append(
+            weakref.ref(info["data_stream"]))
+        # mark entry as recently used
+        try:
+            os.utime(npy)
+        except OSError:
+            pass
+        return info
+
+    def put(self, path, data, system_clock):
+        """Add a decoded photon stream to the cache
+
+        Entries larger than `max_size` are not cached. Errors while
+        writing the entry (e.g. a full disk or an entry that is
+        memory-mapped by another process) are reported as warnings.
+        """
+        data = np.asarray(data, dtype=np.uint32)
+        if data.nbytes > self.max_size:
+            return
+        key = fingerprint(path)
+        if self._in_use(key):
+            # the entry exists and is in use
+            return
+        self.evict(reserve=data.nbytes)
+        npy, meta = self._paths(key)
+        # write to temporary files first, so that concurrent readers
+        # never see incomplete entries
+        tmppaths = []
+        try:
+            fdnpy, tmpnpy = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+            tmppaths.append(tmpnpy)
+            with os.fdopen(fdnpy, "wb") as fd:
+                np.save(fd, data)
+            fdmeta, tmpmeta = tempfile.mkstemp(dir=self.directory,
+                                               suffix=".tmp")
+            tmppaths.append(tmpmeta)
+            with os.fdopen(fdmeta, "w") as fd:
+                json.dump({"system_clock": system_clock,
+                           "path": os.path.abspath(path)}, fd)
+            os.replace(tmpmeta, meta)
+            os.replace(tmpnpy, npy)
+        except OSError as e:
+            warnings.warn("Could not cache {}: {}".format(path, e))
+        finally:
+            for tmp in tmppaths:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+
+def fingerprint(path):
+    """Fast fingerprint of a file
+
+    The fingerprint is computed from the absolute path, the size, the
+    modification time and samples of the content (beginning, middle
+    and end of the file).
+    """
+    stat = os.stat(path)
+    hasher = hashlib.sha1()
+    hasher.update("{}|{}|{}".format(os.path.abspath(path),
+                                     stat.st_size,
+                                     stat.st_mtime_ns).encode("utf-8"))
+    with open(path, "rb") as fd:
+        for pos in [0, stat.st_size // 2, stat.st_size - SAMPLE_SIZE]:
+            fd.seek(max(pos, 0))
+            hasher.update(fd.read(SAMPLE_SIZE))
+    return hasher.hexdigest()
@@ -21,7 +21,11 @@ else:
     extensions = [Extension("pyscanfcs.bin_pe",
                             sources=["pyscanfcs/bin_pe.pyx"],
                             include_dirs=[np.get_include()]
-                            )
+                            ),
+                  Extension("pyscanfcs.decode_dat",
+                            sources=["pyscanfcs/decode_dat.pyx"],
+                            include_dirs=[np.get_include()]
+                            ),
                  ]
 
 try:
@@ -85,6 +89,7 @@ setup(
                  ],
     platforms=['ALL'],
     entry_points={
-       "gui_scripts": ["pyscanfcs=pyscanfcs.gui_wx.main:Main"]
+       "gui_scripts": ["pyscanfcs=pyscanfcs.gui_wx.main:Main"],
+       "console_scripts": ["pyscanfcs-convert=pyscanfcs.convert:main"],
        }
     )
@@ -0,0 +1,118 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from pyscanfcs import archive, openfile
+
+
+@pytest.fixture(params=["compiled", "numpy"])
+def engine(request, monkeypatch):
+    if request.param == "compiled":
+        pytest.importorskip("pyscanfcs.decode_dat")
+    else:
+        monkeypatch.setattr(archive, "decode_dat", None)
+    return request.param
+
+
+def test_varint(engine):
+    values = np.array([0, 1, 127, 128, 16383, 16384, 2**21 - 1, 2**21,
+                       2**28 - 1, 2**28, 2**32 - 1], dtype=np.uint32)
+    raw = archive.varint_encode(values)
+    assert raw.size == 1 + 1 + 1 + 2 + 2 + 3 + 3 + 4 + 4 + 5 + 5
+    assert np.all(archive.varint_decode(raw) == values)
+    rs = np.random.RandomState(42)
+    values = rs.randint(0, 2**32, size=10000, dtype=np.uint64)
+    values = (values >> rs.randint(0, 32, size=10000).astype(np.uint64)).astype(np.uint32)
+    assert np.all(archive.varint_decode(archive.varint_encode(values))
+                  == values)
+    # trailing incomplete integer is ignored
+    raw = archive.varint_encode(np.array([5, 300], dtype=np.uint32))
+    assert np.all(archive.varint_decode(raw[:-1]) == [5])
+
+
+def test_compress_dat(tmp_path, engine):
+    here = pathlib.Path(__file__).parent
+    path = str(here / "data/n2000_7.0ms_16bit.dat")
+    ref = openfile.openDAT(path)["data_stream"]
+    outpath = str(tmp_path / "n2000.psz")
+    archive.compress_dat(path, outpath, block_size=1000)
+    # smaller than the 16 bit file
+    assert pathlib.Path(outpath).stat().st_size < ref.nbytes / 4
+    arc = archive.ArchiveReader(outpath)
+    assert len(arc) == ref.size
+    assert arc.n_blocks == 32
+    assert arc.total_time == np.sum(ref)
+    assert arc.times[5] == np.sum(ref[:5000])
+    assert np.all(arc.read_block(3) == ref[3000:4000])
+    info = openfile.openAny(outpath)
+    assert info["system_clock"] == 60
+    assert np.all(info["data_stream"] == ref)
+    # detected by magic bytes
+    renamed = tmp_path / "n2000.bin"
+    renamed.write_bytes(pathlib.Path(outpath).read_bytes())
+    assert openfile.detect_format(str(renamed)) == "psz"
+
+
+def test_writer_pieces(tmp_path):
+    rs = np.random.RandomState(42)
+    data = rs.randint(1, 100000, size=2500).astype(np.uint32)
+    path = str(tmp_path / "pieces.psz")
+    with archive.ArchiveWriter(path, system_clock=80, block_size=300) as arc:
+        for piece in np.array_split(data, 7):
+            arc.write(piece)
+    arc = archive.ArchiveReader(path)
+    assert arc.system_clock == 80
+    assert np.all(arc.n_events[:-1] == 300)
+    assert np.all(arc.read(workers=3) == data)
+    assert np.all(np.concatenate(list(arc.iter_blocks())) == data)
+
+
+def test_time_window(tmp_path):
+    rs = np.random.RandomState(3)
+    data = rs.randint(1, 20, size=20000).astype(np.uint32)
+    data[5000:5010] = 0
+    path = str(tmp_path / "window.psz")
+    with archive.ArchiveWriter(path, system_clock=60, block_size=999) as arc:
+        arc.write(data)
+    arrival = np.cumsum(data, dtype=np.uint64)
+    for t_start, t_stop in [(0, 10), (arrival[5000], arrival[5000] + 1),
+                            (12345, 98765), (arrival[-1], arrival[-1] + 5),
+                            (arrival[-1] + 1, arrival[-1] + 5)]:
+        info = openfile.openAny(path, t_start=int(t_start),
+                                t_stop=int(t_stop), time_unit="ticks")
+        sel = (arrival >= t_start) & (arrival < t_stop)
+        ref = data[sel].copy()
+        if ref.size:
+            ref[0] = arrival[sel][0] - t_start
+        assert info["time_offset"] == t_start
+        assert np.array_equal(info["data_stream"], ref)
+    # seconds
+    info = openfile.openAny(path, t_stop=100 / 60e6)
+    assert np.array_equal(info["data_stream"], data[arrival < 100])
+    # options without effect for archives
+    info = openfile.openAny(path, mmap=True, cache=None, index=True)
+    assert info["index"] is None
+    with pytest.raises(ValueError, match="Salvage"):
+        openfile.openAny(path, salvage=True)
+    with pytest.raises(TypeError):
+        openfile.openAny(path, unknown=1)
+
+
+def test_incomplete(tmp_path):
+    path = str(tmp_path / "incomplete.psz")
+    arc = archive.ArchiveWriter(path, system_clock=60)
+    arc.write(np.arange(10, dtype=np.uint32))
+    arc._fd.flush()
+    with pytest.raises(ValueError, match="Incomplete"):
+        archive.ArchiveReader(path)
+    arc.close()
+    assert np.all(archive.ArchiveReader(path).read() == np.arange(10))
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -1,6 +1,7 @@
 import numpy as np
+import pytest
 
-from pyscanfcs import bin_pe
+bin_pe = pytest.importorskip("pyscanfcs.bin_pe")
 
 
 def test_bin_photon_events():
@@ -16,6 +17,57 @@ def test_bin_photon_events():
     assert np.all(binned == np.array([1, 3, 4, 3, 0, 3]))
 
 
+def test_bin_photon_array():
+    rs = np.random.RandomState(42)
+    data = rs.randint(1, 300, size=100000).astype(np.uint32)
+    t_bin = 77.7
+    binned = bin_pe.bin_photon_array(data, t_bin=t_bin, binshift=4)
+    # exact arrival times
+    arrival = np.cumsum(data, dtype=np.uint64)
+    ref = np.bincount(np.floor(arrival / t_bin).astype(np.int64))
+    assert binned.dtype == np.uint16
+    assert np.all(binned[:4] == 0)
+    assert np.all(binned[4:] == ref)
+    binf = bin_pe.bin_photon_events(data, t_bin=t_bin, binshift=4)
+    assert np.all(np.fromfile(binf, dtype="uint16") == binned)
+    # total time from index
+    binned = bin_pe.bin_photon_array(data, t_bin=t_bin, outdtype=np.uint32,
+                                     total_time=int(arrival[-1]))
+    assert binned.dtype == np.uint32
+    assert np.all(binned == ref)
+    with pytest.raises(ValueError, match="too short"):
+        bin_pe.bin_photon_array(data, t_bin=t_bin,
+                                total_time=int(arrival[-1]) - 1000)
+
+
+def test_bin_photon_array_empty():
+    data = np.zeros(0, dtype=np.uint32)
+    assert np.all(bin_pe.bin_photon_array(data, t_bin=10) == [0])
+    binf = bin_pe.bin_photon_events(data, t_bin=10)
+    assert np.all(np.fromfile(binf, dtype="uint16") == [0])
+
+
+def test_bin_photon_array_chunks():
+    class Stream(object):
+        def __init__(self, parts):
+            self.parts = parts
+
+        def iter_chunks(self):
+            yield from self.parts
+
+    rs = np.random.RandomState(1)
+    data = rs.randint(1, 100, size=5000).astype(np.uint32)
+    # includes empty chunks and chunks within a single bin
+    parts = [data[:1000], data[1000:1000], data[1000:1001], data[1001:]]
+    ref = bin_pe.bin_photon_array(data, t_bin=1000.5, outdtype=np.uint8)
+    binned = bin_pe.bin_photon_array(Stream(parts), t_bin=1000.5,
+                                     outdtype=np.uint8)
+    assert np.all(binned == ref)
+    binf = bin_pe.bin_photon_events(Stream(parts), t_bin=1000.5,
+                                    outdtype=np.uint8)
+    assert np.all(np.fromfile(binf, dtype="uint8") == ref)
+
+
 if __name__ == "__main__":
     # Run all tests
     loc = locals()
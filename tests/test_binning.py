@@ -0,0 +1,242 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from pyscanfcs import binning, checkpoint, openfile, util
+
+
+@pytest.fixture(params=["compiled", "numpy"])
+def engine(request, monkeypatch):
+    if request.param == "compiled":
+        pytest.importorskip("pyscanfcs.bin_pe")
+    else:
+        monkeypatch.setattr(binning, "bin_pe", None)
+    return request.param
+
+
+def reference(data, t_bin, binshift=0, outdtype=np.uint32):
+    """Bin photon events with a single call to numpy.bincount"""
+    arrival = np.cumsum(data, dtype=np.uint64)
+    # uint64 -> double like the compiled kernel
+    bins = (arrival / t_bin).astype(np.intp) + binshift
+    binned = np.bincount(bins, minlength=binshift + 1)
+    return binned.astype(outdtype)
+
+
+def test_bin_photon_events(engine):
+    data = np.array([5,  # 5
+                     1, 1, 1,  # 8
+                     4, 1, 1, 1,  # 15
+                     1, 1, 1,  # 18
+                     # blank
+                     8, 1, 1,  # 28
+                     ], dtype=np.uint32)
+    binf = binning.bin_photon_events(data=data, t_bin=5.0001)
+    binned = np.fromfile(binf, dtype="uint16", count=-1)
+    assert np.all(binned == np.array([1, 3, 4, 3, 0, 3]))
+    assert np.all(binning.bin_photon_array(data, t_bin=5.0001) == binned)
+
+
+def test_bin_photon_array_identical(engine):
+    rs = np.random.RandomState(42)
+    data = rs.randint(1, 300, size=100000).astype(np.uint32)
+    # large time differences and bin times that are not representable
+    # as floating point numbers
+    data[::10000] = rs.randint(2**20, 2**22, size=data[::10000].size)
+    for t_bin in [77.7, 1000.3, 3]:
+        ref = reference(data, t_bin, binshift=3)
+        binned = binning.bin_photon_array(data, t_bin=t_bin, binshift=3,
+                                          outdtype=np.uint32)
+        assert binned.dtype == np.uint32
+        assert np.array_equal(binned, ref)
+        binf = binning.bin_photon_events(data, t_bin=t_bin, binshift=3,
+                                         outdtype=np.uint32)
+        assert np.array_equal(np.fromfile(binf, dtype="uint32"), ref)
+
+
+def test_bin_photon_array_overflow(engine):
+    # counts wrap around like in the compiled kernel
+    data = np.ones(300, dtype=np.uint32)
+    binned = binning.bin_photon_array(data, t_bin=1000, outdtype=np.uint8)
+    assert np.all(binned == [300 % 256])
+    with pytest.raises(ValueError, match="too short"):
+        binning.bin_photon_array(data, t_bin=1, total_time=200)
+
+
+def test_bin_photon_array_empty(engine):
+    data = np.zeros(0, dtype=np.uint32)
+    assert np.all(binning.bin_photon_array(data, t_bin=10) == [0])
+    binf = binning.bin_photon_events(data, t_bin=10)
+    assert np.all(np.fromfile(binf, dtype="uint16") == [0])
+
+
+def test_bin_chunk_numpy_blocks():
+    rs = np.random.RandomState(3)
+    data = rs.randint(1, 50, size=10000).astype(np.uint32)
+    arrival = np.cumsum(data, dtype=np.uint64) + np.uint64(12345)
+    bins = (arrival / 7.3).astype(np.intp) - 1690
+    ref = np.bincount(bins, minlength=bins[-1] + 6).astype(np.uint16)
+    out = np.zeros_like(ref)
+    binning._bin_chunk_numpy(data, 7.3, 12345, 1690, out, block_size=999)
+    assert np.array_equal(out, ref)
+
+
+def test_bin_parallel(engine):
+    rs = np.random.RandomState(7)
+    data = rs.randint(1, 40, size=200000).astype(np.uint32)
+    # many events per bin: the first bin of each segment is shared
+    for t_bin, outdtype in [(0.7, np.uint16), (5000.5, np.uint32),
+                            (300, np.uint8)]:
+        ref = reference(data, t_bin, binshift=2, outdtype=outdtype)
+        for workers in [2, 3, 7]:
+            binned = binning.bin_photon_array(data, t_bin, binshift=2,
+                                              outdtype=outdtype,
+                                              workers=workers)
+            assert np.array_equal(binned, ref)
+        binf = binning.bin_photon_events(data, t_bin, binshift=2,
+                                         outdtype=outdtype, workers=4)
+        assert np.array_equal(np.fromfile(binf, dtype=outdtype), ref)
+
+
+def test_bin_parallel_index(engine):
+    here = pathlib.Path(__file__).parent
+    path = str(here / "data/n2000_7.0ms_16bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    cpi = checkpoint.CheckpointIndex.build(path, data=data, every=1000)
+    ref = reference(data, 1234.5, outdtype=np.uint16)
+    bounds, times = binning._split_segments(data, 4, index=cpi)
+    assert len(times) == 4
+    assert all(b % 1000 == 0 for b in bounds[:-1])
+    for a, time in zip(bounds, times):
+        assert time == np.sum(data[:a], dtype=np.uint64)
+    for workers in [1, 4, 1000]:
+        binned = binning.bin_photon_array(data, 1234.5, workers=workers,
+                                          index=cpi)
+        assert np.array_equal(binned, ref)
+
+
+def test_bin_pyramid(engine):
+    rs = np.random.RandomState(11)
+    data = rs.randint(1, 1000, size=50000).astype(np.uint32)
+    t_bin = 33.3
+    pyramid = binning.bin_pyramid(data, t_bin, outdtype=np.uint8)
+    assert pyramid[-1].size == 1
+    assert pyramid[-1][0] == data.size
+    for k in range(len(pyramid)):
+        # identical to binning with the bin time of the level
+        ref = reference(data, pyramid.bin_time(k))
+        assert np.array_equal(pyramid[k], ref)
+    assert pyramid[1].dtype == np.uint8
+    assert pyramid[-1].dtype == np.uint16
+    # selection of levels
+    assert pyramid.level_for_bin_time(t_bin) == 0
+    assert pyramid.level_for_bin_time(4.5 * t_bin) == 2
+    k = pyramid.level_for_length(1000)
+    assert pyramid[k].size <= 1000 < pyramid[k - 1].size
+
+
+def test_bin_pyramid_reduce_trace():
+    rs = np.random.RandomState(12)
+    binned = rs.randint(0, 50, size=12345).astype(np.uint16)
+    pyramid = binning.BinPyramid.from_binned(binned, t_bin=10)
+    for length in [12345, 5000, 700, 1]:
+        ref = util.reduce_trace(binned.astype(float), 0.1, length)
+        assert np.array_equal(pyramid.reduce_trace(0.1, length), ref)
+    pyramid = binning.BinPyramid.from_binned(binned, t_bin=10, n_levels=3)
+    assert len(pyramid) == 3
+    assert pyramid.level_for_length(10) == 2
+    with pytest.raises(ValueError, match="levels"):
+        pyramid.reduce_trace(0.1, 700)
+
+
+def test_bin_kymograph(engine):
+    rs = np.random.RandomState(21)
+    data = rs.randint(1, 200, size=100000).astype(np.uint32)
+    # integer line time: identical to binning and reshaping
+    binned = reference(data, 100, binshift=7, outdtype=np.uint16)
+    kymo = binning.bin_kymograph(data, line_time=1000, bins_per_line=10,
+                                 binshift=7)
+    assert kymo.shape == (-(-binned.size // 10), 10)
+    assert kymo.dtype == np.uint16
+    assert np.array_equal(kymo.reshape(-1)[:binned.size], binned)
+    assert np.all(kymo.reshape(-1)[binned.size:] == 0)
+    # parallel binning
+    kymo2 = binning.bin_kymograph(data, line_time=1000, bins_per_line=10,
+                                  binshift=7, workers=3)
+    assert np.array_equal(kymo2, kymo)
+
+
+def test_bin_kymograph_fractional(engine):
+    rs = np.random.RandomState(22)
+    data = rs.randint(1, 500, size=200000).astype(np.uint32)
+    # line time 1000.25 = 4001 / 4 ticks
+    kymo = binning.bin_kymograph(data, line_time=1000.25, bins_per_line=10,
+                                 outdtype=np.uint32)
+    # exact reference with integer arithmetic
+    arrival = np.cumsum(data, dtype=np.uint64).astype(np.int64)
+    line = 4 * arrival // 4001
+    column = (4 * arrival - 4001 * line) * 10 // 4001
+    ref = np.zeros((line[-1] + 1, 10), dtype=np.uint32)
+    np.add.at(ref, (line, column), 1)
+    assert np.array_equal(kymo, ref)
+    # one-dimensional binning accumulates the rounding error
+    binned = reference(data, 1000.25 / 10)
+    assert not np.array_equal(binned, ref.reshape(-1)[:binned.size])
+    # line time correction
+    kymo2 = binning.bin_kymograph(data, line_time=2000.5, bins_per_line=10,
+                                  correction=0.5, outdtype=np.uint32)
+    assert np.array_equal(kymo2, ref)
+    kymo3 = binning.bin_kymograph(data, line_time=1000.25, bins_per_line=10,
+                                  outdtype=np.uint32, workers=4)
+    assert np.array_equal(kymo3, ref)
+
+
+def test_iter_kymograph(engine):
+    rs = np.random.RandomState(23)
+    data = rs.randint(1, 500, size=50000).astype(np.uint32)
+    for line_time, binshift in [(1000, None), (1000.25, 7), (333.3, 25)]:
+        ref = binning.bin_kymograph(data, line_time, 10, binshift=binshift)
+        blocks = list(binning.iter_kymograph(data, line_time, 10,
+                                             binshift=binshift))
+        assert len(blocks) > 50
+        assert all(b.shape[1] == 10 for b in blocks)
+        assert np.array_equal(np.concatenate(blocks), ref)
+    empty = np.zeros(0, dtype=np.uint32)
+    blocks = list(binning.iter_kymograph(empty, 1000, 10, binshift=13))
+    assert np.array_equal(np.concatenate(blocks),
+                          binning.bin_kymograph(empty, 1000, 10, binshift=13))
+
+
+def test_iter_kymograph_parallel(engine):
+    here = pathlib.Path(__file__).parent
+    path = str(here / "data/n2000_7.0ms_16bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    cpi = checkpoint.CheckpointIndex.build(path, data=data, every=1000)
+    ref = binning.bin_kymograph(data, 4321.5, 20, binshift=3)
+    for workers in [1, 4]:
+        for index in [None, cpi]:
+            blocks = list(binning.iter_kymograph(data, 4321.5, 20,
+                                                 binshift=3,
+                                                 workers=workers,
+                                                 index=index))
+            assert np.array_equal(np.concatenate(blocks), ref)
+
+
+def test_kymo_bins():
+    bin_pe = pytest.importorskip("pyscanfcs.bin_pe")
+    arrival = np.array([0, 1, 99, 100, 4000, 4001, 4002, 2**40],
+                       dtype=np.uint64)
+    for line_time in [1000.25, 77.7, 3 * 0.1]:
+        bins = binning.kymo_bins(arrival, line_time, 13)
+        for time, b in zip(arrival, bins):
+            assert bin_pe.kymo_bin(int(time), line_time, 13) == b
+        assert np.all(np.diff(bins) >= 0)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,93 @@
+import os
+import pathlib
+import shutil
+
+import numpy as np
+import pytest
+
+from pyscanfcs import checkpoint, openfile
+
+
+def copy_data(tmp_path, name):
+    here = pathlib.Path(__file__).parent
+    path = tmp_path / name
+    shutil.copy(str(here / "data" / name), str(path))
+    return str(path)
+
+
+def test_build():
+    here = pathlib.Path(__file__).parent
+    for name in ["n2000_7.0ms_16bit.dat", "n2000_7.0ms_32bit.dat"]:
+        path = str(here / "data" / name)
+        data = openfile.openDAT(path)["data_stream"]
+        cpi = checkpoint.CheckpointIndex.build(path, every=100)
+        cpi2 = checkpoint.CheckpointIndex.build(path, data=data, every=100)
+        assert cpi.n_events == cpi2.n_events == data.size
+        assert cpi.total_time == cpi2.total_time == np.sum(data)
+        assert np.all(cpi.times == cpi2.times)
+        assert np.all(cpi.offsets == cpi2.offsets)
+        # decoding from checkpoint offsets
+        for jj in [0, 1, 57, len(cpi.offsets) - 1]:
+            block, _ = openfile._read_events(path, cpi.offsets[jj], 100)
+            assert np.all(block == data[jj * 100:(jj + 1) * 100])
+
+
+def test_lookup():
+    here = pathlib.Path(__file__).parent
+    path = str(here / "data/n2000_7.0ms_16bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    arrival = np.cumsum(data, dtype=np.uint64)
+    cpi = checkpoint.CheckpointIndex.build(path, every=100)
+    for event in [0, 99, 100, 101, 12345, data.size - 1]:
+        assert cpi.event_time(event) == arrival[event]
+        assert cpi.event_time(event, data=data) == arrival[event]
+    times = [0, 1, arrival[99], arrival[99] + 1, arrival[100],
+             arrival[-1], arrival[-1] + 1]
+    for time in times:
+        ref = np.searchsorted(arrival, time)
+        assert cpi.time_to_event(time) == ref
+        assert cpi.time_to_event(time, data=data) == ref
+    jj, offset, time = cpi.seek(arrival[1000])
+    assert jj == 10
+    assert time == arrival[999]
+
+
+def test_sidecar(tmp_path):
+    path = copy_data(tmp_path, "n2000_7.0ms_16bit.dat")
+    assert checkpoint.CheckpointIndex.load(path) is None
+    info = openfile.openDAT(path, index=True)
+    assert os.path.exists(checkpoint.sidecar_path(path))
+    cpi = checkpoint.CheckpointIndex.load(path)
+    assert cpi.n_events == info["index"].n_events
+    assert cpi.total_time == np.sum(info["data_stream"])
+    assert np.all(cpi.offsets == info["index"].offsets)
+    # modified files invalidate the index
+    with open(path, "ab") as fd:
+        fd.write(b"\x01\x00")
+    assert checkpoint.CheckpointIndex.load(path) is None
+
+
+
+def test_sidecar_incomplete(tmp_path):
+    path = copy_data(tmp_path, "n2000_7.0ms_16bit.dat")
+    openfile.openDAT(path, index=True)
+    spath = checkpoint.sidecar_path(path)
+    raw = open(spath, "rb").read()
+    # half-written sidecar file (e.g. after a crash)
+    with open(spath, "wb") as fd:
+        fd.write(raw[:len(raw) // 2])
+    with pytest.warns(UserWarning, match="unreadable"):
+        assert checkpoint.CheckpointIndex.load(path) is None
+    with pytest.warns(UserWarning, match="unreadable"):
+        info = openfile.openDAT(path, index=True)
+    assert info["index"].n_events == 31417
+    # the sidecar file was replaced
+    assert checkpoint.CheckpointIndex.load(path).n_events == 31417
+    assert not os.path.exists(spath + ".tmp")
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,47 @@
+import pathlib
+import shutil
+
+import numpy as np
+
+from pyscanfcs import convert, openfile
+
+
+def test_dat32_name():
+    assert convert.dat32_name("run_1A.dat") == "run_1_32bit_A.dat"
+    assert convert.dat32_name("run_1B.dat") == "run_1_32bit_B.dat"
+    assert convert.dat32_name("/a/run.dat") == "/a/run_32bit.dat"
+
+
+def test_convert_dat(tmp_path):
+    here = pathlib.Path(__file__).parent
+    path = str(tmp_path / "n2000A.dat")
+    shutil.copy(str(here / "data/n2000_7.0ms_16bit.dat"), path)
+    # small chunks to test the streaming conversion
+    outpath = convert.convert_dat(path, chunk_size=1000)
+    assert outpath == str(tmp_path / "n2000_32bit_A.dat")
+    ref = (here / "data/n2000_7.0ms_32bit.dat").read_bytes()
+    assert pathlib.Path(outpath).read_bytes() == ref
+
+
+def test_convert_many_cli(tmp_path):
+    here = pathlib.Path(__file__).parent
+    paths = []
+    for ii in range(3):
+        path = str(tmp_path / "file{}.dat".format(ii))
+        shutil.copy(str(here / "data/n2000_7.0ms_16bit.dat"), path)
+        paths.append(path)
+    outdir = tmp_path / "out"
+    convert.main(["-j", "2", "-o", str(outdir)] + paths)
+    ref = openfile.openDAT(paths[0])["data_stream"]
+    for ii in range(3):
+        info = openfile.openDAT(str(outdir / "file{}_32bit.dat".format(ii)))
+        assert np.all(info["data_stream"] == ref)
+    assert not list(outdir.glob("*.tmp"))
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
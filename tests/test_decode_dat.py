@@ -0,0 +1,97 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from pyscanfcs import openfile
+
+decode_dat = pytest.importorskip("pyscanfcs.decode_dat")
+
+
+def make_words(data):
+    """Encode photon arrival time differences as 16 bit words"""
+    words = []
+    for d in data:
+        if d < 0xFFFF:
+            words.append(d)
+        else:
+            words += [0xFFFF, d & 0xFFFF, d >> 16]
+    return np.array(words, dtype=np.uint16)
+
+
+def test_decode_16bit():
+    data = np.array([3, 70000, 0x1FFFF, 0xFFFF, 5, 0xFFFFFFFF, 0xFFFF0001,
+                     1, 0x10000, 2], dtype=np.uint32)
+    words = make_words(data)
+    assert decode_dat.count_16bit(words) == (data.size, words.size)
+    dec, consumed = decode_dat.decode_16bit(words)
+    assert consumed == words.size
+    assert dec.dtype == np.uint32
+    assert np.all(dec == data)
+
+
+def test_decode_16bit_incomplete():
+    words = make_words([1, 2, 70000])
+    for cut in [1, 2]:
+        dec, consumed = decode_dat.decode_16bit(words[:-cut])
+        assert consumed == 2
+        assert np.all(dec == [1, 2])
+
+
+def test_decode_16bit_out():
+    words = make_words([1, 2, 70000, 4])
+    out = np.zeros(10, dtype=np.uint32)
+    dec, consumed = decode_dat.decode_16bit(words, out=out)
+    assert np.shares_memory(dec, out)
+    assert np.all(dec == [1, 2, 70000, 4])
+    # decoding stops when the output is full
+    dec, consumed = decode_dat.decode_16bit(words, out=out[:3])
+    assert consumed == 5
+    assert np.all(dec == [1, 2, 70000])
+
+
+def test_decode_16bit_parallel():
+    rs = np.random.RandomState(42)
+    data = rs.randint(1, 0xFFFF, size=5000).astype(np.uint32)
+    # many escapes, also with 0xFFFF in the payload
+    data[::7] = 0x1FFFF
+    data[::11] = 0xFFFFFFFF
+    data[::13] = 70000
+    data[-1] = 70000
+    words = make_words(data)
+    for workers in [2, 3, 8, 100]:
+        dec, consumed = openfile._decode_16bit_parallel(words, workers)
+        assert consumed == words.size
+        assert np.all(dec == data)
+    # incomplete escape at the end
+    dec, consumed = openfile._decode_16bit_parallel(words[:-1], 4)
+    assert consumed == words.size - 3
+    assert np.all(dec == data[:-1])
+
+
+def test_split_16bit():
+    data = np.array([1, 0x1FFFF, 2, 3, 0xFFFFFFFF, 4, 5, 6, 70000, 7],
+                    dtype=np.uint32)
+    words = make_words(data)
+    bounds = openfile._split_16bit(words, words.size)
+    # only event boundaries that are not preceded by 0xFFFF are used
+    assert bounds == [0, 5, 6, 11, 12, 15, 16]
+    # no resynchronisation point
+    words = np.full(100, 0xFFFF, dtype=np.uint16)
+    assert openfile._split_16bit(words, 4) == [0, 100]
+
+
+def test_open_dat_workers():
+    here = pathlib.Path(__file__).parent
+    f16 = str(here / "data/n2000_7.0ms_16bit.dat")
+    ref = openfile.openDAT(f16, workers=1)["data_stream"]
+    data = openfile.openDAT(f16, workers=4)["data_stream"]
+    assert np.all(data == ref)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
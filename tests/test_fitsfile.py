@@ -0,0 +1,93 @@
+import astropy.io.fits
+import numpy as np
+import pytest
+
+from pyscanfcs import fitsfile, openfile
+
+
+META = {"system_clock": 60,
+        "line_time": 7000,
+        "bin_time": 1000,
+        "bin_shift": 3,
+        }
+
+
+def test_save_fits(tmp_path):
+    intdata = np.arange(100, dtype=np.uint16) % 200
+    path = str(tmp_path / "kymo.fits")
+    fitsfile.save_fits(path, intdata, bins_per_line=7, chunk_size=10,
+                       total_time=700000, **META)
+    info = openfile.openFITS(path)
+    assert info["data_binned"].dtype == np.dtype(">u1")
+    assert info["data_binned"].shape == (15, 7)
+    assert info["system_clock"] == 60
+    assert info["line_time"] == 7000
+    assert info["bin_time"] == 1000
+    assert info["bin_shift"] == 3
+    assert info["total_time"] == 700000
+    data = info["data_binned"].reshape(-1)
+    assert np.all(data[:100] == intdata)
+    assert np.all(data[100:] == 0)
+    # valid FITS file
+    with astropy.io.fits.open(path) as fits:
+        fits.verify("exception")
+        assert fits[0].data.shape == (15, 7)
+
+
+def test_append_widen(tmp_path):
+    path = str(tmp_path / "kymo.fits")
+    with fitsfile.FITSWriter(path, bins_per_line=5, **META) as fw:
+        fw.append(np.arange(12))
+        assert fw.bitpix == 8
+        assert fw.n_lines == 2
+        fw.append(np.array([[300, 1, 2]]))
+        assert fw.bitpix == 16
+        fw.append(np.arange(10) + 70000)
+        assert fw.bitpix == 32
+    info = openfile.openFITS(path)
+    assert info["total_time"] is None
+    assert info["data_binned"].dtype == np.dtype(">i4")
+    ref = np.concatenate((np.arange(12), [300, 1, 2], np.arange(10) + 70000))
+    assert np.all(info["data_binned"].reshape(-1) == ref)
+
+
+def test_save_fits_mapped(tmp_path):
+    # overwrite the file a kymograph was opened from
+    path = str(tmp_path / "kymo.fits")
+    intdata = np.arange(70, dtype=np.uint16)
+    fitsfile.save_fits(path, intdata, bins_per_line=7, **META)
+    data = openfile.openFITS(path)["data_binned"]
+    fitsfile.save_fits(path, data.reshape(-1) + 1, bins_per_line=7,
+                       **META)
+    # the memory map is still valid
+    assert np.all(data.reshape(-1) == intdata)
+    info = openfile.openFITS(path)
+    assert np.all(info["data_binned"].reshape(-1) == intdata + 1)
+    assert not (tmp_path / "kymo.fits.tmp").exists()
+
+
+def test_writer_exception(tmp_path):
+    path = tmp_path / "kymo.fits"
+    path.write_bytes(b"old")
+    with pytest.raises(ValueError, match="Negative"):
+        with fitsfile.FITSWriter(str(path), bins_per_line=5, **META) as fw:
+            fw.append([1, -1])
+    assert path.read_bytes() == b"old"
+    assert not (tmp_path / "kymo.fits.tmp").exists()
+
+
+def test_append_errors(tmp_path):
+    path = str(tmp_path / "kymo.fits")
+    with fitsfile.FITSWriter(path, bins_per_line=5, **META) as fw:
+        with pytest.raises(ValueError, match="Negative"):
+            fw.append([1, -1])
+        with pytest.raises(ValueError, match="exceed 32 bit"):
+            fw.append([2**31])
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,119 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from pyscanfcs import integrity, openfile
+
+
+here = pathlib.Path(__file__).parent
+
+
+def write_dat(path, fformat, raw, system_clock=60):
+    with open(path, "wb") as fd:
+        fd.write(np.array([fformat, system_clock], dtype="<u1").tobytes())
+        fd.write(raw)
+
+
+def test_intact():
+    for name in ["n2000_7.0ms_16bit.dat", "n2000_7.0ms_32bit.dat"]:
+        path = str(here / "data" / name)
+        data, report = integrity.scan_dat(path)
+        assert report["ok"]
+        assert report["n_events"] == data.size
+        assert report["last_consistent"] == data.size - 1
+        assert np.all(data == openfile.openDAT(path)["data_stream"])
+
+
+def test_truncated_escape(tmp_path):
+    path = str(tmp_path / "trunc16.dat")
+    # escape sequence with only one payload word and a trailing byte
+    words = np.array([5, 0xFFFF, 0x1170, 0x0001, 7, 0xFFFF, 3],
+                     dtype="<u2")
+    write_dat(path, 16, words.tobytes() + b"\x01")
+    with pytest.raises(ValueError, match="Truncated"):
+        openfile.openDAT(path)
+    info, report = integrity.salvage_dat(path)
+    assert np.all(info["data_stream"] == [5, 0x11170, 7])
+    assert info["system_clock"] == 60
+    assert report["truncated_escape"]
+    assert report["trailing_bytes"] == 5
+    assert report["n_salvaged"] == 3
+    assert not report["ok"]
+    info = openfile.openDAT(path, salvage=True)
+    assert np.all(info["data_stream"] == [5, 0x11170, 7])
+    assert info["integrity"]["trailing_bytes"] == 5
+
+
+def test_implausible(tmp_path):
+    path = str(tmp_path / "bad32.dat")
+    data = np.array([10, 20, 5000, 0, 30, 40], dtype="<u4")
+    write_dat(path, 32, data.tobytes() + b"\x01\x02")
+    _, report = integrity.scan_dat(path, max_zero_run=0)
+    assert report["zero_intervals"] == 1
+    assert report["large_intervals"] == 0
+    assert report["first_invalid"] == 3
+    assert report["trailing_bytes"] == 2
+    # isolated zero time differences are plausible by default
+    _, report = integrity.scan_dat(path)
+    assert report["zero_intervals"] == 1
+    assert report["first_invalid"] is None
+    info, report = integrity.salvage_dat(path, max_interval=1000)
+    assert report["large_intervals"] == 1
+    assert report["first_invalid"] == 2
+    assert report["last_consistent"] == 1
+    assert np.all(info["data_stream"] == [10, 20])
+
+
+@pytest.fixture(params=["compiled", "numpy"])
+def engine(request, monkeypatch):
+    if request.param == "compiled":
+        pytest.importorskip("pyscanfcs.decode_dat")
+    else:
+        monkeypatch.setattr(openfile, "decode_dat", None)
+    return request.param
+
+
+def test_zero_runs(engine):
+    data = np.array([4, 0, 5, 0, 0, 6, 0, 0, 0, 7], dtype=np.uint32)
+    assert integrity._find_invalid(data, max_zero_run=3) == (6, 0, None)
+    assert integrity._find_invalid(data, max_zero_run=2) == (6, 0, 6)
+    assert integrity._find_invalid(data, max_zero_run=1) == (6, 0, 3)
+    assert integrity._find_invalid(data, max_zero_run=0) == (6, 0, 1)
+    assert integrity._find_invalid(data, max_interval=5,
+                                   max_zero_run=2) == (6, 2, 5)
+    # runs across blocks of the NumPy implementation
+    assert integrity._find_invalid(data, max_zero_run=2,
+                                   chunk_size=3) == (6, 0, 6)
+
+
+def test_salvage_time_window():
+    path = str(here / "data/n2000_7.0ms_32bit.dat")
+    with pytest.raises(ValueError, match="salvage"):
+        openfile.openDAT(path, salvage=True, t_start=0.1)
+
+
+def test_8bit(tmp_path):
+    path = str(tmp_path / "eight.dat")
+    write_dat(path, 8, bytes([0x0A, 0xFF, 0x08, 0xFF]))
+    data, report = integrity.scan_dat(path)
+    assert report["ok"]
+    assert np.all(data == [11, 264])
+
+
+def test_bad_header(tmp_path):
+    path = str(tmp_path / "bad.dat")
+    write_dat(path, 12, b"\x00" * 8)
+    with pytest.raises(ValueError, match="Unknown format"):
+        integrity.scan_dat(path)
+    write_dat(path, 16, b"\x00" * 8, system_clock=0)
+    with pytest.raises(ValueError, match="system clock"):
+        integrity.scan_dat(path)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
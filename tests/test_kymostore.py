@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from pyscanfcs import kymostore
+
+
+def make_store(directory, data, **kwargs):
+    with kymostore.KymographWriter(str(directory), bins_per_line=7,
+                                   lines_per_chunk=3, bin_time=10,
+                                   line_time=70, bin_shift=2,
+                                   system_clock=60, **kwargs) as kw:
+        for piece in np.array_split(data, 5):
+            kw.append(piece)
+    return kymostore.KymographStore(str(directory))
+
+
+def test_indexing(tmp_path):
+    data = np.arange(100) % 250
+    data[50] = 1000
+    store = make_store(tmp_path / "store", data)
+    assert len(store) == 100
+    assert store.n_chunks == 5
+    assert store.n_lines == 15
+    assert store.dtype == np.uint16
+    assert store.manifest["chunks"][0]["dtype"] == "uint8"
+    assert store.line_time == 70
+    assert store.bin_shift == 2
+    assert store.max() == 1000
+    assert store[50] == 1000
+    assert store[-1] == data[-1]
+    with pytest.raises(IndexError):
+        store[100]
+    for key in [slice(None), slice(5, 40), slice(19, 23), slice(3, 97, 8),
+                slice(20, 21, 5), slice(90, 10, -7), slice(None, None, -1),
+                slice(60, 200, 13), slice(200, 300)]:
+        assert np.all(store[key] == data[key]), key
+    assert np.all(np.asarray(store) == data)
+
+
+def test_read_lines(tmp_path):
+    data = np.arange(100) % 250
+    store = make_store(tmp_path / "store", data)
+    lines = store.read_lines(2, 5)
+    assert lines.shape == (3, 7)
+    assert np.all(lines.reshape(-1) == data[14:35])
+    # incomplete last line is padded
+    lines = store.read_lines(13, 16)
+    assert np.all(lines.reshape(-1)[:9] == data[91:])
+    assert np.all(lines.reshape(-1)[9:] == 0)
+
+
+def test_from_file(tmp_path):
+    data = np.arange(1000, dtype=np.uint16)
+    path = tmp_path / "binned.int"
+    data.tofile(str(path))
+    store = kymostore.from_file(str(path), str(tmp_path / "store"),
+                                chunk_size=64, bins_per_line=10,
+                                lines_per_chunk=25)
+    assert store.n_chunks == 4
+    assert np.all(store[:] == data)
+    assert store.bin_time is None
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,75 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+from pyscanfcs import binning, multistream, openfile
+
+
+def split_data(tmp_path, nfiles=3):
+    """Split the test data into `nfiles` consecutive 32 bit files"""
+    here = pathlib.Path(__file__).parent
+    path = str(here / "data/n2000_7.0ms_32bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    paths = []
+    for ii, part in enumerate(np.array_split(data, nfiles)):
+        path = tmp_path / "run_{:03d}A.dat".format(ii + 1)
+        with open(path, "wb") as fd:
+            fd.write(np.array([32, 60], dtype=np.uint8).tobytes())
+            part.astype("<u4").tofile(fd)
+        paths.append(str(path))
+    return data, paths
+
+
+def test_find_split_files(tmp_path):
+    _, paths = split_data(tmp_path)
+    assert multistream.find_split_files(paths[0]) == paths
+    assert multistream.find_split_files(paths[1]) == paths[1:]
+    assert multistream.find_split_files(str(tmp_path / "a.dat")) == \
+        [str(tmp_path / "a.dat")]
+
+
+def test_slicing(tmp_path):
+    data, paths = split_data(tmp_path)
+    stream = multistream.ConcatenatedStream(paths, mmap=True)
+    assert len(stream) == data.size
+    assert stream.system_clock == 60
+    assert np.all(stream[:] == data)
+    n1 = stream.offsets[1]
+    for key in [slice(None, 1000), slice(n1 - 10, n1 + 10),
+                slice(5, -5, 3), slice(-100, None), slice(None, None, -1),
+                slice(250, 50, -3), slice(n1 + 10, n1 - 10, -1),
+                slice(10, 20, -1)]:
+        assert np.array_equal(stream[key], data[key])
+    for key in [0, n1 - 1, n1, -1]:
+        assert stream[key] == data[key]
+    with pytest.raises(IndexError):
+        stream[data.size]
+
+
+def test_total_time_and_binning(tmp_path):
+    data, paths = split_data(tmp_path)
+    stream = multistream.ConcatenatedStream(paths)
+    assert stream.total_time() == np.sum(data, dtype=np.uint64)
+    ref = binning.bin_photon_events(data, t_bin=60000.)
+    binf = binning.bin_photon_events(stream, t_bin=60000.)
+    assert np.all(np.fromfile(binf, dtype="uint16")
+                  == np.fromfile(ref, dtype="uint16"))
+
+
+def test_tofile(tmp_path):
+    data, paths = split_data(tmp_path)
+    stream = multistream.ConcatenatedStream(paths)
+    with open(tmp_path / "all.dat", "wb") as fd:
+        fd.write(np.array([32, 60], dtype=np.uint8).tobytes())
+        stream.tofile(fd)
+    assert np.all(openfile.openDAT(str(tmp_path / "all.dat"))["data_stream"]
+                  == data)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
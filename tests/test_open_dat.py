@@ -1,8 +1,11 @@
 import pathlib
+import subprocess
+import sys
 
 import numpy as np
+import pytest
 
-from pyscanfcs import openfile
+from pyscanfcs import binning, checkpoint, openfile
 
 
 def test_open_dat():
@@ -19,6 +22,211 @@ def test_open_dat():
     assert np.all(info16["data_stream"][-5:] == ref)
 
 
+def write_dat16(path, data, system_clock=60):
+    """Encode photon arrival time differences in the 16 bit format"""
+    words = []
+    for d in data:
+        if d < 0xFFFF:
+            words.append(d)
+        else:
+            words += [0xFFFF, d & 0xFFFF, d >> 16]
+    with open(path, "wb") as fd:
+        fd.write(np.array([16, system_clock], dtype="<u1").tobytes())
+        fd.write(np.array(words, dtype="<u2").tobytes())
+
+
+def test_open_dat_numpy_fallback(monkeypatch):
+    here = pathlib.Path(__file__).parent
+    f16 = str(here / "data/n2000_7.0ms_16bit.dat")
+    f32 = str(here / "data/n2000_7.0ms_32bit.dat")
+    # the 32 bit format does not require decoding
+    ref = openfile.openDAT(f32)["data_stream"]
+    monkeypatch.setattr(openfile, "decode_dat", None)
+    assert np.all(openfile.openDAT(f16)["data_stream"] == ref)
+    assert np.all(openfile.openDAT(f16, workers=4)["data_stream"] == ref)
+
+
+def test_iter_dat():
+    here = pathlib.Path(__file__).parent
+    ref = openfile.openDAT(str(here / "data/n2000_7.0ms_32bit.dat"))
+    for name in ["n2000_7.0ms_16bit.dat", "n2000_7.0ms_32bit.dat"]:
+        for chunk_size in [1, 7, 1000, 2**20]:
+            blocks = list(openfile.iterDAT(str(here / "data" / name),
+                                           chunk_size=chunk_size))
+            assert np.all([b.size == chunk_size for b in blocks[:-1]])
+            assert 0 < blocks[-1].size <= chunk_size
+            assert np.all(np.concatenate(blocks) == ref["data_stream"])
+
+
+def test_iter_dat_escape_boundaries(tmp_path):
+    # escapes at all possible block boundaries, including 0xFFFF payload
+    data = np.array([3, 70000, 0x1FFFF, 0xFFFF, 5, 0xFFFFFFFF, 0xFFFF0001,
+                     1, 0x10000, 2] * 5, dtype=np.uint32)
+    path = tmp_path / "escapes.dat"
+    write_dat16(path, data)
+    assert np.all(openfile.openDAT(str(path))["data_stream"] == data)
+    for chunk_size in range(1, 12):
+        blocks = list(openfile.iterDAT(str(path), chunk_size=chunk_size))
+        assert np.all(np.concatenate(blocks) == data)
+
+
+def test_iter_dat_truncated(tmp_path):
+    path = tmp_path / "truncated.dat"
+    write_dat16(path, [1, 2, 70000])
+    # cut the last word of the escape sequence
+    with open(path, "rb+") as fd:
+        fd.truncate(path.stat().st_size - 2)
+    with pytest.raises(ValueError, match="Truncated"):
+        list(openfile.iterDAT(str(path), chunk_size=2))
+    with pytest.raises(ValueError, match="Truncated"):
+        openfile.openDAT(str(path))
+
+
+def test_open_dat_8bit(tmp_path):
+    # example from the Flex manual: 0A 0B FF 08 (with trailing overflow)
+    path = tmp_path / "example8.dat"
+    path.write_bytes(bytes([8, 60, 0x0A, 0x0B, 0xFF, 0x08, 0xFF]))
+    info = openfile.openDAT(str(path))
+    assert info["system_clock"] == 60
+    assert np.all(info["data_stream"] == [0x0A + 1, 0x0B + 1, 0xFF + 8 + 1])
+    assert openfile.probeDAT(str(path))["n_events"] == 3
+    words = np.frombuffer(path.read_bytes()[2:] * 5, dtype=np.uint8)
+    assert openfile._count_8bit(words, block_size=3) == 15
+
+
+def test_iter_dat_8bit(tmp_path):
+    rs = np.random.RandomState(47)
+    data = rs.randint(1, 2000, size=500)
+    # encode: (data - 1) = 255 * overflows + byte
+    raw = []
+    for d in data:
+        raw += [0xFF] * ((d - 1) // 255) + [(d - 1) % 255]
+    path = tmp_path / "random8.dat"
+    path.write_bytes(bytes([8, 60] + raw))
+    assert np.all(openfile.openDAT(str(path))["data_stream"] == data)
+    for chunk_size in [1, 3, 64, 1000]:
+        blocks = list(openfile.iterDAT(str(path), chunk_size=chunk_size))
+        assert np.all([b.size == chunk_size for b in blocks[:-1]])
+        assert np.all(np.concatenate(blocks) == data)
+
+
+def test_probe_dat(tmp_path, monkeypatch):
+    here = pathlib.Path(__file__).parent
+    data = np.array([3, 70000, 0x1FFFF, 0xFFFF, 5, 1], dtype=np.uint32)
+    path = tmp_path / "escapes.dat"
+    write_dat16(path, data)
+    for name in ["n2000_7.0ms_16bit.dat", "n2000_7.0ms_32bit.dat"]:
+        info = openfile.probeDAT(str(here / "data" / name))
+        assert info["system_clock"] == 60
+        assert info["n_events"] == 31417
+    info = openfile.probeDAT(str(path))
+    assert info["format"] == 16
+    assert info["n_events"] == data.size
+    assert info["total_time"] is None
+    # total time from index
+    openfile.openDAT(str(path), index=True)
+    assert openfile.probeDAT(str(path))["total_time"] == np.sum(data)
+    # NumPy fallback, also for truncated files
+    monkeypatch.setattr(openfile, "decode_dat", None)
+    assert openfile.probeDAT(str(path))["n_events"] == data.size
+    with open(path, "rb+") as fd:
+        fd.truncate(path.stat().st_size - 6)
+    assert openfile.probeDAT(str(path))["n_events"] == data.size - 3
+
+
+def test_open_dat_time_window(tmp_path):
+    here = pathlib.Path(__file__).parent
+    path = str(tmp_path / "data.dat")
+    with open(str(here / "data/n2000_7.0ms_16bit.dat"), "rb") as fd:
+        pathlib.Path(path).write_bytes(fd.read())
+    ref = openfile.openDAT(path)["data_stream"]
+    arrival = np.cumsum(ref, dtype=np.uint64)
+    windows = [(0, 1000), (arrival[100], arrival[20000]),
+               (arrival[100] + 1, arrival[20000] + 1), (12345678, None),
+               (None, 5000000), (arrival[-1] + 1, None)]
+    for with_index in [False, True]:
+        if with_index:
+            checkpoint.CheckpointIndex.build(path, every=1000).save()
+        for t_start, t_stop in windows:
+            info = openfile.openDAT(path, t_start=t_start, t_stop=t_stop,
+                                    time_unit="ticks")
+            start = 0 if t_start is None else t_start
+            stop = arrival[-1] + 1 if t_stop is None else t_stop
+            ids = np.flatnonzero((arrival >= start) & (arrival < stop))
+            data = info["data_stream"]
+            assert info["time_offset"] == start
+            assert data.size == ids.size
+            if ids.size:
+                assert data[0] == arrival[ids[0]] - start
+                assert np.all(data[1:] == ref[ids[1:]])
+    # seconds
+    info = openfile.openAny(path, t_start=0.1, t_stop=0.2)
+    assert info["time_offset"] == 6000000
+    ids = np.flatnonzero((arrival >= 6000000) & (arrival < 12000000))
+    assert np.all(info["data_stream"][1:] == ref[ids[1:]])
+
+
+def test_open_any_magic(tmp_path):
+    here = pathlib.Path(__file__).parent
+    path = tmp_path / "renamed.bin"
+    path.write_bytes((here / "data/n2000_7.0ms_16bit.dat").read_bytes())
+    assert openfile.detect_format(str(path)) == "dat"
+    info = openfile.openAny(str(path))
+    assert info["data_stream"].size == 31417
+    # FITS magic wins over the suffix
+    path = tmp_path / "kymo.dat"
+    path.write_bytes(b"SIMPLE  =                    T" + b" " * 50)
+    assert openfile.detect_format(str(path)) == "fits"
+    path = tmp_path / "unknown.xyz"
+    path.write_bytes(b"\x00\x01")
+    with pytest.raises(ValueError, match="Unknown file format"):
+        openfile.openAny(str(path))
+
+
+def test_lazy_imports():
+    # opening .dat files does not require astropy or tifffile
+    cmd = ("import sys; import pyscanfcs; "
+           "assert 'astropy' not in sys.modules; "
+           "assert 'tifffile' not in sys.modules")
+    subprocess.check_call([sys.executable, "-c", cmd],
+                          cwd=str(pathlib.Path(__file__).parent.parent))
+
+
+def test_lazy_reader(tmp_path):
+    path = tmp_path / "test.lazy"
+    path.write_bytes(b"LAZY")
+    openfile.register_format("lazy", "binned", "json:loads",
+                             magic=b"LAZY")
+    try:
+        assert openfile.detect_format(str(path)) == "lazy"
+        assert isinstance(openfile.methods_binned["lazy"],
+                          openfile.LazyReader)
+        assert openfile.methods_binned["lazy"]("[1]") == [1]
+    finally:
+        openfile.methods_binned.pop("lazy")
+        openfile._magic.pop("lazy")
+
+
+def test_open_dat_mmap():
+    here = pathlib.Path(__file__).parent
+    f16 = here / "data/n2000_7.0ms_16bit.dat"
+    f32 = here / "data/n2000_7.0ms_32bit.dat"
+    info16 = openfile.openDAT(str(f16), mmap=True)
+    info32 = openfile.openDAT(str(f32), mmap=True)
+
+    # 16 bit data must be decoded and cannot be memory-mapped
+    assert not isinstance(info16["data_stream"], np.memmap)
+    assert isinstance(info32["data_stream"], np.memmap)
+    assert not info32["data_stream"].flags.writeable
+    assert info32["system_clock"] == 60
+    assert np.all(info16["data_stream"] == info32["data_stream"])
+    # downstream consumers work with the memory map
+    binf = binning.bin_photon_events(info32["data_stream"], t_bin=60000)
+    binf_ref = binning.bin_photon_events(info16["data_stream"], t_bin=60000)
+    assert np.all(np.fromfile(binf, dtype="uint16")
+                  == np.fromfile(binf_ref, dtype="uint16"))
+
+
 if __name__ == "__main__":
     # Run all tests
     loc = locals()
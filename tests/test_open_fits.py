@@ -0,0 +1,55 @@
+import mmap
+
+import astropy.io.fits
+import numpy as np
+
+from pyscanfcs import openfile
+
+
+def write_fits(path, data, **cards):
+    hdu = astropy.io.fits.PrimaryHDU(data)
+    for key, value in cards.items():
+        hdu.header[key] = value
+    hdu.writeto(path)
+
+
+def test_memmap(tmp_path):
+    data = np.arange(5 * 7, dtype=np.uint8).reshape(5, 7)
+    path = str(tmp_path / "kymo.fits")
+    write_fits(path, data, SysClck=60, Tcycle=700, Tbin=100, Binshift=2)
+    info = openfile.openAny(path)
+    assert info["bins_per_line"] == 7
+    assert info["size"] == 35
+    assert info["line_time"] == 700
+    assert info["bin_time"] == 100
+    assert info["bin_shift"] == 2
+    assert info["total_time"] is None
+    intdata = info["data_binned"].reshape(info["size"])
+    # memory-mapped view, not a copy
+    assert not intdata.flags.owndata
+    assert np.shares_memory(intdata, info["data_binned"])
+    base = intdata
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, mmap.mmap)
+    assert np.all(intdata == np.arange(35))
+
+
+def test_scaled(tmp_path):
+    # astropy stores unsigned 16 bit integers with BZERO
+    data = np.arange(4 * 3, dtype=np.uint16).reshape(4, 3) + 40000
+    path = str(tmp_path / "kymo16.fits")
+    write_fits(path, data, SysClck=60, Tline=300, Tbin=100, Total=1200)
+    info = openfile.openFITS(path)
+    assert info["line_time"] == 300
+    assert info["total_time"] == 1200
+    assert info["bin_shift"] is None
+    assert np.all(info["data_binned"].reshape(-1) == np.arange(12) + 40000)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
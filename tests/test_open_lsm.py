@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import tifffile
+
+from pyscanfcs import openfile
+
+
+def make_tiff(path, **kwargs):
+    data = np.arange(3 * 50 * 7, dtype=np.uint16).reshape(3, 50, 7)
+    tifffile.imwrite(path, data, planarconfig="separate",
+                     photometric="minisblack", rowsperstrip=8,
+                     **kwargs)
+    return data
+
+
+def read_channels(path, channels):
+    with tifffile.TiffFile(path) as tif:
+        return openfile._read_tiff_channels(tif, tif.pages[0], channels)
+
+
+@pytest.fixture
+def lsm_metadata(monkeypatch):
+    """LSM metadata for all TIFF pages (tifffile cannot write LSM)"""
+    monkeypatch.setattr(tifffile.TiffPage, "cz_lsm_scan_information",
+                        {"tracks": [{"pixel_time": 2.5}]}, raising=False)
+    monkeypatch.setattr(tifffile.TiffPage, "cz_lsm_time_stamps",
+                        np.array([10.0, 10.001, 10.05]), raising=False)
+
+
+def test_open_lsm(tmp_path, lsm_metadata):
+    path = str(tmp_path / "scan.lsm")
+    data = make_tiff(path)
+    info = openfile.openLSM(path)
+    assert info["type"] == "binned"
+    assert info["n_channels"] == 3
+    assert np.all(info["data_binned"] == data[0])
+    assert "data_binned_channels" not in info
+    assert info["bin_time"] == 2.5
+    assert np.allclose(info["line_time"], 1000)
+    assert np.allclose(info["total_time"], 50000)
+    assert info["bins_per_line"] == 7
+    assert info["size"] == 350
+    # single channel
+    info = openfile.openLSM(path, channel=2)
+    assert np.all(info["data_binned"] == data[2])
+    # selected channels
+    info = openfile.openLSM(path, channel=1, channels=[2, 1])
+    assert np.all(info["data_binned"] == data[1])
+    assert len(info["data_binned_channels"]) == 2
+    assert np.all(info["data_binned_channels"][0] == data[2])
+    assert np.all(info["data_binned_channels"][1] == data[1])
+    # all channels
+    info = openfile.openLSM(path, channels="all")
+    assert len(info["data_binned_channels"]) == 3
+    for ch in range(3):
+        assert np.all(info["data_binned_channels"][ch] == data[ch])
+    with pytest.raises(IndexError, match="Channel 3"):
+        openfile.openLSM(path, channel=3)
+
+
+def test_detect_lsm(tmp_path):
+    data = np.zeros((10, 7), dtype=np.uint8)
+    for byteorder in "<>":
+        path = str(tmp_path / "img.tif")
+        tifffile.imwrite(path, data, byteorder=byteorder)
+        assert openfile.detect_format(path) is None
+        with pytest.raises(ValueError, match="Unknown file format"):
+            openfile.openAny(path)
+        # CZ_LSMINFO tag
+        path = str(tmp_path / "scan.bin")
+        tifffile.imwrite(path, data, byteorder=byteorder,
+                         extratags=[(34412, "B", 4, b"\x00" * 4, False)])
+        assert openfile.detect_format(path) == "lsm"
+
+
+def test_channels_memmap(tmp_path):
+    path = str(tmp_path / "plain.tif")
+    data = make_tiff(path)
+    ch2, ch0 = read_channels(path, [2, 0])
+    assert isinstance(ch2, np.memmap)
+    assert np.all(ch2 == data[2])
+    assert np.all(ch0 == data[0])
+
+
+def test_channels_compressed(tmp_path):
+    path = str(tmp_path / "zlib.tif")
+    data = make_tiff(path, compression="zlib")
+    ch1, = read_channels(path, [1])
+    assert np.all(ch1 == data[1])
+    ch0, ch2 = read_channels(path, [0, 2])
+    assert np.all(ch0 == data[0])
+    assert np.all(ch2 == data[2])
+
+
+def test_channels_interleaved(tmp_path):
+    path = str(tmp_path / "rgb.tif")
+    data = np.arange(20 * 6 * 3, dtype=np.uint8).reshape(20, 6, 3)
+    tifffile.imwrite(path, data, planarconfig="contig",
+                     photometric="rgb")
+    ch1, = read_channels(path, [1])
+    assert np.all(ch1 == data[..., 1])
+    path = str(tmp_path / "rgb_zlib.tif")
+    tifffile.imwrite(path, data, planarconfig="contig",
+                     photometric="rgb", compression="zlib")
+    ch0, ch2 = read_channels(path, [0, 2])
+    assert np.all(ch0 == data[..., 0])
+    assert np.all(ch2 == data[..., 2])
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
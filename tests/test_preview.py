@@ -0,0 +1,113 @@
+import pathlib
+
+import numpy as np
+
+from pyscanfcs import checkpoint, multistream, openfile, preview
+
+
+here = pathlib.Path(__file__).parent
+
+
+def reference(data, t_bin, binshift):
+    arrival = np.cumsum(data, dtype=np.uint64)
+    bins = np.floor(arrival / t_bin).astype(np.int64) + binshift
+    return np.bincount(bins)
+
+
+def check_windows(data, binned, lines, t_bin, bpl, binshift):
+    ref = reference(data, t_bin, binshift)
+    pos = 0
+    for first, nlines in lines:
+        part = binned[pos:pos + nlines * bpl]
+        assert np.all(part == ref[first * bpl:(first + nlines) * bpl])
+        pos += nlines * bpl
+    assert pos == binned.size
+
+
+def test_windows_events():
+    rs = np.random.RandomState(42)
+    data = rs.randint(1, 200, size=100000).astype(np.uint32)
+    binned, lines = preview.bin_windows(data, t_bin=50.5, bins_per_line=20,
+                                        n_events=5000, n_windows=5,
+                                        binshift=3)
+    assert len(lines) == 5
+    # windows spread over the measurement
+    total_lines = np.sum(data, dtype=np.uint64) / 50.5 / 20
+    assert lines[0][0] <= 1
+    assert lines[-1][0] > 0.75 * total_lines
+    check_windows(data, binned, lines, 50.5, 20, 3)
+
+
+def test_windows_index():
+    path = str(here / "data/n2000_7.0ms_16bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    index = checkpoint.CheckpointIndex.build(path, data=data, every=1000)
+    t_bin = 100.
+    binned, lines = preview.bin_windows(data, t_bin=t_bin, bins_per_line=50,
+                                        n_events=3000, n_windows=4,
+                                        index=index)
+    assert len(lines) == 4
+    check_windows(data, binned, lines, t_bin, 50, 0)
+    # windows are spread in time
+    total_lines = index.total_time / t_bin / 50
+    for k, (first, _) in enumerate(lines):
+        assert abs(first - k * total_lines / 4) < 0.01 * total_lines
+
+
+def test_windows_all_events():
+    rs = np.random.RandomState(1)
+    data = rs.randint(1, 50, size=1000).astype(np.uint32)
+    # more events requested than available
+    binned, lines = preview.bin_windows(data, t_bin=10, bins_per_line=7,
+                                        n_events=5000, n_windows=3)
+    check_windows(data, binned, lines, 10, 7, 0)
+    assert sum(nl for _, nl in lines) > 0
+
+
+def test_windows_few_events():
+    data = np.array([30, 5, 12], dtype=np.uint32)
+    # fewer events than windows: prefix preview
+    binned, lines = preview.bin_windows(data, t_bin=10, bins_per_line=2,
+                                        n_events=5, n_windows=10)
+    assert len(lines) == 1
+    check_windows(data, binned, lines, 10, 2, 0)
+    binned, lines = preview.bin_windows(data[:0], t_bin=10, bins_per_line=2,
+                                        n_events=2000, n_windows=10)
+    assert binned.size == 0
+    assert lines == []
+
+
+def test_windows_concatenated(tmp_path):
+    path = str(here / "data/n2000_7.0ms_32bit.dat")
+    data = openfile.openDAT(path)["data_stream"]
+    paths = []
+    for ii, part in enumerate(np.array_split(data, 6)):
+        path = str(tmp_path / "run_{:03d}A.dat".format(ii + 1))
+        with open(path, "wb") as fd:
+            fd.write(np.array([32, 60], dtype=np.uint8).tobytes())
+            part.astype("<u4").tofile(fd)
+        checkpoint.CheckpointIndex.build(path, every=1000).save()
+        paths.append(path)
+    stream = multistream.ConcatenatedStream(paths)
+    decoded = []
+    get_file_data = stream.get_file_data
+
+    def get_file_data_logged(index):
+        decoded.append(index)
+        return get_file_data(index)
+
+    stream.get_file_data = get_file_data_logged
+    binned, lines = preview.bin_windows(stream, t_bin=100., bins_per_line=50,
+                                        n_events=2000, n_windows=2)
+    assert len(lines) == 2
+    check_windows(data, binned, lines, 100., 50, 0)
+    # start times of the files from the checkpoint indices
+    assert sorted(set(decoded)) == [0, 2, 3]
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
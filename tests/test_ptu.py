@@ -0,0 +1,152 @@
+import struct
+
+import numpy as np
+import pytest
+
+from pyscanfcs import openfile, ptu
+
+
+def write_ptu(path, records, rectype, resolution, n_records=True):
+    """Write a minimal PicoQuant .ptu file"""
+    def tag(name, typ, value, idx=-1):
+        return struct.pack("<32siIq", name.encode("ascii"), idx, typ, value)
+
+    res = struct.unpack("<q", struct.pack("<d", resolution))[0]
+    comment = b"synthetic\x00\x00\x00\x00\x00\x00\x00"
+    header = [ptu.MAGIC, b"1.0.00\x00\x00",
+              tag("File_Comment", ptu._TY_ANSISTRING, len(comment))
+              + comment,
+              tag("TTResultFormat_TTTRRecType", ptu._TY_INT8, rectype),
+              tag("MeasDesc_GlobalResolution", ptu._TY_FLOAT8, res),
+              tag("HW_InpChanOffs", ptu._TY_INT8, 0, idx=1),
+              ]
+    if n_records:
+        header.append(tag("TTResult_NumberOfRecords", ptu._TY_INT8,
+                          len(records)))
+    header.append(tag("Header_End", ptu._TY_EMPTY8, 0))
+    with open(path, "wb") as fd:
+        fd.write(b"".join(header))
+        np.asarray(records, dtype="<u4").tofile(fd)
+
+
+def generic_t2(times, channels):
+    """Records (with overflows) of the generic T2 format"""
+    records = []
+    wrap = 33554432
+    nwrap = 0
+    for time, channel in zip(times, channels):
+        if time // wrap > nwrap:
+            records.append((1 << 31) | (0x3F << 25) | (time // wrap - nwrap))
+            nwrap = time // wrap
+        records.append((channel << 25) | (time % wrap))
+    return np.array(records, dtype=np.uint32)
+
+
+def test_generic_t2(tmp_path):
+    rs = np.random.RandomState(42)
+    times = np.cumsum(rs.randint(1, 10**8, size=2000)).astype(np.int64)
+    channels = rs.randint(0, 2, size=times.size)
+    path = str(tmp_path / "t2.ptu")
+    # MultiHarp T2 with 5 ps resolution
+    write_ptu(path, generic_t2(times, channels), 0x00010207, 5e-12)
+    info = openfile.openAny(path)
+    assert info["system_clock"] == 1000
+    assert info["header"]["File_Comment"] == "synthetic"
+    assert info["header"]["HW_InpChanOffs(1)"] == 0
+    assert np.all(np.cumsum(info["data_stream"]) == times // 200)
+    # single channel
+    info = openfile.openAny(path, channel=1)
+    ref = times[channels == 1] // 200
+    assert np.all(np.cumsum(info["data_stream"]) == ref)
+    # chunked decoding
+    blocks = list(ptu.iterPTU(path, channel=1, chunk_size=100))
+    assert all(b.size == 100 for b in blocks[:-1])
+    assert np.all(np.concatenate(blocks) == info["data_stream"])
+
+
+def test_time_window(tmp_path):
+    rs = np.random.RandomState(7)
+    times = np.cumsum(rs.randint(1, 10**6, size=3000)).astype(np.int64)
+    channels = rs.randint(0, 2, size=times.size)
+    path = str(tmp_path / "t2.ptu")
+    write_ptu(path, generic_t2(times, channels), 0x00010207, 5e-12)
+    arrival = times[channels == 1] // 200
+    t_start, t_stop = int(arrival[100]) - 3, int(arrival[900])
+    info = openfile.openAny(path, channel=1, t_start=t_start,
+                            t_stop=t_stop, time_unit="ticks")
+    assert info["time_offset"] == t_start
+    data = info["data_stream"]
+    assert data.size == 800
+    assert data[0] == 3
+    assert np.all(np.cumsum(data) + t_start == arrival[100:900])
+    # seconds (system clock 1000 MHz)
+    info = openfile.openAny(path, channel=1, t_stop=t_stop / 1e9)
+    assert np.all(np.cumsum(info["data_stream"]) == arrival[:900])
+    info = openfile.openAny(path, mmap=True, cache=None, index=True)
+    assert info["index"] is None
+    with pytest.raises(ValueError, match="Salvage"):
+        openfile.openAny(path, salvage=True)
+
+
+def test_picoharp_t3(tmp_path):
+    # sync pulses, dtime, channel
+    nsync = np.array([10, 70000, 70001, 200000, 200000])
+    chans = np.array([1, 2, 1, 1, 2])
+    records = []
+    nwrap = 0
+    for ns, ch in zip(nsync, chans):
+        while ns // 65536 > nwrap:
+            records.append(0xF << 28)
+            nwrap += 1
+        records.append((ch << 28) | (123 << 16) | (ns % 65536))
+    # marker record (not an overflow)
+    records.insert(2, (0xF << 28) | (1 << 16) | 5)
+    path = str(tmp_path / "t3.ptu")
+    # 40 MHz sync rate
+    write_ptu(path, records, 0x00010303, 25e-9, n_records=False)
+    info = ptu.openPTU(path)
+    assert info["system_clock"] == 40
+    assert np.all(info["data_stream"] == np.diff(nsync, prepend=0))
+    info = ptu.openPTU(path, channel=[2])
+    assert np.all(info["data_stream"] == [70000, 130000])
+
+
+def test_decode_hydraharp1_t2():
+    # overflow records of HydraHarp V1 always count one overflow
+    records = np.array([(3 << 25) | 5,
+                        (1 << 31) | (0x3F << 25) | 7,
+                        (1 << 31) | (0x3F << 25),
+                        (1 << 31) | 8,  # sync
+                        (1 << 31) | (1 << 25) | 9,  # marker
+                        (4 << 25) | 6], dtype=np.uint32)
+    times, channels, overflow = ptu._decode_records(records, "T2",
+                                                    "hydraharp1")
+    assert np.all(times == [5, 2 * 33552000 + 6])
+    assert np.all(channels == [3, 4])
+    assert overflow == 2 * 33552000
+
+
+def test_overflow_32bit(tmp_path):
+    times = np.array([10, 2**33])
+    path = str(tmp_path / "long.ptu")
+    write_ptu(path, generic_t2(times, [0, 0]), 0x00010207, 1e-9)
+    with pytest.raises(ValueError, match="exceeds 32 bit"):
+        ptu.openPTU(path)
+    info = ptu.openPTU(path, max_clock=500)
+    assert info["system_clock"] == 500
+    assert np.all(info["data_stream"] == [5, 2**32 - 5])
+
+
+def test_not_ptu(tmp_path):
+    path = tmp_path / "wrong.ptu"
+    path.write_bytes(b"\x10\x3c" + b"\x00" * 100)
+    with pytest.raises(ValueError, match="Not a PicoQuant"):
+        ptu.openPTU(str(path))
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
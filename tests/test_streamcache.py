@@ -0,0 +1,99 @@
+import os
+import pathlib
+import shutil
+
+import numpy as np
+import pytest
+
+from pyscanfcs import openfile, streamcache
+
+
+def test_cache_open_dat(tmp_path):
+    here = pathlib.Path(__file__).parent
+    path = str(tmp_path / "data.dat")
+    shutil.copy(str(here / "data/n2000_7.0ms_16bit.dat"), path)
+    cache = streamcache.StreamCache(directory=str(tmp_path / "cache"))
+    assert cache.get(path) is None
+    ref = openfile.openDAT(path, cache=cache)
+    assert len(cache.entries()) == 1
+    info = openfile.openDAT(path, cache=cache)
+    assert isinstance(info["data_stream"], np.memmap)
+    assert info["system_clock"] == ref["system_clock"]
+    assert np.all(info["data_stream"] == ref["data_stream"])
+    # modified files are decoded again
+    with open(path, "ab") as fd:
+        fd.write(b"\x05\x00")
+    info = openfile.openDAT(path, cache=cache)
+    assert info["data_stream"][-1] == 5
+    assert len(cache.entries()) == 2
+
+
+def test_cache_eviction(tmp_path):
+    cache = streamcache.StreamCache(directory=str(tmp_path / "cache"),
+                                    max_size=10000)
+    paths = []
+    for ii in range(4):
+        path = str(tmp_path / "file{}.dat".format(ii))
+        with open(path, "wb") as fd:
+            fd.write(bytes([16, 60, ii, 0]))
+        paths.append(path)
+        cache.put(path, np.full(1000, ii, dtype=np.uint32), 60)
+        # make sure the access times differ
+        os.utime(cache._paths(streamcache.fingerprint(path))[0],
+                 (ii, ii))
+    # each entry has ~4kB, the limit allows two entries
+    assert len(cache.entries()) == 2
+    assert cache.get(paths[0]) is None
+    assert cache.get(paths[3])["data_stream"][0] == 3
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_cache_eviction_mapped(tmp_path):
+    cache = streamcache.StreamCache(directory=str(tmp_path / "cache"),
+                                    max_size=10000)
+    paths = []
+    for ii in range(3):
+        path = str(tmp_path / "file{}.dat".format(ii))
+        with open(path, "wb") as fd:
+            fd.write(bytes([16, 60, ii, 0]))
+        paths.append(path)
+    cache.put(paths[0], np.full(1000, 0, dtype=np.uint32), 60)
+    os.utime(cache._paths(streamcache.fingerprint(paths[0]))[0], (0, 0))
+    # memory-mapped entries are not evicted
+    data = cache.get(paths[0])["data_stream"][10:]
+    cache.put(paths[1], np.full(1000, 1, dtype=np.uint32), 60)
+    cache.put(paths[2], np.full(1000, 2, dtype=np.uint32), 60)
+    assert cache.get(paths[0]) is not None
+    assert cache.get(paths[1]) is None
+    cache.clear()
+    assert len(cache.entries()) == 1
+    assert np.all(data == 0)
+    # released memory maps can be removed
+    del data
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_cache_put_error(tmp_path, monkeypatch):
+    cache = streamcache.StreamCache(directory=str(tmp_path / "cache"))
+    path = str(tmp_path / "file.dat")
+    with open(path, "wb") as fd:
+        fd.write(bytes([16, 60, 1, 0]))
+
+    def replace(src, dst):
+        raise PermissionError("in use")
+
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.warns(UserWarning, match="in use"):
+        cache.put(path, np.arange(10, dtype=np.uint32), 60)
+    # no temporary files are left behind
+    assert os.listdir(cache.directory) == []
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()